@@ -1,9 +1,11 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-import subprocess
-import threading
-import queue
+from typing import Optional
+import json
 import logging
+import os
+
+from common.supervisor import run_supervised
 
 app = FastAPI()
 
@@ -16,84 +18,80 @@ logger = logging.getLogger(__name__)
 
 class ConvertRequest(BaseModel):
     input_dir: str
-
-def stream_output(pipe, q, output_list):
-    try:
-        for line in iter(pipe.readline, ''):
-            if line:
-                line = line.strip()
-                q.put(line)
-                output_list.append(line)
-    finally:
-        pipe.close()
-
-def log_from_queue(q, process):
-    while process.poll() is None or not q.empty():
-        try:
-            line = q.get_nowait()
-            logger.info(line)
-        except queue.Empty:
-            continue
-
+    camera: str = "OPENCV"
+    resize: bool = False
+    matcher: str = "auto"  # auto, exhaustive, sequential, vocab_tree, spatial
+    # preprocessing_params: variante images_<W>x<H> per la risoluzione di training
+    target_width: Optional[int] = None
+    target_height: Optional[int] = None
+    # Selezione frame prima di COLMAP: scarta mossi e quasi-duplicati
+    filter_frames: bool = False
+    max_frames: Optional[int] = None
+    # Coarse-to-fine: lato massimo delle immagini per la SfM (es. 1600), undistort sugli originali
+    sfm_max_size: Optional[int] = None
+    # Pose note (transforms.json o JSON stile COLMAP): solo matching + point_triangulator
+    poses_path: Optional[str] = None
+    # Registra solo le immagini nuove di input/ nella ricostruzione esistente
+    extend: bool = False
+    # Filtro dei punti sparsi (track, errore, outlier) e budget di punti per l'inizializzazione
+    filter_points: bool = False
+    max_points: Optional[int] = None
+    # Processi COLMAP paralleli per estrazione e matching (1 = un solo processo)
+    shards: int = 1
+    # image_undistorter di COLMAP al posto dell'undistort in-process
+    colmap_undistorter: bool = False
+    use_cache: bool = True  # Riusa la conversione della stessa cattura (COLMAP_CACHE_DIR)
+
+# def, non async def: FastAPI la esegue nel threadpool e la conversione bloccante non ferma l'event loop
 @app.post("/convert")
-async def run_convert(request: ConvertRequest):
-    command = f"python3 /workspace/gaussian-splatting/convert.py -s {request.input_dir}"
+def run_convert(request: ConvertRequest):
+    command = [
+        "python3", "/workspace/gaussian-splatting/convert.py",
+        "-s", request.input_dir,
+        "--camera", request.camera,
+        "--matcher", request.matcher,
+    ]
+    if request.resize:
+        command.append("--resize")
+    if request.target_width and request.target_height:
+        command.extend(["--target_width", str(request.target_width), "--target_height", str(request.target_height)])
+    if request.filter_frames:
+        command.append("--filter_frames")
+    if request.max_frames:
+        command.extend(["--max_frames", str(request.max_frames)])
+    if request.sfm_max_size:
+        command.extend(["--sfm_max_size", str(request.sfm_max_size)])
+    if request.poses_path:
+        command.extend(["--poses", request.poses_path])
+    if request.extend:
+        command.append("--extend")
+    if request.filter_points:
+        command.append("--filter_points")
+    if request.max_points:
+        command.extend(["--max_points", str(request.max_points)])
+    if request.shards > 1:
+        command.extend(["--shards", str(request.shards)])
+    if request.colmap_undistorter:
+        command.append("--colmap_undistorter")
+    if not request.use_cache:
+        command.append("--no_cache")
     logger.info(f"Starting conversion for directory: {request.input_dir}")
 
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1
-    )
-
-    stdout_queue = queue.Queue()
-    stderr_queue = queue.Queue()
-
-    stdout_lines = []
-    stderr_lines = []
-
-    # Threads for stdout
-    stdout_thread = threading.Thread(
-        target=stream_output,
-        args=(process.stdout, stdout_queue, stdout_lines)
-    )
-    stdout_logger = threading.Thread(
-        target=log_from_queue,
-        args=(stdout_queue, process)
-    )
-
-    # Threads for stderr
-    stderr_thread = threading.Thread(
-        target=stream_output,
-        args=(process.stderr, stderr_queue, stderr_lines)
-    )
-    stderr_logger = threading.Thread(
-        target=log_from_queue,
-        args=(stderr_queue, process)
-    )
-
-    # Start threads
-    stdout_thread.start()
-    stdout_logger.start()
-    stderr_thread.start()
-    stderr_logger.start()
-
-    # Wait for completion
-    process.wait()
-    stdout_thread.join()
-    stderr_thread.join()
-    stdout_logger.join()
-    stderr_logger.join()
+    process = run_supervised(command)
 
     if process.returncode != 0:
         raise HTTPException(
             status_code=500,
-            detail={"error": "Conversion failed", "stderr": "\n".join(stderr_lines)}
+            detail={"error": "Conversion failed", "stderr": "\n".join(process.stderr_tail)}
         )
 
     logger.info("Conversion completed successfully")
 
-    return {"message": "Conversion completed successfully"}
+    report = {}
+    report_path = os.path.join(request.input_dir, "conversion_report.json")
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+
+    # Tempo, CPU e picco di RSS per stage (reused = ripreso da un run precedente)
+    return {"message": "Conversion completed successfully", "stages": report.get("stages", {}), "report": report}
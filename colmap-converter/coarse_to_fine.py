@@ -0,0 +1,120 @@
+"""Coarse-to-fine SfM: reconstruct on downscaled images, undistort at full size.
+
+SIFT extraction and matching on 4K frames cost far more than the
+reconstruction needs when training runs at 1280x720 or 1920x1080.
+``downscale_images`` writes a copy of the inputs whose longest side is at
+most ``max_size`` (same file names, so images.bin still matches input/),
+and ``rescale_model`` brings the reconstructed cameras and 2D points back
+to the resolution of the images handed to ``image_undistorter``.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from common.colmap_model import (
+    Camera, read_cameras_binary, read_images_arrays, write_cameras_binary, write_images_arrays,
+)
+from pyramid import available_cores, fit_size, write_image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_FEATURES = 8192
+# Modelli con un'unica focale (params = f, cx, cy, ...); gli altri iniziano con fx, fy, cx, cy
+_SINGLE_FOCAL = {"SIMPLE_PINHOLE", "SIMPLE_RADIAL", "RADIAL", "SIMPLE_RADIAL_FISHEYE", "RADIAL_FISHEYE"}
+
+
+def _downscale(task):
+    source_file, destination_file, max_size = task
+    cv2.setNumThreads(1)
+    image = cv2.imread(source_file, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Cannot read {source_file}")
+    height, width = image.shape[:2]
+    size = fit_size(width, height, max_size, max_size)
+    if size != (width, height):
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    write_image(destination_file, image)
+
+
+def downscale_images(source_dir, destination_dir, names, max_size, workers=None):
+    """Copy ``names`` into ``destination_dir`` with the longest side <= ``max_size``."""
+    os.makedirs(destination_dir, exist_ok=True)
+    workers = workers or available_cores()
+    tasks = [(os.path.join(source_dir, name), os.path.join(destination_dir, name), max_size) for name in names]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(_downscale, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+            pass
+    elapsed = time.perf_counter() - started
+    logger.info(f"Downscaled {len(names)} images to {max_size}px in {elapsed:.1f}s with {workers} processes")
+    return {"images": len(names), "workers": workers, "seconds": elapsed}
+
+
+def rescale_camera(camera, width, height):
+    sx, sy = width / camera.width, height / camera.height
+    params = np.array(camera.params, dtype=np.float64)
+    # Convenzione COLMAP: origine nell'angolo del primo pixel, quindi basta moltiplicare
+    if camera.model in _SINGLE_FOCAL:
+        params[0] *= (sx + sy) / 2
+        params[1] *= sx
+        params[2] *= sy
+    else:
+        params[[0, 2]] *= sx
+        params[[1, 3]] *= sy
+    # Le distorsioni sono in coordinate normalizzate: restano invariate
+    return Camera(camera.id, camera.model, width, height, params), (sx, sy)
+
+
+_RESCALED_FILES = ("images.bin", "cameras.bin")
+_RESCALE_PENDING = "rescale.pending"
+
+
+def _finish_rescale(model_path):
+    """Complete or roll back an interrupted rescale, so both files come from the same run."""
+    pending = os.path.join(model_path, _RESCALE_PENDING)
+    for name in _RESCALED_FILES:
+        rescaled = os.path.join(model_path, f"{name}.rescaled")
+        if os.path.exists(pending) and os.path.exists(rescaled):
+            os.replace(rescaled, os.path.join(model_path, name))
+        elif os.path.exists(rescaled):
+            # Scritto a metà prima del marker: gli originali sono intatti
+            os.remove(rescaled)
+    if os.path.exists(pending):
+        os.remove(pending)
+
+
+def rescale_model(model_path, image_dir):
+    """Rescale cameras.bin and images.bin of ``model_path`` to the images in ``image_dir``.
+
+    points3D.bin is left as is: the 3D structure does not depend on the image size.
+    Both files are written to ``*.rescaled`` first and swapped in only once
+    both are complete (``rescale.pending``); a rerun finishes an interrupted
+    swap, and a model already at full size gets scale 1.
+    """
+    _finish_rescale(model_path)
+    cameras = read_cameras_binary(os.path.join(model_path, "cameras.bin"))
+    images = read_images_arrays(os.path.join(model_path, "images.bin"))
+
+    scales = {}
+    for camera_id, camera in list(cameras.items()):
+        # Dimensione originale da una delle immagini registrate con questa camera
+        registered = np.flatnonzero(images.camera_ids == camera_id)
+        if len(registered) == 0:
+            continue
+        index = int(registered[0])
+        height, width = cv2.imread(os.path.join(image_dir, images.names[index]), cv2.IMREAD_UNCHANGED).shape[:2]
+        cameras[camera_id], scales[camera_id] = rescale_camera(camera, width, height)
+
+    per_image = np.array([scales[camera_id] for camera_id in images.camera_ids.tolist()]).reshape(-1, 2)
+    xys = images.xys * np.repeat(per_image, np.diff(images.point_offsets), axis=0)
+    # La scala deriva da cameras.bin: i due file devono cambiare insieme, o
+    # un rescale interrotto e ripetuto scalerebbe i punti di images.bin due volte
+    write_images_arrays(images._replace(xys=xys), os.path.join(model_path, "images.bin.rescaled"))
+    write_cameras_binary(cameras, os.path.join(model_path, "cameras.bin.rescaled"))
+    open(os.path.join(model_path, _RESCALE_PENDING), "w").close()
+    _finish_rescale(model_path)
+    return {str(camera_id): list(scale) for camera_id, scale in scales.items()}
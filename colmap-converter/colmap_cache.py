@@ -0,0 +1,176 @@
+"""Content-addressed cache of COLMAP conversions.
+
+The same capture is converted once per algorithm/quality level of a
+benchmark. The cache key is the hash of the input images plus every
+converter setting that changes the output; a hit re-creates images/,
+sparse/0 and the resized pyramids in the scene with hardlinks (a copy only
+when the cache lives on another filesystem) instead of re-running SfM.
+Entries also keep distorted/database.db and the selected distorted model,
+so a restored scene can still be extended; database.db is modified in
+place by COLMAP and is therefore always copied, never linked.
+
+Entries are written to a temporary directory and renamed into place, so a
+crashed conversion never leaves a half-written entry behind. Cached files
+are shared by hardlink with every scene that used them: downstream steps
+must write new files (or replace them), never modify them in place.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+from common.depth import IMAGE_EXTENSIONS
+from common.hashing import hash_files
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+ENTRY_FILE = "entry.json"
+INPUT_INDEX = ".input_hashes.json"
+
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def natural_key(name):
+    """Sort key with the numbers compared by value: frame_2 before frame_10."""
+    return [(0, int(part), part) if part.isdigit() else (1, 0, part) for part in _DIGITS.split(name) if part]
+
+
+def input_images(input_dir):
+    """Input images in capture order (natural sort of the file names)."""
+    return sorted((
+        name for name in os.listdir(input_dir)
+        if not name.startswith(".") and name.lower().endswith(IMAGE_EXTENSIONS)
+        and os.path.isfile(os.path.join(input_dir, name))
+    ), key=natural_key)
+
+
+def input_fingerprint(input_dir, index_path=None):
+    """Hash of the names and contents of the input images."""
+    names = input_images(input_dir)
+    hashes = hash_files(input_dir, names, index_path)
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(f"{name}:{hashes[name]}\n".encode())
+    return digest.hexdigest(), len(names)
+
+
+def conversion_key(input_dir, settings, index_path=None):
+    """Hash of the input images plus the converter settings."""
+    fingerprint, count = input_fingerprint(input_dir, index_path)
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"version": CACHE_VERSION, "settings": settings}, sort_keys=True).encode())
+    digest.update(fingerprint.encode())
+    return digest.hexdigest(), count
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+        return True
+    except OSError:
+        # Filesystem diverso (EXDEV) o link non supportati: copia
+        shutil.copy2(src, dst)
+        return False
+
+
+def _link_tree(source, destination):
+    """Hardlink every file of ``source`` (a directory or a single file) into ``destination``."""
+    if os.path.isfile(source):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        return (1, 0) if _link(source, destination) else (0, 1)
+    linked = copied = 0
+    for root, _, files in os.walk(source):
+        target_root = os.path.join(destination, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            if _link(os.path.join(root, name), os.path.join(target_root, name)):
+                linked += 1
+            else:
+                copied += 1
+    return linked, copied
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class ColmapCache:
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def from_env(cls):
+        """Cache under COLMAP_CACHE_DIR, or None when it is not configured."""
+        root = os.environ.get("COLMAP_CACHE_DIR")
+        return cls(root) if root else None
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def materialize(self, key, source_path, clear=()):
+        """Recreate a cached conversion in ``source_path``; False on a miss.
+
+        ``clear`` lists folders of an earlier conversion of ``source_path``
+        that are removed even when the entry does not restore them.
+        """
+        entry = self._entry(key)
+        if not os.path.exists(os.path.join(entry, ENTRY_FILE)):
+            return False
+        started = time.perf_counter()
+        with open(os.path.join(entry, ENTRY_FILE)) as f:
+            data = json.load(f)
+        outputs, private = data["outputs"], data.get("private", [])
+        for name in {*outputs, *private, *clear}:
+            _remove(os.path.join(source_path, name))
+        linked = copied = 0
+        for name in outputs:
+            counts = _link_tree(os.path.join(entry, name), os.path.join(source_path, name))
+            linked += counts[0]
+            copied += counts[1]
+        for name in private:
+            target = os.path.join(source_path, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(os.path.join(entry, name), target)
+            copied += 1
+        elapsed = time.perf_counter() - started
+        logger.info(f"Cache hit {key[:12]}: {linked} files linked, {copied} copied in {elapsed * 1000:.0f} ms")
+        return {"linked": linked, "copied": copied, "materialize_s": elapsed, "restored": outputs + private}
+
+    def store(self, key, source_path, outputs, settings, private=()):
+        """Hardlink the conversion outputs of ``source_path`` into the cache.
+
+        ``private`` files are modified in place after a conversion (by
+        ``--extend``): they are copied into the entry and out of it.
+        """
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return False
+        os.makedirs(self.root, exist_ok=True)
+        tmp_entry = f"{entry}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        present = [name for name in outputs if os.path.exists(os.path.join(source_path, name))]
+        for name in present:
+            _link_tree(os.path.join(source_path, name), os.path.join(tmp_entry, name))
+        private = [name for name in private if os.path.isfile(os.path.join(source_path, name))]
+        for name in private:
+            os.makedirs(os.path.dirname(os.path.join(tmp_entry, name)), exist_ok=True)
+            shutil.copy2(os.path.join(source_path, name), os.path.join(tmp_entry, name))
+        with open(os.path.join(tmp_entry, ENTRY_FILE), "w") as f:
+            json.dump({"outputs": present, "private": private, "settings": settings,
+                       "created_at": time.time()}, f, indent=2)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Un'altra conversione della stessa scena è arrivata prima
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return False
+        logger.info(f"Stored conversion {key[:12]} in cache ({', '.join(present + private)})")
+        return True
@@ -9,166 +9,588 @@
 #
 
 import os
+import json
 import logging
+import time
 from argparse import ArgumentParser
 import shutil
+import struct
+
+from common.colmap_model import (
+    MODEL_FILES, model_stats, read_cameras_binary, read_images_arrays, read_points3D_colors, write_points3D_ply,
+)
+from colmap_cache import ColmapCache, INPUT_INDEX, conversion_key, input_fingerprint, input_images
+from coarse_to_fine import DEFAULT_MAX_FEATURES, downscale_images, rescale_model
+from common.hashing import file_sha1
+from extend import database_images, merge_undistorted, replace_model, write_list, write_pairs
+from frames import BLUR_RATIO, DUPLICATE_DISTANCE, filter_frames
+from known_poses import apply_intrinsics, load_poses, shared_intrinsics, write_prior_model
+from matching import (
+    STRATEGIES, choose_strategy, clear_matches, extension_matcher_command, match_pairs, matcher_command,
+    pairs_matcher_command, vocab_tree_path,
+)
+from point_filter import MAX_REPROJECTION_ERROR, MIN_TRACK_LENGTH, OUTLIER_STD_RATIO, filter_points
+from pyramid import available_cores, build_pyramid, target_dir_name
+from sharding import extract_features, match_features, write_pairs as write_pair_list
+from undistort import supported, undistort_model
+from stages import StageRunner
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # This Python script is based on the shell converter script provided in the MipNerF 360 repository.
-parser = ArgumentParser("Colmap converter (exhaustive only)")
+parser = ArgumentParser("Colmap converter")
 parser.add_argument("--no_gpu", action='store_true')
 parser.add_argument("--skip_matching", action='store_true')
 parser.add_argument("--source_path", "-s", required=True, type=str)
 parser.add_argument("--camera", default="OPENCV", type=str)
 parser.add_argument("--colmap_executable", default="", type=str)
 parser.add_argument("--resize", action="store_true")
-parser.add_argument("--magick_executable", default="", type=str)
+parser.add_argument("--magick_executable", default="", type=str)  # Non più usato: il resize è in-process
+parser.add_argument("--target_width", type=int)
+parser.add_argument("--target_height", type=int)
+parser.add_argument("--workers", type=int, help="Processi per il resize (default: core del container)")
+parser.add_argument("--no_cache", action="store_true")
+parser.add_argument("--matcher", default="auto", choices=("auto",) + STRATEGIES)
+parser.add_argument("--vocab_tree_path", default="", type=str)
+# Selezione dei frame prima di COLMAP: scarta mossi e quasi-duplicati
+parser.add_argument("--filter_frames", action="store_true")
+parser.add_argument("--max_frames", type=int, help="Numero massimo di frame (implica --filter_frames)")
+parser.add_argument("--blur_ratio", type=float, default=BLUR_RATIO)
+parser.add_argument("--duplicate_distance", type=int, default=DUPLICATE_DISTANCE)
+# Coarse-to-fine: SIFT e mapper su una copia ridotta, undistort sugli originali
+parser.add_argument("--sfm_max_size", type=int, help="Lato massimo delle immagini usate per la SfM")
+parser.add_argument("--sfm_max_features", type=int, default=DEFAULT_MAX_FEATURES)
+# Pose note (transforms.json o JSON stile COLMAP): niente mapper, solo point_triangulator
+parser.add_argument("--poses", type=str, help="File con pose e intrinseci delle immagini")
+# Estensione: registra solo le immagini nuove nella ricostruzione esistente
+parser.add_argument("--extend", action="store_true")
+# Estrazione e matching divisi in N processi COLMAP in parallelo
+parser.add_argument("--shards", type=int, default=1, help="Processi COLMAP paralleli per estrazione e matching")
+# Filtro dei punti sparsi e downsampling a voxel prima del training
+parser.add_argument("--filter_points", action="store_true")
+parser.add_argument("--min_track_length", type=int, default=MIN_TRACK_LENGTH)
+parser.add_argument("--max_reprojection_error", type=float, default=MAX_REPROJECTION_ERROR)
+parser.add_argument("--outlier_std_ratio", type=float, default=OUTLIER_STD_RATIO)
+parser.add_argument("--max_points", type=int, help="Budget di punti dopo il filtro (implica --filter_points)")
+# Undistort in-process (remap con tabelle in cache) direttamente alla risoluzione target
+parser.add_argument("--colmap_undistorter", action="store_true", help="Usa image_undistorter di COLMAP")
 args = parser.parse_args()
 
 colmap_command = '"{}"'.format(args.colmap_executable) if len(args.colmap_executable) > 0 else "colmap"
-magick_command = '"{}"'.format(args.magick_executable) if len(args.magick_executable) > 0 else "magick"
 use_gpu = 1 if not args.no_gpu else 0
+if (args.target_width is None) != (args.target_height is None):
+    parser.error("--target_width and --target_height go together")
+target = (args.target_width, args.target_height) if args.target_width else None
+if args.shards < 1:
+    parser.error("--shards must be at least 1")
+if args.extend and (args.poses or args.sfm_max_size or args.filter_frames or args.max_frames or args.skip_matching):
+    parser.error("--extend works on the full-resolution images and cannot be combined with "
+                 "--poses, --sfm_max_size, frame selection or --skip_matching")
+frame_settings = {
+    "max_frames": args.max_frames,
+    "blur_ratio": args.blur_ratio,
+    "duplicate_distance": args.duplicate_distance,
+} if (args.filter_frames or args.max_frames) else None
+sfm_settings = {
+    "max_size": args.sfm_max_size,
+    "max_features": args.sfm_max_features,
+} if args.sfm_max_size else None
+point_settings = {
+    "min_track_length": args.min_track_length,
+    "max_reprojection_error": args.max_reprojection_error,
+    "std_ratio": args.outlier_std_ratio,
+    "max_points": args.max_points,
+} if (args.filter_points or args.max_points) else None
 
 def find_best_reconstruction(sparse_path):
-    best_model = None
-    max_images = 0
-    for folder in os.listdir(sparse_path):
+    """Sub-model with most registered images, then most points, then lowest error."""
+    models = {}
+    for folder in sorted(os.listdir(sparse_path)):
         model_path = os.path.join(sparse_path, folder)
-        if os.path.isdir(model_path) and "images.bin" in os.listdir(model_path):
-            num_images = read_binary_num_images(model_path)
-            if num_images > max_images:
-                best_model = model_path
-                max_images = num_images
-    return best_model
-
-def read_binary_num_images(path):
-    try:
-        with open(os.path.join(path, "images.bin"), "rb") as f:
-            # Stima grezza del numero di immagini scorrendo il file
-            f.read(8)  # header
-            num_images = 0
-            chunk = f.read(64)
-            while chunk and len(chunk) >= 64:
-                num_images += 1
-                chunk = f.read(64)
-            return num_images
-    except Exception:
-        return 0
-
-if not args.skip_matching:
+        if os.path.isdir(model_path) and all(os.path.exists(os.path.join(model_path, name)) for name in MODEL_FILES):
+            try:
+                models[folder] = model_stats(model_path)
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning(f"Skipping unreadable model {model_path}: {e}")
+    candidates = [folder for folder, stats in models.items() if stats["registered_images"] > 0]
+    if not candidates:
+        return None, {"models": models}
+    best = max(candidates, key=lambda folder: (
+        models[folder]["registered_images"],
+        models[folder]["points"],
+        -(models[folder]["mean_reprojection_error"] or 0.0),
+    ))
+    print(f"🏆 Best model {best}: {models[best]['registered_images']} images, {models[best]['points']} points")
+    return os.path.join(sparse_path, best), {"models": models, "best": best}
+
+def ply_stage():
+    """points3D.ply ready for the scene loaders, which would otherwise build it point by point."""
+    model_dir = os.path.join(args.source_path, "sparse", "0")
+    started = time.perf_counter()
+    xyz, rgb = read_points3D_colors(os.path.join(model_dir, "points3D.bin"))
+    size = write_points3D_ply(xyz, rgb, os.path.join(model_dir, "points3D.ply"))
+    return {"ply": {"points": len(xyz), "bytes": size, "seconds": time.perf_counter() - started}}
+
+def write_report(report):
+    with open(os.path.join(args.source_path, "conversion_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+report = {}
+runner = StageRunner(args.source_path, report)
+
+input_dir = os.path.join(args.source_path, "input")
+distorted_dir = os.path.join(args.source_path, "distorted")
+database_path = os.path.join(distorted_dir, "database.db")
+image_list_path = os.path.join(distorted_dir, "image_list.txt")
+sfm_image_dir = os.path.join(distorted_dir, "sfm_images") if sfm_settings is not None else input_dir
+vocab_tree = vocab_tree_path(args.vocab_tree_path)
+index_path = os.path.join(args.source_path, INPUT_INDEX)
+poses = load_poses(args.poses, input_dir, input_images(input_dir)) if args.poses else None
+if poses is not None and not poses:
+    logging.error(f"❌ Nessuna posa di {args.poses} corrisponde alle immagini di input.")
+    raise SystemExit(1)
+
+# ♻️ Stessa cattura e stesse impostazioni già convertite: si riusa il risultato
+cache = None if (args.skip_matching or args.no_cache or args.extend) else ColmapCache.from_env()
+cache_outputs = ["images", "sparse", "images_2", "images_4", "images_8"]
+if target is not None:
+    cache_outputs.append(target_dir_name(*target))
+cache_settings = {
+    "camera": args.camera,
+    # La strategia risolta dipende solo da immagini, richiesta e vocab tree: basta la richiesta
+    "matcher": args.matcher,
+    "vocab_tree": vocab_tree is not None,
+    "frames": frame_settings,
+    "sfm": sfm_settings,
+    "poses": file_sha1(args.poses) if args.poses else None,
+    "resize": args.resize,
+    "target": list(target) if target else None,
+    "colmap_undistorter": args.colmap_undistorter,
+    "points": point_settings,
+}
+if cache is not None:
+    cache_key, num_inputs = conversion_key(input_dir, cache_settings, index_path=index_path)
+    # distorted/ di una conversione precedente non corrisponde allo sparse/0 del cache
+    hit = cache.materialize(cache_key, args.source_path, clear=["distorted"])
+    report["cache"] = {"key": cache_key, "hit": bool(hit), "images": num_inputs, **(hit or {})}
+    if hit:
+        print("♻️  Conversion restored from cache")
+        # --extend richiede database.db e il modello distorto (non in cache per il coarse-to-fine)
+        report["cache"]["extendable"] = "distorted/database.db" in hit["restored"]
+        # Gli output non vengono più dagli stage: i marker non li descrivono
+        runner.reset()
+        write_report(report)
+        raise SystemExit(0)
+
+if args.extend:
+    final_model = os.path.join(args.source_path, "sparse", "0")
+    if not (os.path.exists(database_path) and os.path.exists(os.path.join(final_model, "images.bin"))):
+        logging.error("❌ --extend richiede una conversione precedente (distorted/database.db e sparse/0).")
+        raise SystemExit(1)
+    if os.path.isdir(os.path.join(distorted_dir, "sfm_images")):
+        logging.error("❌ --extend non supporta scene convertite in coarse-to-fine.")
+        raise SystemExit(1)
+
+    registered_before = set(read_images_arrays(os.path.join(final_model, "images.bin")).names)
+    new_names = [name for name in input_images(input_dir) if name not in registered_before]
+    if not new_names:
+        print("✅ No new images to register")
+        write_report(report)
+        raise SystemExit(0)
+    print(f"➕ Extending the reconstruction with {len(new_names)} new images")
+
+    best_model_path, _ = find_best_reconstruction(os.path.join(distorted_dir, "sparse"))
+    if best_model_path is None:
+        logging.error("❌ Nessuna ricostruzione valida trovata.")
+        raise SystemExit(1)
+    extension_dir = os.path.join(distorted_dir, "extension")
+    new_list_path = os.path.join(extension_dir, "new_images.txt")
+    extension = report.setdefault("extension", {"new_images": len(new_names)})
+
+    def extend_extract_stage():
+        os.makedirs(extension_dir, exist_ok=True)
+        known = database_images(database_path)
+        to_extract = [name for name in new_names if name not in known]
+        if to_extract:
+            write_list(os.path.join(extension_dir, "extract.txt"), to_extract)
+            # Le nuove immagini condividono la camera già calibrata della ricostruzione
+            camera_id = next(iter(known.values()))[1]
+            feat_extracton_cmd = (
+                f'{colmap_command} feature_extractor '
+                f'--database_path {database_path} '
+                f'--image_path {input_dir} '
+                f'--image_list_path {extension_dir}/extract.txt '
+                f'--ImageReader.existing_camera_id {camera_id} '
+                f'--SiftExtraction.use_gpu {use_gpu}'
+            )
+            runner.command(feat_extracton_cmd, "Feature extraction")
+        extension["extracted"] = len(to_extract)
+        return {"extension": dict(extension)}
+
+    def extend_match_stage():
+        write_list(new_list_path, new_names)
+        new = set(new_names)
+        existing = [name for name in database_images(database_path) if name not in new]
+        pairs_path = os.path.join(extension_dir, "pairs.txt")
+        if vocab_tree is None:
+            extension["pairs"] = write_pairs(pairs_path, new_names, existing)
+        print(f"🔗 Matching {len(new_names)} new images against {len(existing)} existing ones")
+        runner.command(
+            extension_matcher_command(colmap_command, database_path, use_gpu, new_list_path, pairs_path, vocab_tree),
+            "Feature matching",
+        )
+        extension["matcher"] = "vocab_tree" if vocab_tree is not None else "pairs"
+        return {"extension": dict(extension)}
+
+    def extend_register_stage():
+        registered_dir = os.path.join(extension_dir, "registered")
+        if os.path.exists(registered_dir):
+            shutil.rmtree(registered_dir)
+        os.makedirs(registered_dir)
+        print("📌 Registering new images...")
+        runner.command(
+            f'{colmap_command} image_registrator '
+            f'--database_path {database_path} '
+            f'--input_path {best_model_path} '
+            f'--output_path {registered_dir}',
+            "Image registrator",
+        )
+        # Intrinseci fissi: le immagini già undistorte restano valide
+        runner.command(
+            f'{colmap_command} bundle_adjuster '
+            f'--input_path {registered_dir} '
+            f'--output_path {registered_dir} '
+            f'--BundleAdjustment.refine_focal_length 0 '
+            f'--BundleAdjustment.refine_principal_point 0 '
+            f'--BundleAdjustment.refine_extra_params 0',
+            "Bundle adjuster",
+        )
+        replace_model(registered_dir, best_model_path)
+        names = set(read_images_arrays(os.path.join(best_model_path, "images.bin")).names)
+        extension["registered"] = sorted(name for name in new_names if name in names)
+        extension["model"] = model_stats(best_model_path)
+        return {"extension": dict(extension)}
+
+    def extend_undistort_stage():
+        registered = extension["registered"]
+        if not registered:
+            return {"extension": dict(extension)}
+        print(f"📐 Undistorting {len(registered)} new images...")
+        if not args.colmap_undistorter and supported(read_cameras_binary(os.path.join(best_model_path, "cameras.bin"))):
+            # Stesse tabelle di remap della conversione: solo le nuove immagini, modello intero
+            extension["undistortion"] = undistort_model(
+                best_model_path, input_dir,
+                os.path.join(args.source_path, "images"), os.path.join(args.source_path, "sparse", "0"),
+                os.path.join(distorted_dir, "remap"), target=target, names=registered, workers=args.workers,
+            )
+            extension["undistorted"] = extension["undistortion"]["images"]
+            return {"extension": dict(extension)}
+        undistorted_dir = os.path.join(extension_dir, "undistorted")
+        if os.path.exists(undistorted_dir):
+            shutil.rmtree(undistorted_dir)
+        write_list(os.path.join(extension_dir, "registered.txt"), registered)
+        runner.command(
+            f'{colmap_command} image_undistorter '
+            f'--image_path {input_dir} '
+            f'--input_path {best_model_path} '
+            f'--output_path {undistorted_dir} '
+            f'--image_list_path {extension_dir}/registered.txt '
+            f'--output_type COLMAP',
+            "Image undistorter",
+        )
+        extension["undistorted"] = merge_undistorted(undistorted_dir, args.source_path, registered)
+        return {"extension": dict(extension)}
+
+    def extend_pyramid_stage():
+        # images/ già alla risoluzione target se l'undistort è in-process
+        pyramid_target = None if extension.get("undistortion", {}).get("target") else target
+        if not (args.resize or pyramid_target is not None) or not extension["registered"]:
+            return {}
+        print("Resizing...")
+        return {"pyramid": build_pyramid(
+            args.source_path,
+            factors=(2, 4, 8) if args.resize else (),
+            target=pyramid_target,
+            workers=args.workers,
+            names=extension["registered"],
+        )}
+
+    def extend_points_stage():
+        if point_settings is None or not extension["registered"]:
+            return {}
+        # Il modello esteso ha di nuovo tutti i punti: stesso filtro della conversione
+        print("🧹 Filtering sparse points...")
+        return {"points": {**point_settings, **filter_points(
+            best_model_path, os.path.join(args.source_path, "sparse", "0"), point_settings,
+        )}}
+
+    extension_stages = (
+        ("extend_extract", {"new": new_names, "vocab_tree": vocab_tree}, extend_extract_stage),
+        ("extend_match", {}, extend_match_stage),
+        ("extend_register", {}, extend_register_stage),
+        ("extend_undistort", {"target": target, "colmap": args.colmap_undistorter}, extend_undistort_stage),
+        ("extend_pyramid", {"resize": args.resize, "target": target}, extend_pyramid_stage),
+        ("extend_points", point_settings, extend_points_stage),
+        # sparse/0 è stato sostituito: il .ply va rigenerato
+        ("extend_ply", {}, lambda: ply_stage() if extension["registered"] else {}),
+    )
+    for name, inputs, func in extension_stages:
+        runner.run(name, inputs, func)
+        # Uno stage ripreso dal marker riporta il suo "extension": serve agli stage successivi
+        extension.update(report.get("extension", {}))
+        report["extension"] = extension
+    print(f"✅ Registered {len(report['extension']['registered'])}/{len(new_names)} new images")
+    write_report(report)
+    raise SystemExit(0)
+
+def sfm_names():
+    """Images given to COLMAP: the selected/posed frames, or every input image."""
+    if frame_settings is None and poses is None:
+        return input_images(input_dir)
+    with open(image_list_path) as f:
+        return [line.strip() for line in f if line.strip()]
 
+def extract_stage():
     # Pulisce eventuali risultati precedenti
-    folders_to_remove = [
-        os.path.join(args.source_path, "distorted"),
-        os.path.join(args.source_path, "images"),
-        os.path.join(args.source_path, "sparse"),
-        os.path.join(args.source_path, "output"),
-        os.path.join(args.source_path, "stereo"),
-    ]
-    for folder in folders_to_remove:
-        if os.path.exists(folder):
-            shutil.rmtree(folder)
-
-    os.makedirs(os.path.join(args.source_path, "distorted", "sparse"), exist_ok=True)
-
-    # Feature extraction
-    feat_extracton_cmd = (
-        f'{colmap_command} feature_extractor '
-        f'--database_path {args.source_path}/distorted/database.db '
-        f'--image_path {args.source_path}/input '
-        f'--ImageReader.single_camera 1 '
+    for folder in ("distorted", "images", "sparse", "output", "stereo"):
+        if os.path.exists(os.path.join(args.source_path, folder)):
+            shutil.rmtree(os.path.join(args.source_path, folder))
+    os.makedirs(distorted_dir)
+    entries = {}
+
+    # Selezione dei frame: solo quelli tenuti arrivano a feature extraction e matching
+    names = input_images(input_dir)
+    image_list_arg = ""
+    if poses is not None:
+        # Con pose note si usano solo le immagini che ne hanno una
+        names = [name for name in names if name in poses]
+    if frame_settings is not None:
+        print("🎞️  Selecting frames...")
+        names, entries["frames"] = filter_frames(
+            input_dir, names, args.max_frames, args.blur_ratio, args.duplicate_distance, args.workers,
+        )
+    if frame_settings is not None or poses is not None:
+        with open(image_list_path, "w") as f:
+            f.write("\n".join(names) + "\n")
+        image_list_arg = f'--image_list_path {image_list_path} '
+
+    # Coarse-to-fine: la SfM lavora su una copia ridotta con gli stessi nomi file
+    sift_args = ""
+    if sfm_settings is not None:
+        print(f"🔽 Downscaling SfM images to {args.sfm_max_size}px...")
+        entries["coarse_to_fine"] = {
+            **sfm_settings,
+            "downscale": downscale_images(input_dir, sfm_image_dir, names, args.sfm_max_size, args.workers),
+        }
+        sift_args = (
+            f'--SiftExtraction.max_image_size {args.sfm_max_size} '
+            f'--SiftExtraction.max_num_features {args.sfm_max_features} '
+        )
+
+    single_camera = poses is None or shared_intrinsics(poses)
+    extractor_args = (
+        f'--image_path {sfm_image_dir} '
+        f'--ImageReader.single_camera {int(single_camera)} '
         f'--ImageReader.camera_model {args.camera} '
+        f'{sift_args}'
         f'--SiftExtraction.use_gpu {use_gpu}'
     )
-    exit_code = os.system(feat_extracton_cmd)
-    if exit_code != 0:
-        logging.error(f"Feature extraction failed with code {exit_code}. Exiting.")
-        raise SystemExit(exit_code)
-
-    # 🔒 Matching: sempre e solo EXHAUSTIVE
-    feat_matching_cmd = (
-        f'{colmap_command} exhaustive_matcher '
-        f'--database_path {args.source_path}/distorted/database.db '
-        f'--SiftMatching.use_gpu {use_gpu}'
-    )
-    exit_code = os.system(feat_matching_cmd)
-    if exit_code != 0:
-        logging.error(f"Feature matching failed with code {exit_code}. Exiting.")
-        raise SystemExit(exit_code)
+    if args.shards > 1:
+        entries["sharding"] = {"extraction": extract_features(
+            runner, colmap_command, extractor_args, database_path, names, args.shards,
+            args.workers or available_cores(), single_camera,
+        )}
+    else:
+        feat_extracton_cmd = (
+            f'{colmap_command} feature_extractor '
+            f'--database_path {database_path} '
+            f'{image_list_arg}'
+            f'{extractor_args}'
+        )
+        runner.command(feat_extracton_cmd, "Feature extraction")
+    if poses is not None:
+        # Intrinseci noti al posto di quelli stimati da EXIF
+        entries["known_poses"] = {"poses": len(poses), "cameras": apply_intrinsics(database_path, poses)}
+    return entries
+
+def match_stage():
+    # Strategia di matching sul numero di immagini effettivamente usate
+    names = sfm_names()
+    matcher, matcher_reason = choose_strategy(input_dir, names, args.matcher, vocab_tree)
+    # Matching: exhaustive solo dove conviene, altrimenti sequential / vocab tree / spatial
+    print(f"🔗 Matching with {matcher} ({matcher_reason})")
+    clear_matches(database_path)
+    started = time.perf_counter()
+    entries = {}
+    # Shard solo con coppie esplicite: vocab_tree e spatial scelgono i vicini durante il matching
+    pairs = match_pairs(matcher, names) if args.shards > 1 else None
+    # sequential_matcher ordina per nome: con numeri di frame senza zeri iniziali frame_10 viene prima di frame_2
+    explicit_order = not pairs and matcher == "sequential" and names != sorted(names)
+    if explicit_order:
+        logging.warning("Frame names are not zero-padded: sequential pairs in capture order, without loop detection")
+        pairs_path = os.path.join(distorted_dir, "sequential_pairs.txt")
+        write_pair_list(pairs_path, match_pairs(matcher, names))
+        runner.command(pairs_matcher_command(colmap_command, database_path, use_gpu, pairs_path), "Feature matching")
+    elif pairs:
+        if matcher == "sequential" and vocab_tree is not None:
+            logging.warning("Sharded sequential matching runs without loop detection")
+        # L'estrazione ha già messo il suo report in "sharding"
+        entries["sharding"] = {**report.get("sharding", {}), "matching": match_features(
+            runner, colmap_command, database_path, pairs, args.shards, args.workers or available_cores(), use_gpu,
+        )}
+    else:
+        feat_matching_cmd = matcher_command(
+            colmap_command, matcher, database_path, use_gpu,
+            vocab_tree if matcher in ("sequential", "vocab_tree") else None,
+        )
+        runner.command(feat_matching_cmd, "Feature matching")
+    entries["matching"] = {
+        "strategy": matcher,
+        "requested": args.matcher,
+        "reason": matcher_reason,
+        "images": len(names),
+        "loop_detection": matcher == "sequential" and vocab_tree is not None and not pairs and not explicit_order,
+        "explicit_pairs": explicit_order,
+        "shards": len(entries["sharding"]["matching"]["shards"]) if pairs else 1,
+        "seconds": time.perf_counter() - started,
+    }
+    return entries
 
+def map_stage():
+    sparse_dir = os.path.join(distorted_dir, "sparse")
+    if os.path.exists(sparse_dir):
+        shutil.rmtree(sparse_dir)
+    os.makedirs(sparse_dir)
+    if poses is not None:
+        # Pose note: modello senza punti con gli id del database, poi sola triangolazione
+        prior_dir = os.path.join(distorted_dir, "known_poses")
+        registered = write_prior_model(database_path, poses, prior_dir)
+        os.makedirs(os.path.join(sparse_dir, "0"))
+        triangulator_cmd = (
+            f'{colmap_command} point_triangulator '
+            f'--database_path {database_path} '
+            f'--image_path {sfm_image_dir} '
+            f'--input_path {prior_dir} '
+            f'--output_path {sparse_dir}/0'
+        )
+        print(f"📍 Triangulating points for {registered} posed images...")
+        runner.command(triangulator_cmd, "Point triangulator")
+        return
     # Mapper / bundle adjustment
     mapper_cmd = (
         f'{colmap_command} mapper '
-        f'--database_path {args.source_path}/distorted/database.db '
-        f'--image_path {args.source_path}/input '
-        f'--output_path {args.source_path}/distorted/sparse '
+        f'--database_path {database_path} '
+        f'--image_path {sfm_image_dir} '
+        f'--output_path {sparse_dir} '
         f'--Mapper.ba_global_function_tolerance=0.000001'
     )
     print("🗺️  Starting bundle adjustment...")
-    exit_code = os.system(mapper_cmd)
-    if exit_code != 0:
-        logging.error(f"Mapper failed with code {exit_code}. Exiting.")
-        raise SystemExit(exit_code)
-
-# Seleziona il miglior modello ricostruito
-sparse_base = os.path.join(args.source_path, "distorted", "sparse")
-best_model_path = find_best_reconstruction(sparse_base)
-if best_model_path is None:
-    logging.error("❌ Nessuna ricostruzione valida trovata.")
-    raise SystemExit(1)
+    runner.command(mapper_cmd, "Mapper")
 
-# Undistort
-print("📐 Undistorting images...")
-img_undist_cmd = (
-    f'{colmap_command} image_undistorter '
-    f'--image_path {args.source_path}/input '
-    f'--input_path {best_model_path} '
-    f'--output_path {args.source_path} '
-    f'--output_type COLMAP'
-)
-exit_code = os.system(img_undist_cmd)
-if exit_code != 0:
-    logging.error(f"Image undistorter failed with code {exit_code}. Exiting.")
-    raise SystemExit(exit_code)
-
-# Colmap si aspetta i files in sparse/0
-files = os.listdir(os.path.join(args.source_path, "sparse"))
-os.makedirs(os.path.join(args.source_path, "sparse", "0"), exist_ok=True)
-for file in files:
-    if file == '0':
-        continue
-    source_file = os.path.join(args.source_path, "sparse", file)
-    destination_file = os.path.join(args.source_path, "sparse", "0", file)
-    shutil.move(source_file, destination_file)
-
-# Resize opzionale
-if args.resize:
-    print("Copying and resizing...")
-
-    os.makedirs(os.path.join(args.source_path, "images_2"), exist_ok=True)
-    os.makedirs(os.path.join(args.source_path, "images_4"), exist_ok=True)
-    os.makedirs(os.path.join(args.source_path, "images_8"), exist_ok=True)
-
-    files = os.listdir(os.path.join(args.source_path, "images"))
+def select_stage():
+    # Seleziona il miglior modello ricostruito
+    best_model_path, reconstruction = find_best_reconstruction(os.path.join(distorted_dir, "sparse"))
+    if best_model_path is None:
+        logging.error("❌ Nessuna ricostruzione valida trovata.")
+        raise SystemExit(1)
+    # Camere e punti 2D dalla risoluzione ridotta a quella degli originali (idempotente)
+    if sfm_settings is not None:
+        reconstruction["rescaled"] = rescale_model(best_model_path, input_dir)
+    return {"reconstruction": reconstruction}
+
+def undistort_stage():
+    for folder in ("images", "sparse", "stereo"):
+        if os.path.exists(os.path.join(args.source_path, folder)):
+            shutil.rmtree(os.path.join(args.source_path, folder))
+    best_model_path = os.path.join(distorted_dir, "sparse", report["reconstruction"]["best"])
+    print("📐 Undistorting images...")
+    if not args.colmap_undistorter and supported(read_cameras_binary(os.path.join(best_model_path, "cameras.bin"))):
+        # images/ e sparse/0 escono già alla risoluzione target, con camere PINHOLE
+        return {"undistortion": undistort_model(
+            best_model_path, input_dir,
+            os.path.join(args.source_path, "images"), os.path.join(args.source_path, "sparse", "0"),
+            os.path.join(distorted_dir, "remap"), target=target, workers=args.workers,
+        )}
+    img_undist_cmd = (
+        f'{colmap_command} image_undistorter '
+        f'--image_path {input_dir} '
+        f'--input_path {best_model_path} '
+        f'--output_path {args.source_path} '
+        f'--output_type COLMAP'
+    )
+    runner.command(img_undist_cmd, "Image undistorter")
+    return {"undistortion": {"method": "colmap", "target": None}}
+
+def reorganize_stage():
+    # Colmap si aspetta i files in sparse/0
+    files = os.listdir(os.path.join(args.source_path, "sparse"))
+    os.makedirs(os.path.join(args.source_path, "sparse", "0"), exist_ok=True)
     for file in files:
-        source_file = os.path.join(args.source_path, "images", file)
-
-        destination_file = os.path.join(args.source_path, "images_2", file)
-        shutil.copy2(source_file, destination_file)
-        exit_code = os.system(f'{magick_command} mogrify -resize 50% "{destination_file}"')
-        if exit_code != 0:
-            logging.error(f"50% resize failed with code {exit_code}. Exiting.")
-            raise SystemExit(exit_code)
-
-        destination_file = os.path.join(args.source_path, "images_4", file)
-        shutil.copy2(source_file, destination_file)
-        exit_code = os.system(f'{magick_command} mogrify -resize 25% "{destination_file}"')
-        if exit_code != 0:
-            logging.error(f"25% resize failed with code {exit_code}. Exiting.")
-            raise SystemExit(exit_code)
-
-        destination_file = os.path.join(args.source_path, "images_8", file)
-        shutil.copy2(source_file, destination_file)
-        exit_code = os.system(f'{magick_command} mogrify -resize 12.5% "{destination_file}"')
-        if exit_code != 0:
-            logging.error(f"12.5% resize failed with code {exit_code}. Exiting.")
-            raise SystemExit(exit_code)
+        if file == '0':
+            continue
+        source_file = os.path.join(args.source_path, "sparse", file)
+        destination_file = os.path.join(args.source_path, "sparse", "0", file)
+        shutil.move(source_file, destination_file)
+
+def points_stage():
+    best_model_path = os.path.join(distorted_dir, "sparse", report["reconstruction"]["best"])
+    model_dir = os.path.join(args.source_path, "sparse", "0")
+    if point_settings is None:
+        # Nessun filtro: si rimettono sempre tutti i punti, sparse/0 può avere quelli di un filtro precedente
+        return {"points": filter_points(best_model_path, model_dir)}
+    print("🧹 Filtering sparse points...")
+    return {"points": {**point_settings, **filter_points(best_model_path, model_dir, point_settings)}}
+
+def pyramid_target():
+    """Target variant still to be made: none if images/ is already at the target size."""
+    return None if report.get("undistortion", {}).get("target") else target
+
+def pyramid_stage():
+    # Resize opzionale: ogni immagine viene decodificata una volta sola
+    if not (args.resize or pyramid_target() is not None):
+        return {}
+    print("Resizing...")
+    return {"pyramid": build_pyramid(
+        args.source_path,
+        factors=(2, 4, 8) if args.resize else (),
+        target=pyramid_target(),
+        workers=args.workers,
+    )}
+
+sfm_stages = (
+    ("extract", {
+        "input": input_fingerprint(input_dir, index_path)[0],
+        "camera": args.camera,
+        "frames": frame_settings,
+        "sfm": sfm_settings,
+        "poses": cache_settings["poses"],
+    }, extract_stage, ["distorted/database.db"]),
+    ("match", {"matcher": args.matcher, "vocab_tree": vocab_tree}, match_stage, ["distorted/database.db"]),
+    ("map", {}, map_stage, ["distorted/sparse"]),
+)
+for name, inputs, func, outputs in sfm_stages:
+    if args.skip_matching:
+        runner.skip(name)
+    else:
+        runner.run(name, inputs, func, outputs)
+
+runner.run("select", {}, select_stage, ["distorted/sparse"])
+runner.run("undistort", {"target": target, "colmap": args.colmap_undistorter}, undistort_stage, ["images", "sparse"])
+runner.run("reorganize", {}, reorganize_stage, ["sparse/0/cameras.bin"])
+pyramid_outputs = [f"images_{factor}" for factor in (2, 4, 8)] if args.resize else []
+if pyramid_target() is not None:
+    pyramid_outputs.append(target_dir_name(*target))
+runner.run("pyramid", {"resize": args.resize, "target": target}, pyramid_stage, pyramid_outputs)
+# Dopo la piramide: cambiare il filtro non fa ridecodificare le immagini
+runner.run("points", point_settings, points_stage, ["sparse/0/points3D.bin"])
+runner.run("ply", {}, ply_stage, ["sparse/0/points3D.ply"])
+
+if cache is not None:
+    private = []
+    # Database e modello distorto servono a --extend; in coarse-to-fine i keypoint sono a risoluzione ridotta
+    if sfm_settings is None:
+        cache_outputs.append(f"distorted/sparse/{report['reconstruction']['best']}")
+        private.append("distorted/database.db")
+    report["cache"]["stored"] = cache.store(cache_key, args.source_path, cache_outputs, cache_settings, private)
+
+write_report(report)
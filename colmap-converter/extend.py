@@ -0,0 +1,66 @@
+"""Extension of an existing reconstruction with newly uploaded images.
+
+Instead of rebuilding the scene, ``--extend`` keeps distorted/database.db
+and the reconstructed model: features are extracted for the new images
+only, matched against the existing ones, registered with
+``image_registrator`` and refined with ``bundle_adjuster`` with the
+intrinsics held fixed. With the cameras unchanged, the images already in
+images/ stay valid and only the new ones are undistorted.
+"""
+import logging
+import os
+import shutil
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+def database_images(database_path):
+    """``{name: (image_id, camera_id)}`` of the images already in the database."""
+    with sqlite3.connect(database_path) as connection:
+        rows = connection.execute("SELECT name, image_id, camera_id FROM images").fetchall()
+    connection.close()
+    return {name: (image_id, camera_id) for name, image_id, camera_id in rows}
+
+
+def write_list(path, names):
+    with open(path, "w") as f:
+        f.write("\n".join(names) + "\n")
+
+
+def write_pairs(path, new_names, existing_names):
+    """Pairs for matches_importer: every new image against every other one."""
+    pairs = 0
+    with open(path, "w") as f:
+        for i, name in enumerate(new_names):
+            for other in list(existing_names) + new_names[i + 1:]:
+                f.write(f"{name} {other}\n")
+                pairs += 1
+    return pairs
+
+
+def replace_model(source_dir, destination_dir):
+    """Move the model files of ``source_dir`` over the ones in ``destination_dir``.
+
+    os.replace swaps the directory entry: files shared with the conversion
+    cache by hardlink are never modified.
+    """
+    os.makedirs(destination_dir, exist_ok=True)
+    for name in os.listdir(source_dir):
+        os.replace(os.path.join(source_dir, name), os.path.join(destination_dir, name))
+
+
+def merge_undistorted(undistorted_dir, source_path, names):
+    """Move the newly undistorted images and the updated model into the scene."""
+    images_dir = os.path.join(source_path, "images")
+    moved = 0
+    for name in names:
+        source = os.path.join(undistorted_dir, "images", name)
+        if os.path.exists(source):
+            os.makedirs(os.path.dirname(os.path.join(images_dir, name)), exist_ok=True)
+            os.replace(source, os.path.join(images_dir, name))
+            moved += 1
+    replace_model(os.path.join(undistorted_dir, "sparse"), os.path.join(source_path, "sparse", "0"))
+    shutil.rmtree(undistorted_dir)
+    logger.info(f"Merged {moved} undistorted images into {images_dir}")
+    return moved
@@ -0,0 +1,154 @@
+"""Known-pose conversion: triangulate only, no incremental mapping.
+
+Captures from rigs or phone AR sessions already come with accurate poses.
+With them the sparse model is built directly and COLMAP only extracts and
+matches features and runs ``point_triangulator``, skipping the incremental
+``mapper`` and its repeated bundle adjustments.
+
+Two input formats are accepted:
+
+- transforms.json (instant-ngp / nerfstudio): ``frames`` with ``file_path``
+  and an OpenGL camera-to-world ``transform_matrix``, intrinsics
+  (``fl_x``, ``fl_y``, ``cx``, ``cy``, ``w``, ``h``, ``k1``, ``k2``, ``p1``,
+  ``p2`` or ``camera_angle_x``) at the top level or per frame;
+- a COLMAP-style JSON: ``{"camera": {"model", "width", "height", "params"},
+  "images": [{"name", "qvec", "tvec", "camera"?}]}`` with world-to-camera
+  poses.
+"""
+import json
+import logging
+import math
+import os
+import sqlite3
+
+import cv2
+import numpy as np
+
+from coarse_to_fine import rescale_camera
+from common.colmap_model import (
+    CAMERA_MODEL_IDS, Camera, ImageArrays, PointArrays, rotmat2qvec,
+    write_cameras_binary, write_images_arrays, write_points3D_arrays,
+)
+
+logger = logging.getLogger(__name__)
+
+_INTRINSIC_KEYS = ("fl_x", "fl_y", "cx", "cy", "w", "h", "k1", "k2", "p1", "p2", "camera_angle_x")
+
+
+def _transforms_camera(values, image_path):
+    if "w" in values and "h" in values:
+        width, height = int(values["w"]), int(values["h"])
+    else:
+        height, width = cv2.imread(image_path, cv2.IMREAD_UNCHANGED).shape[:2]
+    fx = values.get("fl_x")
+    if fx is None:
+        fx = 0.5 * width / math.tan(0.5 * values["camera_angle_x"])
+    fy = values.get("fl_y", fx)
+    cx, cy = values.get("cx", width / 2), values.get("cy", height / 2)
+    distortion = [values.get(key, 0.0) for key in ("k1", "k2", "p1", "p2")]
+    if any(distortion):
+        return Camera(0, "OPENCV", width, height, np.array([fx, fy, cx, cy, *distortion]))
+    return Camera(0, "PINHOLE", width, height, np.array([fx, fy, cx, cy]))
+
+
+def _match_name(file_path, lookup):
+    # file_path può essere relativo ad altre cartelle o senza estensione (dataset Blender)
+    base = os.path.basename(file_path)
+    return lookup.get(base) or lookup.get(os.path.splitext(base)[0])
+
+
+def load_poses(path, input_dir, input_names):
+    """``{input name: (Camera, qvec, tvec)}`` with world-to-camera poses."""
+    with open(path) as f:
+        data = json.load(f)
+    lookup = {name: name for name in input_names}
+    lookup.update({os.path.splitext(name)[0]: name for name in input_names})
+
+    poses = {}
+    if "frames" in data:
+        shared = {key: data[key] for key in _INTRINSIC_KEYS if key in data}
+        for frame in data["frames"]:
+            name = _match_name(frame["file_path"], lookup)
+            if name is None:
+                continue
+            values = {**shared, **{key: frame[key] for key in _INTRINSIC_KEYS if key in frame}}
+            camera = _transforms_camera(values, os.path.join(input_dir, name))
+            c2w = np.array(frame["transform_matrix"], dtype=np.float64)
+            # OpenGL (y su, z indietro) -> OpenCV/COLMAP (y giù, z avanti)
+            c2w[:3, 1:3] *= -1
+            w2c = np.linalg.inv(c2w)
+            poses[name] = (camera, rotmat2qvec(w2c[:3, :3]), w2c[:3, 3])
+    else:
+        shared = data.get("camera")
+        for image in data["images"]:
+            name = _match_name(image["name"], lookup)
+            if name is None:
+                continue
+            values = image.get("camera", shared)
+            camera = Camera(0, values["model"], int(values["width"]), int(values["height"]),
+                            np.array(values["params"], dtype=np.float64))
+            poses[name] = (camera, np.array(image["qvec"], dtype=np.float64), np.array(image["tvec"], dtype=np.float64))
+    logger.info(f"Loaded {len(poses)} poses from {path}")
+    return poses
+
+
+def shared_intrinsics(poses):
+    cameras = {(camera.model, camera.width, camera.height, tuple(camera.params)) for camera, _, _ in poses.values()}
+    return len(cameras) == 1
+
+
+def apply_intrinsics(database_path, poses):
+    """Write the known intrinsics into the cameras created by feature_extractor.
+
+    Intrinsics are rescaled to the size of the images actually extracted
+    (the coarse-to-fine copy may be smaller than the poses' resolution).
+    """
+    with sqlite3.connect(database_path) as connection:
+        rows = connection.execute(
+            "SELECT images.name, cameras.camera_id, cameras.width, cameras.height "
+            "FROM images JOIN cameras ON images.camera_id = cameras.camera_id"
+        ).fetchall()
+        updated = set()
+        for name, camera_id, width, height in rows:
+            if camera_id in updated or name not in poses:
+                continue
+            camera, _ = rescale_camera(poses[name][0], width, height)
+            connection.execute(
+                "UPDATE cameras SET model = ?, params = ?, prior_focal_length = 1 WHERE camera_id = ?",
+                (CAMERA_MODEL_IDS[camera.model], camera.params.astype("<f8").tobytes(), camera_id),
+            )
+            updated.add(camera_id)
+    connection.close()
+    return len(updated)
+
+
+def write_prior_model(database_path, poses, model_dir):
+    """Sparse model with the known poses and no points, using the database ids."""
+    with sqlite3.connect(database_path) as connection:
+        image_rows = connection.execute("SELECT image_id, name, camera_id FROM images").fetchall()
+        camera_rows = connection.execute("SELECT camera_id, model, width, height, params FROM cameras").fetchall()
+    connection.close()
+    models = {model_id: name for name, model_id in CAMERA_MODEL_IDS.items()}
+    cameras = {
+        camera_id: Camera(camera_id, models[model], width, height, np.frombuffer(params, dtype="<f8"))
+        for camera_id, model, width, height, params in camera_rows
+    }
+    image_rows = sorted(row for row in image_rows if row[1] in poses)
+    images = ImageArrays(
+        np.array([row[0] for row in image_rows], dtype=np.int32),
+        np.array([poses[row[1]][1] for row in image_rows]).reshape(-1, 4),
+        np.array([poses[row[1]][2] for row in image_rows]).reshape(-1, 3),
+        np.array([row[2] for row in image_rows], dtype=np.int32),
+        [row[1] for row in image_rows],
+        np.zeros(len(image_rows) + 1, dtype=np.int64),
+        np.zeros((0, 2)), np.zeros(0, dtype=np.int64),
+    )
+    points = PointArrays(
+        np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros((0, 3), dtype=np.uint8), np.zeros(0),
+        np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+    )
+    os.makedirs(model_dir, exist_ok=True)
+    write_cameras_binary(cameras, os.path.join(model_dir, "cameras.bin"))
+    write_images_arrays(images, os.path.join(model_dir, "images.bin"))
+    write_points3D_arrays(points, os.path.join(model_dir, "points3D.bin"))
+    return len(image_rows)
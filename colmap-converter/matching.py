@@ -0,0 +1,161 @@
+"""Feature matching strategies for convert_optimized.py.
+
+Exhaustive matching is O(n²) in the number of images and takes hours on
+800-2000 frame captures. Besides it:
+
+- sequential: neighbouring frames of a video, plus loop detection through
+  the vocabulary tree when one is available;
+- vocab_tree: retrieval of the most similar images, for unordered photos;
+- spatial: neighbours by EXIF GPS position.
+
+``auto`` picks one from the image count, the file naming and the presence
+of GPS tags.
+"""
+import logging
+import os
+import re
+import sqlite3
+
+from colmap_cache import natural_key
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("exhaustive", "sequential", "vocab_tree", "spatial")
+DEFAULT_VOCAB_TREE = "/workspace/vocab_trees/vocab_tree_flickr100K_words256K.bin"
+
+# Sotto questa soglia l'exhaustive resta il più robusto e dura pochi minuti
+EXHAUSTIVE_MAX_IMAGES = 200
+SEQUENTIAL_OVERLAP = 10
+_FRAME_NUMBER = re.compile(r"^(?P<prefix>.*?)(?P<number>\d+)$")
+_GPS_IFD = 0x8825
+
+
+def vocab_tree_path(path=None):
+    """The vocabulary tree to use, or None if the file is missing."""
+    path = path or os.environ.get("COLMAP_VOCAB_TREE", DEFAULT_VOCAB_TREE)
+    return path if path and os.path.exists(path) else None
+
+
+def looks_sequential(names, min_ratio=0.9):
+    """True when names are ``<prefix><frame number>`` with mostly unit steps."""
+    if len(names) < 3:
+        return False
+    numbers = {}
+    for name in names:
+        match = _FRAME_NUMBER.match(os.path.splitext(name)[0])
+        if not match:
+            return False
+        numbers.setdefault(match["prefix"], []).append(int(match["number"]))
+    if len(numbers) != 1:
+        return False
+    frames = sorted(next(iter(numbers.values())))
+    steps = [b - a for a, b in zip(frames, frames[1:])]
+    # Frame estratti ogni k fotogrammi: passo costante anche se diverso da 1
+    common_step = max(set(steps), key=steps.count)
+    return common_step > 0 and steps.count(common_step) >= min_ratio * len(steps)
+
+
+def has_gps(image_dir, names, samples=5):
+    """True if the EXIF of a few sampled images carries a GPS position."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    step = max(1, len(names) // samples)
+    for name in names[::step][:samples]:
+        try:
+            with Image.open(os.path.join(image_dir, name)) as image:
+                gps = image.getexif().get_ifd(_GPS_IFD)
+        except (OSError, ValueError):
+            continue
+        # 2 = GPSLatitude, 4 = GPSLongitude
+        if gps and 2 in gps and 4 in gps:
+            return True
+    return False
+
+
+def choose_strategy(image_dir, names, requested="auto", vocab_tree=None):
+    """Return ``(strategy, reason)``."""
+    if requested != "auto":
+        if requested == "vocab_tree" and vocab_tree is None:
+            logger.warning("Vocabulary tree not found, falling back to exhaustive matching")
+            return "exhaustive", "vocab_tree requested but no vocabulary tree available"
+        return requested, "requested"
+    count = len(names)
+    if count <= EXHAUSTIVE_MAX_IMAGES:
+        return "exhaustive", f"{count} images <= {EXHAUSTIVE_MAX_IMAGES}"
+    if looks_sequential(names):
+        return "sequential", f"{count} images named as consecutive video frames"
+    if has_gps(image_dir, names):
+        return "spatial", f"{count} images with EXIF GPS"
+    if vocab_tree is not None:
+        return "vocab_tree", f"{count} unordered images"
+    return "exhaustive", f"{count} unordered images, no vocabulary tree available"
+
+
+def matcher_command(colmap_command, strategy, database_path, use_gpu, vocab_tree=None):
+    command = (
+        f'{colmap_command} {strategy}_matcher '
+        f'--database_path {database_path} '
+        f'--SiftMatching.use_gpu {use_gpu}'
+    )
+    if strategy == "sequential":
+        command += f' --SequentialMatching.overlap {SEQUENTIAL_OVERLAP}'
+        if vocab_tree is not None:
+            # Loop detection: richiude il percorso quando la camera ripassa da un punto già visto
+            command += (
+                ' --SequentialMatching.loop_detection 1'
+                f' --SequentialMatching.vocab_tree_path {vocab_tree}'
+            )
+    elif strategy == "vocab_tree":
+        command += f' --VocabTreeMatching.vocab_tree_path {vocab_tree}'
+    elif strategy == "spatial":
+        command += ' --SpatialMatching.is_gps 1'
+    return command
+
+
+def extension_matcher_command(colmap_command, database_path, use_gpu, list_path, pairs_path, vocab_tree=None):
+    """Match only the listed new images: by retrieval if possible, else against every image."""
+    if vocab_tree is not None:
+        return (
+            f'{colmap_command} vocab_tree_matcher '
+            f'--database_path {database_path} '
+            f'--SiftMatching.use_gpu {use_gpu} '
+            f'--VocabTreeMatching.vocab_tree_path {vocab_tree} '
+            f'--VocabTreeMatching.match_list_path {list_path}'
+        )
+    return pairs_matcher_command(colmap_command, database_path, use_gpu, pairs_path)
+
+
+def pairs_matcher_command(colmap_command, database_path, use_gpu, pairs_path):
+    return (
+        f'{colmap_command} matches_importer '
+        f'--database_path {database_path} '
+        f'--SiftMatching.use_gpu {use_gpu} '
+        f'--match_list_path {pairs_path} '
+        f'--match_type pairs'
+    )
+
+
+def match_pairs(strategy, names):
+    """Explicit image pairs of ``strategy``, or None when COLMAP picks them itself.
+
+    vocab_tree and spatial choose neighbours from the features or the GPS
+    tags while matching, so they cannot be split into pair lists up front.
+    """
+    names = sorted(names, key=natural_key)
+    if strategy == "exhaustive":
+        return [(first, second) for i, first in enumerate(names) for second in names[i + 1:]]
+    if strategy == "sequential":
+        return [(first, second) for i, first in enumerate(names) for second in names[i + 1:i + 1 + SEQUENTIAL_OVERLAP]]
+    return None
+
+
+def clear_matches(database_path):
+    """Drop the matches of a previous run, keeping the extracted features."""
+    with sqlite3.connect(database_path) as connection:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for table in ("matches", "two_view_geometries"):
+            if table in tables:
+                connection.execute(f"DELETE FROM {table}")
+    connection.close()
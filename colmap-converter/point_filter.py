@@ -0,0 +1,182 @@
+"""Filtering and voxel downsampling of the sparse points before training.
+
+train.py starts from one gaussian per entry of points3D.bin: with dense
+exhaustive reconstructions that means millions of points, many of them
+seen by two images only or badly reprojected, which cost VRAM in the first
+iterations and slow down densification (3dgs-mcmc ``--init_type sfm``
+most of all). In order, the points are dropped by:
+
+- track length and reprojection error;
+- density: a point whose 3x3x3 voxel neighbourhood holds far fewer points
+  than the others (``std_ratio`` standard deviations below the mean of the
+  log counts, and under a tenth of the median) is an isolated outlier: a
+  grid version of the statistical outlier removal, no k-d tree needed;
+- voxel downsampling to a point budget: the voxel size is searched so that
+  at most ``max_points`` voxels are occupied, and in each voxel the point
+  with the lowest reprojection error is kept, tracks included.
+
+Everything is vectorized over int64 voxel keys. Removed points are also
+unlinked from images.bin (point3D_id -1).
+"""
+import logging
+import os
+import time
+
+import numpy as np
+
+from common.colmap_model import (
+    read_images_arrays, read_points3D_arrays, select_points, write_images_arrays, write_points3D_arrays,
+)
+
+logger = logging.getLogger(__name__)
+
+MIN_TRACK_LENGTH = 3
+MAX_REPROJECTION_ERROR = 2.0
+OUTLIER_STD_RATIO = 2.0
+# Lato del voxel per la densità: in media un punto ogni 8 voxel del volume robusto
+OUTLIER_VOXEL_SCALE = 2.0
+MIN_RELATIVE_DENSITY = 0.1
+# Il downsampling si ferma quando i voxel occupati sono tra il 90% e il 100% del budget
+BUDGET_TOLERANCE = 0.9
+_KEY_BITS = 21
+_OFFSETS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)])
+
+
+def _voxel_coords(xyz, size):
+    # +1: il vicino a -1 del primo strato resta una chiave valida, senza fondere gli strati 0 e 1
+    coords = np.floor((xyz - xyz.min(axis=0)) / size).astype(np.int64) + 1
+    # Un punto lontanissimo finisce sul bordo della griglia invece di far traboccare la chiave
+    return np.minimum(coords, (1 << _KEY_BITS) - 2)
+
+
+def _keys(coords):
+    return (coords[:, 0] << (2 * _KEY_BITS)) | (coords[:, 1] << _KEY_BITS) | coords[:, 2]
+
+
+def robust_extent(xyz):
+    """Largest side of the box holding the central 98% of the points."""
+    low, high = np.percentile(xyz, [1, 99], axis=0)
+    return float((high - low).max())
+
+
+def density_inliers(xyz, std_ratio=OUTLIER_STD_RATIO, voxel_size=None):
+    """Mask of the points whose neighbourhood is not abnormally sparse."""
+    if len(xyz) == 0:
+        return np.zeros(0, dtype=bool), voxel_size
+    voxel_size = voxel_size or (OUTLIER_VOXEL_SCALE * robust_extent(xyz) / np.cbrt(len(xyz)) or 1.0)
+    coords = _voxel_coords(xyz, voxel_size)
+    voxels, inverse, counts = np.unique(_keys(coords), return_inverse=True, return_counts=True)
+    voxel_coords = coords[np.unique(inverse, return_index=True)[1]]
+
+    # Punti nei 27 voxel attorno a ogni voxel occupato: una ricerca ordinata per offset
+    neighbours = np.zeros(len(voxels), dtype=np.int64)
+    for offset in _OFFSETS:
+        keys = _keys(voxel_coords + offset)
+        index = np.minimum(np.searchsorted(voxels, keys), len(voxels) - 1)
+        neighbours += np.where(voxels[index] == keys, counts[index], 0)
+
+    # La densità è moltiplicativa: statistica sul logaritmo dei conteggi
+    per_point = np.log(neighbours[inverse])
+    threshold = per_point.mean() - std_ratio * per_point.std()
+    # Con densità molto uniforme la soglia taglierebbe i bordi delle superfici:
+    # è outlier solo chi ha anche meno di un decimo dei vicini tipici
+    threshold = min(threshold, np.median(per_point) + np.log(MIN_RELATIVE_DENSITY))
+    # Almeno un altro punto nel vicinato, qualunque sia la statistica
+    return (per_point >= threshold) & (per_point > 0), voxel_size
+
+
+def _occupied(coords_xyz, size):
+    return len(np.unique(_keys(_voxel_coords(coords_xyz, size))))
+
+
+def voxel_downsample(xyz, errors, max_points, iterations=12):
+    """Indices of at most ``max_points`` points, one per voxel; returns ``(indices, voxel_size)``."""
+    if len(xyz) <= max_points:
+        return np.arange(len(xyz)), None
+    extent = robust_extent(xyz) or 1.0
+    # Stima iniziale: max_points voxel su un volume pieno, poi bisezione sul lato
+    low, high = extent / max_points, extent / max(1.0, np.cbrt(max_points)) * 4
+    while _occupied(xyz, high) > max_points:
+        low, high = high, high * 2
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        occupied = _occupied(xyz, middle)
+        if occupied > max_points:
+            low = middle
+        else:
+            high = middle
+            if occupied >= BUDGET_TOLERANCE * max_points:
+                break
+    keys = _keys(_voxel_coords(xyz, high))
+    # Per voxel il punto con errore minore: ordinamento per (voxel, errore), primo di ogni gruppo
+    order = np.lexsort((errors, keys))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = keys[order][1:] != keys[order][:-1]
+    return np.sort(order[first]), high
+
+
+def _unlink_removed(source_images, images, point_ids):
+    """point3D_id of ``images`` from ``source_images``, -1 where the point was removed.
+
+    The ids come from the reconstructed model, so a rerun can also bring
+    back points removed by an earlier, stricter filter.
+    """
+    source = read_images_arrays(source_images)
+    if not np.array_equal(source.ids, images.ids):
+        order = np.argsort(source.ids)
+        index = order[np.searchsorted(source.ids, images.ids, sorter=order)]
+        lengths = np.diff(source.point_offsets)[index]
+        ranges = np.repeat(source.point_offsets[:-1][index] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        source_ids = source.point3D_ids[np.arange(int(lengths.sum())) + ranges]
+    else:
+        source_ids = source.point3D_ids
+    return np.where(np.isin(source_ids, point_ids), source_ids, -1)
+
+
+def filter_points(source_model, model_dir, settings=None):
+    """Write into ``model_dir`` the points of ``source_model`` that pass ``settings``.
+
+    ``source_model`` is the reconstructed model, so every run starts again
+    from all of its points; without ``settings`` they are all restored.
+    Returns the statistics.
+    """
+    started = time.perf_counter()
+    points = read_points3D_arrays(os.path.join(source_model, "points3D.bin"))
+    stats = {"input": len(points.ids)}
+    keep = np.ones(len(points.ids), dtype=bool)
+
+    if settings is not None:
+        lengths = np.diff(points.track_offsets)
+        # Errore -1 = non calcolato: il punto non viene scartato per l'errore
+        keep = (lengths >= settings["min_track_length"]) & (points.errors <= settings["max_reprojection_error"])
+        stats["after_track_and_error"] = int(keep.sum())
+
+        inliers, stats["outlier_voxel_size"] = density_inliers(points.xyz[keep], settings["std_ratio"])
+        keep[np.flatnonzero(keep)[~inliers]] = False
+        stats["after_outliers"] = int(keep.sum())
+
+        if settings["max_points"]:
+            candidates = np.flatnonzero(keep)
+            kept, stats["downsample_voxel_size"] = voxel_downsample(
+                points.xyz[candidates], points.errors[candidates], settings["max_points"],
+            )
+            keep = np.zeros_like(keep)
+            keep[candidates[kept]] = True
+    stats["output"] = int(keep.sum())
+
+    filtered = select_points(points, keep)
+    images_path = os.path.join(model_dir, "images.bin")
+    images = read_images_arrays(images_path)
+    point3D_ids = _unlink_removed(os.path.join(source_model, "images.bin"), images, filtered.ids)
+    write_images_arrays(images._replace(point3D_ids=point3D_ids), images_path)
+    write_points3D_arrays(filtered, os.path.join(model_dir, "points3D.bin"))
+
+    filtered_lengths = np.diff(filtered.track_offsets)
+    errors = filtered.errors[filtered.errors >= 0]
+    stats.update({
+        "mean_track_length": float(filtered_lengths.mean()) if len(filtered_lengths) else 0.0,
+        "mean_reprojection_error": float(errors.mean()) if len(errors) else None,
+        "seconds": time.perf_counter() - started,
+    })
+    logger.info(f"Filtered sparse points: {stats['input']} -> {stats['output']} in {stats['seconds']:.1f}s")
+    return stats
@@ -0,0 +1,124 @@
+"""Downscaled copies of the undistorted images, decoded once per image.
+
+Replaces copy2 + ``magick mogrify`` (three copies and three processes per
+image, all serial) with a process pool in which every worker decodes an
+image once and writes images_2/4/8 by successive area halving, plus an
+optional ``images_<W>x<H>`` variant that fits the training target
+resolution.
+"""
+import logging
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+PYRAMID_FACTORS = (2, 4, 8)
+JPEG_QUALITY = 95
+
+
+def available_cores():
+    """CPUs this container may use: affinity mask capped by the cgroup quota."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2: "max 100000" oppure "200000 100000"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cores = min(cores, max(1, math.ceil(quota)))
+    return max(1, cores)
+
+
+def target_dir_name(target_width, target_height):
+    return f"images_{target_width}x{target_height}"
+
+
+def fit_size(width, height, target_width, target_height):
+    """Largest size within the target box with the same aspect; never upscales."""
+    scale = min(target_width / width, target_height / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def write_image(path, image):
+    params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY] if path.lower().endswith((".jpg", ".jpeg")) else []
+    if not cv2.imwrite(path, image, params):
+        raise OSError(f"Cannot write {path}")
+
+
+def _process_image(task):
+    source_file, outputs, factors, target = task
+    # OpenCV usa già più thread per resize: nel pool si lavora a un thread per processo
+    cv2.setNumThreads(1)
+    image = cv2.imread(source_file, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Cannot read {source_file}")
+    height, width = image.shape[:2]
+    name = os.path.basename(source_file)
+
+    level, level_factor = image, 1
+    for factor in factors:
+        # Dimezzamenti successivi con INTER_AREA: equivalgono alla media sui blocchi factor×factor
+        while level_factor < factor:
+            level_factor *= 2
+            size = (max(1, round(width / level_factor)), max(1, round(height / level_factor)))
+            level = cv2.resize(level, size, interpolation=cv2.INTER_AREA)
+        write_image(os.path.join(outputs[factor], name), level)
+
+    if target is not None:
+        size = fit_size(width, height, *target)
+        resized = image if size == (width, height) else cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        write_image(os.path.join(outputs["target"], name), resized)
+    return name
+
+
+def build_pyramid(source_path, factors=PYRAMID_FACTORS, target=None, workers=None, names=None):
+    """Write ``images_<f>`` for ``factors`` and the optional target variant.
+
+    With ``names`` only those images are added to the existing levels.
+    Returns ``{"images", "workers", "seconds", "outputs"}``.
+    """
+    images_dir = os.path.join(source_path, "images")
+    outputs = {factor: os.path.join(source_path, f"images_{factor}") for factor in factors}
+    if target is not None:
+        outputs["target"] = os.path.join(source_path, target_dir_name(*target))
+    for directory in outputs.values():
+        # Si riparte da cartelle vuote: i file potrebbero essere hardlink della cache
+        if names is None and os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+
+    names = sorted(os.listdir(images_dir)) if names is None else names
+    tasks = [(os.path.join(images_dir, name), outputs, sorted(factors), target) for name in names]
+    workers = workers or available_cores()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(_process_image, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+            pass
+    elapsed = time.perf_counter() - started
+    logger.info(f"Pyramid of {len(names)} images in {elapsed:.1f}s with {workers} processes")
+    return {
+        "images": len(names),
+        "workers": workers,
+        "seconds": elapsed,
+        "outputs": [os.path.basename(directory) for directory in outputs.values()],
+    }
@@ -0,0 +1,223 @@
+"""Sharded feature extraction and matching.
+
+A single COLMAP process per step leaves most cores of a CPU-only converter
+idle. With ``--shards N`` the images are split into N lists, each extracted
+by its own ``feature_extractor`` into its own shard database; the shards are
+joined with ``database_merger``. Matching is then split by pair list: every
+shard gets a database with the features its pairs need and runs
+``matches_importer``, and the matches are copied back into database.db
+before mapping.
+
+Shards talk only through files (image lists, pair lists, shard databases),
+but they are run here as local processes.
+"""
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tabelle per immagine copiate solo per le immagini delle coppie dello shard
+_PER_IMAGE_TABLES = ("keypoints", "descriptors")
+_MATCH_TABLES = ("matches", "two_view_geometries")
+
+
+def split(items, shards):
+    """``shards`` contiguous, balanced chunks (consecutive frames stay together)."""
+    size, extra = divmod(len(items), shards)
+    chunks, start = [], 0
+    for index in range(shards):
+        end = start + size + (1 if index < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return [chunk for chunk in chunks if chunk]
+
+
+def threads_per_shard(shards, cores):
+    return max(1, cores // shards)
+
+
+def _tables(connection, schema="main"):
+    return {row[0] for row in connection.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type='table'")}
+
+
+def unify_cameras(database_path):
+    """Give every image the first camera: each shard created its own copy of it."""
+    with sqlite3.connect(database_path) as connection:
+        tables = _tables(connection)
+        if "rigs" in tables or "frames" in tables:
+            # Schema con rig/frame (COLMAP >= 3.12): le camere sono referenziate anche lì
+            logger.warning("Database with rigs/frames: keeping one camera per shard")
+            return False
+        (camera_id,) = connection.execute("SELECT MIN(camera_id) FROM cameras").fetchone()
+        connection.execute("UPDATE images SET camera_id = ?", (camera_id,))
+        connection.execute("DELETE FROM cameras WHERE camera_id != ?", (camera_id,))
+    connection.close()
+    return True
+
+
+def shard_database(database_path, shard_path, names):
+    """Copy of database.db with all images but only the features of ``names``."""
+    if os.path.exists(shard_path):
+        os.remove(shard_path)
+    with sqlite3.connect(shard_path) as connection:
+        connection.execute("ATTACH DATABASE ? AS source", (database_path,))
+        schema = connection.execute(
+            "SELECT name, sql FROM source.sqlite_master "
+            "WHERE type IN ('table', 'index') AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        # sqlite_sequence (AUTOINCREMENT di cameras/images) è interna: SQLite la crea e aggiorna da sola
+        for _, sql in schema:
+            connection.execute(sql)
+        connection.execute("CREATE TEMP TABLE shard_images (image_id INTEGER PRIMARY KEY)")
+        placeholders = ",".join("?" * len(names))
+        connection.execute(
+            f"INSERT INTO shard_images SELECT image_id FROM source.images WHERE name IN ({placeholders})", names
+        )
+        for table in _tables(connection, "source"):
+            if table in _MATCH_TABLES or table.startswith("sqlite_"):
+                continue
+            if table in _PER_IMAGE_TABLES:
+                connection.execute(
+                    f"INSERT INTO main.{table} SELECT * FROM source.{table} "
+                    f"WHERE image_id IN (SELECT image_id FROM shard_images)"
+                )
+            else:
+                connection.execute(f"INSERT INTO main.{table} SELECT * FROM source.{table}")
+        connection.commit()
+        connection.execute("DETACH DATABASE source")
+    connection.close()
+
+
+def merge_matches(database_path, shard_paths):
+    """Copy matches and two-view geometries of every shard into database.db."""
+    with sqlite3.connect(database_path) as connection:
+        for shard_path in shard_paths:
+            connection.execute("ATTACH DATABASE ? AS shard", (shard_path,))
+            for table in _MATCH_TABLES:
+                if table in _tables(connection, "shard"):
+                    connection.execute(f"INSERT OR REPLACE INTO main.{table} SELECT * FROM shard.{table}")
+            connection.commit()
+            connection.execute("DETACH DATABASE shard")
+    connection.close()
+
+
+def write_pairs(path, pairs):
+    with open(path, "w") as f:
+        f.writelines(f"{first} {second}\n" for first, second in pairs)
+
+
+def pair_images(pairs):
+    return sorted({name for pair in pairs for name in pair})
+
+
+def _throughput(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+
+def _reset_dir(shard_dir):
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+
+
+def extract_features(runner, colmap_command, extractor_args, database_path, names, shards, cores, single_camera):
+    """feature_extractor on ``shards`` image lists at once, merged into ``database_path``.
+
+    ``extractor_args`` are the options shared by every shard (image path,
+    camera model, SIFT settings); each shard gets its own list and database.
+    """
+    shard_dir = os.path.join(os.path.dirname(database_path), "shards")
+    _reset_dir(shard_dir)
+    chunks = split(names, shards)
+    threads = threads_per_shard(len(chunks), cores)
+    shard_paths, commands = [], []
+    for index, chunk in enumerate(chunks):
+        list_path = os.path.join(shard_dir, f"extract_{index}.txt")
+        shard_path = os.path.join(shard_dir, f"extract_{index}.db")
+        with open(list_path, "w") as f:
+            f.write("\n".join(chunk) + "\n")
+        shard_paths.append(shard_path)
+        commands.append(
+            f'{colmap_command} feature_extractor '
+            f'--database_path {shard_path} '
+            f'--image_list_path {list_path} '
+            f'--SiftExtraction.num_threads {threads} '
+            f'{extractor_args}'
+        )
+    print(f"🧩 Extracting features in {len(chunks)} shards ({threads} threads each)...")
+    seconds = runner.commands(commands, "Feature extraction")
+
+    # database_merger unisce due database alla volta: si accumula shard dopo shard
+    started = time.perf_counter()
+    merged = shard_paths[0]
+    for index, shard_path in enumerate(shard_paths[1:], start=1):
+        output = os.path.join(shard_dir, f"merged_{index}.db")
+        runner.command(
+            f'{colmap_command} database_merger '
+            f'--database_path1 {merged} '
+            f'--database_path2 {shard_path} '
+            f'--database_path {output}',
+            "Database merger",
+        )
+        merged = output
+    os.replace(merged, database_path)
+    unified = single_camera and unify_cameras(database_path)
+    merge_seconds = time.perf_counter() - started
+    cleanup(shard_dir)
+    return {
+        "shards": [
+            {"shard": index, "images": len(chunk), "seconds": seconds[index],
+             "images_per_s": _throughput(len(chunk), seconds[index])}
+            for index, chunk in enumerate(chunks)
+        ],
+        "threads_per_shard": threads,
+        "merge_seconds": merge_seconds,
+        "cameras_unified": unified,
+    }
+
+
+def match_features(runner, colmap_command, database_path, pairs, shards, cores, use_gpu):
+    """matches_importer on ``shards`` slices of ``pairs`` at once, merged into ``database_path``."""
+    shard_dir = os.path.join(os.path.dirname(database_path), "shards")
+    _reset_dir(shard_dir)
+    chunks = split(pairs, shards)
+    threads = threads_per_shard(len(chunks), cores)
+    started = time.perf_counter()
+    shard_paths, commands = [], []
+    for index, chunk in enumerate(chunks):
+        pairs_path = os.path.join(shard_dir, f"pairs_{index}.txt")
+        shard_path = os.path.join(shard_dir, f"match_{index}.db")
+        write_pairs(pairs_path, chunk)
+        shard_database(database_path, shard_path, pair_images(chunk))
+        shard_paths.append(shard_path)
+        commands.append(
+            f'{colmap_command} matches_importer '
+            f'--database_path {shard_path} '
+            f'--match_list_path {pairs_path} '
+            f'--match_type pairs '
+            f'--SiftMatching.num_threads {threads} '
+            f'--SiftMatching.use_gpu {use_gpu}'
+        )
+    split_seconds = time.perf_counter() - started
+    print(f"🧩 Matching {len(pairs)} pairs in {len(chunks)} shards ({threads} threads each)...")
+    seconds = runner.commands(commands, "Feature matching")
+    started = time.perf_counter()
+    merge_matches(database_path, shard_paths)
+    merge_seconds = time.perf_counter() - started
+    cleanup(shard_dir)
+    return {
+        "shards": [
+            {"shard": index, "pairs": len(chunk), "seconds": seconds[index],
+             "pairs_per_s": _throughput(len(chunk), seconds[index])}
+            for index, chunk in enumerate(chunks)
+        ],
+        "threads_per_shard": threads,
+        "split_seconds": split_seconds,
+        "merge_seconds": merge_seconds,
+    }
+
+
+def cleanup(shard_dir):
+    shutil.rmtree(shard_dir, ignore_errors=True)
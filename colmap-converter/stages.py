@@ -0,0 +1,156 @@
+"""Named, resumable stages of a conversion.
+
+Every completed stage writes ``<source>/.convert_stages/<stage>.json`` with
+the fingerprint of its inputs, chained with the fingerprint of the stage
+before it, so a change upstream invalidates everything downstream. A rerun
+reuses each stage whose marker matches and whose outputs still exist and
+resumes at the first stale one: a failed undistortion no longer throws away
+a two-hour mapper run.
+
+For every stage the report records wall time, CPU time (this process plus
+the children it reaped) and peak RSS.
+"""
+import hashlib
+import json
+import logging
+import os
+import resource
+import subprocess
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_DIR = ".convert_stages"
+MARKER_VERSION = 1
+
+
+def _cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageRunner:
+    def __init__(self, source_path, report):
+        self.source_path = source_path
+        self.state_dir = os.path.join(source_path, STATE_DIR)
+        self.report = report
+        self.stages = report.setdefault("stages", {})
+        self.previous = ""
+        self.invalidated = False
+        self._child_peaks = []
+
+    def _marker_path(self, name):
+        return os.path.join(self.state_dir, f"{name}.json")
+
+    def _load(self, name):
+        try:
+            with open(self._marker_path(name)) as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return marker if marker.get("version") == MARKER_VERSION else None
+
+    def reset(self):
+        """Forget every marker (the outputs were replaced from outside, e.g. by the cache)."""
+        if os.path.isdir(self.state_dir):
+            for name in os.listdir(self.state_dir):
+                os.remove(os.path.join(self.state_dir, name))
+
+    def run(self, name, inputs, func, outputs=()):
+        """Run ``func`` unless the stage is up to date; ``func`` returns report entries."""
+        fingerprint = hashlib.sha256(
+            json.dumps({"previous": self.previous, "inputs": inputs}, sort_keys=True).encode()
+        ).hexdigest()
+        self.previous = fingerprint
+
+        marker = None if self.invalidated else self._load(name)
+        missing = [path for path in outputs if not os.path.exists(os.path.join(self.source_path, path))]
+        if marker is not None and marker["fingerprint"] == fingerprint and not missing:
+            print(f"⏭️  Stage {name} up to date, reusing it")
+            self.report.update(marker["report"])
+            self.stages[name] = {"status": "reused", **marker["usage"]}
+            return marker["report"]
+
+        # Da qui in poi ogni marker è vecchio: si riparte da questo stage
+        self.invalidated = True
+        if os.path.exists(self._marker_path(name)):
+            os.remove(self._marker_path(name))
+
+        self._child_peaks = []
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = time.perf_counter()
+        entries = func() or {}
+        wall = time.perf_counter() - started
+        self_after = resource.getrusage(resource.RUSAGE_SELF)
+        children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        # ru_maxrss è un massimo storico: conta solo se è cresciuto durante lo stage
+        peaks = list(self._child_peaks)
+        for before, after in ((self_before, self_after), (children_before, children_after)):
+            if after.ru_maxrss > before.ru_maxrss:
+                peaks.append(after.ru_maxrss)
+        usage = {
+            "wall_s": wall,
+            "cpu_s": _cpu_seconds(self_after) - _cpu_seconds(self_before)
+                     + _cpu_seconds(children_after) - _cpu_seconds(children_before),
+            "peak_rss_mb": max(peaks or [self_after.ru_maxrss]) / 1024,
+        }
+        self.report.update(entries)
+        self.stages[name] = {"status": "ran", **usage}
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = self._marker_path(name) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": MARKER_VERSION,
+                "fingerprint": fingerprint,
+                "inputs": inputs,
+                "report": entries,
+                "usage": usage,
+                "completed_at": time.time(),
+            }, f, indent=2)
+        os.replace(tmp_path, self._marker_path(name))
+        return entries
+
+    def skip(self, name):
+        """Stage not run on request (--skip_matching): chain on its last marker, if any."""
+        marker = self._load(name)
+        self.previous = marker["fingerprint"] if marker else f"skipped:{name}"
+        self.stages[name] = {"status": "skipped"}
+
+    def command(self, command, label):
+        """Run a shell command, charging its peak RSS to the current stage."""
+        process = subprocess.Popen(command, shell=True)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = exit_code = os.waitstatus_to_exitcode(status)
+        self._child_peaks.append(usage.ru_maxrss)
+        if exit_code != 0:
+            logger.error(f"{label} failed with code {exit_code}. Exiting.")
+            raise SystemExit(exit_code)
+
+    def commands(self, commands, label):
+        """Run shell commands concurrently; returns the seconds each one took."""
+        started = time.perf_counter()
+        processes = {}
+        for index, command in enumerate(commands):
+            process = subprocess.Popen(command, shell=True)
+            processes[process.pid] = (index, process)
+        seconds = [0.0] * len(commands)
+        peaks, failed = [], []
+        while processes:
+            pid, status, usage = os.wait4(-1, 0)
+            if pid not in processes:
+                continue
+            index, process = processes.pop(pid)
+            seconds[index] = time.perf_counter() - started
+            peaks.append(usage.ru_maxrss)
+            process.returncode = exit_code = os.waitstatus_to_exitcode(status)
+            if exit_code != 0:
+                failed.append(exit_code)
+                logger.error(f"{label} (shard {index}) failed with code {exit_code}")
+        # Processi in parallelo: il picco dello stage è al più la somma dei picchi
+        self._child_peaks.append(sum(peaks))
+        if failed:
+            logger.error(f"{label}: {len(failed)}/{len(commands)} shards failed. Exiting.")
+            raise SystemExit(failed[0])
+        return seconds
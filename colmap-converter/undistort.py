@@ -0,0 +1,245 @@
+"""In-process undistortion of the reconstructed images.
+
+``image_undistorter`` re-derives the distortion for every image, runs on
+one core and always writes full-resolution copies, which the pyramid then
+decodes again to make the training resolution. Here cameras.bin is parsed
+once, the remap table of every camera is built once (one table in total
+for a single-camera capture) and saved as .npy next to the database, and a
+process pool remaps the images straight to the output resolution. The
+output is a PINHOLE model at that resolution, with the 2D points
+undistorted as ``image_undistorter`` does.
+
+The undistorted camera follows COLMAP's ``UndistortCamera`` with its
+defaults (blank_pixels 0, scale clipped to [0.2, 2]), so without a target
+the output matches the one of ``image_undistorter``. Models OpenCV cannot
+remap (FOV, the radial fisheyes, THIN_PRISM_FISHEYE) are not supported:
+the caller falls back to COLMAP.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from coarse_to_fine import rescale_camera
+from common.colmap_model import (
+    Camera, read_cameras_binary, read_images_arrays, write_cameras_binary, write_images_arrays,
+)
+from pyramid import available_cores, fit_size, write_image
+
+logger = logging.getLogger(__name__)
+
+MIN_SCALE = 0.2
+MAX_SCALE = 2.0
+# Modello COLMAP -> (indici di fx, fy, cx, cy, indici dei coefficienti OpenCV, fisheye)
+_OPENCV_MODELS = {
+    "SIMPLE_PINHOLE": ((0, 0, 1, 2), (), False),
+    "PINHOLE": ((0, 1, 2, 3), (), False),
+    "SIMPLE_RADIAL": ((0, 0, 1, 2), (3,), False),
+    "RADIAL": ((0, 0, 1, 2), (3, 4), False),
+    "OPENCV": ((0, 1, 2, 3), (4, 5, 6, 7), False),
+    "FULL_OPENCV": ((0, 1, 2, 3), (4, 5, 6, 7, 8, 9, 10, 11), False),
+    "OPENCV_FISHEYE": ((0, 1, 2, 3), (4, 5, 6, 7), True),
+}
+_POINT_CRITERIA = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 100, 1e-10)
+
+# Tabelle di remap già aperte in questo worker
+_MAPS = {}
+
+
+def supported(cameras):
+    return all(camera.model in _OPENCV_MODELS for camera in cameras.values())
+
+
+def _opencv(camera):
+    """Camera matrix (OpenCV pixel centres), distortion coefficients and fisheye flag."""
+    focal, coefficients, fisheye = _OPENCV_MODELS[camera.model]
+    fx, fy, cx, cy = (camera.params[index] for index in focal)
+    # COLMAP mette il centro del primo pixel in (0.5, 0.5), OpenCV in (0, 0)
+    matrix = np.array([[fx, 0, cx - 0.5], [0, fy, cy - 0.5], [0, 0, 1]])
+    distortion = np.zeros(4 if fisheye else max(4, len(coefficients)))
+    # SIMPLE_RADIAL e RADIAL hanno solo k1 (e k2): p1, p2 restano a zero
+    distortion[:len(coefficients)] = camera.params[list(coefficients)]
+    return matrix, distortion, fisheye
+
+
+def _pinhole_matrix(camera):
+    fx, fy, cx, cy = camera.params
+    return np.array([[fx, 0, cx - 0.5], [0, fy, cy - 0.5], [0, 0, 1]])
+
+
+def undistort_points(camera, pinhole, xys):
+    """Pixel coordinates of ``camera`` seen by the undistorted ``pinhole`` camera."""
+    if len(xys) == 0:
+        return np.zeros((0, 2))
+    matrix, distortion, fisheye = _opencv(camera)
+    points = (np.asarray(xys, dtype=np.float64) - 0.5).reshape(-1, 1, 2)
+    if fisheye:
+        undistorted = cv2.fisheye.undistortPoints(
+            points, matrix, distortion, R=np.eye(3), P=_pinhole_matrix(pinhole), criteria=_POINT_CRITERIA,
+        )
+    elif hasattr(cv2, "undistortPointsIter"):
+        undistorted = cv2.undistortPointsIter(
+            points, matrix, distortion, np.eye(3), _pinhole_matrix(pinhole), _POINT_CRITERIA,
+        )
+    else:
+        # OpenCV 5: i criteri di arresto sono passati a undistortPoints
+        undistorted = cv2.undistortPoints(
+            points, matrix, distortion, R=np.eye(3), P=_pinhole_matrix(pinhole), criteria=_POINT_CRITERIA,
+        )
+    return undistorted.reshape(-1, 2) + 0.5
+
+
+def undistorted_camera(camera):
+    """PINHOLE camera without blank pixels, as COLMAP's ``UndistortCamera``."""
+    focal, _, _ = _OPENCV_MODELS[camera.model]
+    fx, fy, cx, cy = (float(camera.params[index]) for index in focal)
+    pinhole = Camera(camera.id, "PINHOLE", camera.width, camera.height, np.array([fx, fy, cx, cy]))
+    if camera.model in ("SIMPLE_PINHOLE", "PINHOLE"):
+        return pinhole
+    width, height = camera.width, camera.height
+
+    # Bordi dell'immagine distorta visti dalla camera senza distorsione
+    ys, xs = np.arange(height) + 0.5, np.arange(width) + 0.5
+    left = undistort_points(camera, pinhole, np.stack([np.full(height, 0.5), ys], axis=1))[:, 0]
+    right = undistort_points(camera, pinhole, np.stack([np.full(height, width - 0.5), ys], axis=1))[:, 0]
+    top = undistort_points(camera, pinhole, np.stack([xs, np.full(width, 0.5)], axis=1))[:, 1]
+    bottom = undistort_points(camera, pinhole, np.stack([xs, np.full(width, height - 0.5)], axis=1))[:, 1]
+
+    # blank_pixels = 0: la scala che non lascia pixel vuoti
+    scale_x = 1.0 / max(cx / (cx - left.max()), (width - 0.5 - cx) / (right.min() - cx))
+    scale_y = 1.0 / max(cy / (cy - top.max()), (height - 0.5 - cy) / (bottom.min() - cy))
+    scale_x = float(np.clip(scale_x, MIN_SCALE, MAX_SCALE))
+    scale_y = float(np.clip(scale_y, MIN_SCALE, MAX_SCALE))
+    new_width, new_height = max(1, int(scale_x * width)), max(1, int(scale_y * height))
+    params = np.array([fx, fy, cx * new_width / width, cy * new_height / height])
+    return Camera(camera.id, "PINHOLE", new_width, new_height, params)
+
+
+def output_camera(camera, target=None):
+    """Undistorted PINHOLE camera, fitted into ``target`` when given."""
+    pinhole = undistorted_camera(camera)
+    if target is None:
+        return pinhole
+    size = fit_size(pinhole.width, pinhole.height, *target)
+    return pinhole if size == (pinhole.width, pinhole.height) else rescale_camera(pinhole, *size)[0]
+
+
+def _source_size(camera, pinhole):
+    """Size the distorted image is area-downscaled to before remapping.
+
+    Bilinear remap aliases when shrinking by more than 2x: the source is
+    first reduced to twice the output resolution.
+    """
+    scale = pinhole.width / undistorted_camera(camera).width
+    if scale >= 0.5:
+        return camera.width, camera.height
+    return max(1, round(camera.width * 2 * scale)), max(1, round(camera.height * 2 * scale))
+
+
+def remap_tables(camera, pinhole, cache_dir):
+    """Paths of the fixed-point remap tables from ``camera`` to ``pinhole``, built once."""
+    key = hashlib.sha1(repr((
+        camera.model, camera.width, camera.height, camera.params.tolist(),
+        pinhole.width, pinhole.height, pinhole.params.tolist(),
+    )).encode()).hexdigest()[:16]
+    paths = (os.path.join(cache_dir, f"{key}_xy.npy"), os.path.join(cache_dir, f"{key}_frac.npy"))
+    if all(os.path.exists(path) for path in paths):
+        return paths
+    matrix, distortion, fisheye = _opencv(camera)
+    size = (pinhole.width, pinhole.height)
+    if fisheye:
+        maps = cv2.fisheye.initUndistortRectifyMap(
+            matrix, distortion, np.eye(3), _pinhole_matrix(pinhole), size, cv2.CV_16SC2,
+        )
+    else:
+        maps = cv2.initUndistortRectifyMap(matrix, distortion, None, _pinhole_matrix(pinhole), size, cv2.CV_16SC2)
+    os.makedirs(cache_dir, exist_ok=True)
+    for path, table in zip(paths, maps):
+        # Scrittura atomica: più conversioni possono condividere la cartella
+        tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+        np.save(tmp_path, table)
+        os.replace(tmp_path, path)
+    return paths
+
+
+def _remap(task):
+    source_file, destination_file, tables, source_size = task
+    cv2.setNumThreads(1)
+    if tables not in _MAPS:
+        # mmap: le pagine delle tabelle sono condivise tra i worker
+        _MAPS[tables] = tuple(np.load(path, mmap_mode="r") for path in tables)
+    image = cv2.imread(source_file, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Cannot read {source_file}")
+    if (image.shape[1], image.shape[0]) != source_size:
+        image = cv2.resize(image, source_size, interpolation=cv2.INTER_AREA)
+    xy, frac = _MAPS[tables]
+    undistorted = cv2.remap(image, np.asarray(xy), np.asarray(frac), cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_CONSTANT)
+    os.makedirs(os.path.dirname(destination_file), exist_ok=True)
+    write_image(destination_file, undistorted)
+
+
+def undistort_model(model_path, image_dir, output_dir, sparse_dir, cache_dir, target=None, names=None, workers=None):
+    """Undistort the images of ``model_path`` into ``output_dir`` and write the PINHOLE model.
+
+    With ``names`` only those images are remapped; the model is always
+    written whole. Returns the report entry.
+    """
+    cameras = read_cameras_binary(os.path.join(model_path, "cameras.bin"))
+    images = read_images_arrays(os.path.join(model_path, "images.bin"))
+
+    started = time.perf_counter()
+    pinholes, sources, tables = {}, {}, {}
+    for camera_id, camera in cameras.items():
+        pinholes[camera_id] = output_camera(camera, target)
+        source_size = _source_size(camera, pinholes[camera_id])
+        sources[camera_id] = source_size
+        source_camera = camera if source_size == (camera.width, camera.height) else rescale_camera(camera, *source_size)[0]
+        tables[camera_id] = remap_tables(source_camera, pinholes[camera_id], cache_dir)
+    tables_seconds = time.perf_counter() - started
+
+    # Punti 2D nelle coordinate delle camere PINHOLE, camera per camera
+    xys = np.empty_like(images.xys)
+    point_cameras = np.repeat(images.camera_ids, np.diff(images.point_offsets))
+    for camera_id, camera in cameras.items():
+        mask = point_cameras == camera_id
+        xys[mask] = undistort_points(camera, pinholes[camera_id], images.xys[mask])
+
+    os.makedirs(sparse_dir, exist_ok=True)
+    write_cameras_binary(pinholes, os.path.join(sparse_dir, "cameras.bin"))
+    write_images_arrays(images._replace(xys=xys), os.path.join(sparse_dir, "images.bin"))
+    # Copia + rename: sparse/0 può contenere hardlink della cache
+    points_path = os.path.join(sparse_dir, "points3D.bin")
+    shutil.copyfile(os.path.join(model_path, "points3D.bin"), f"{points_path}.tmp-{os.getpid()}")
+    os.replace(f"{points_path}.tmp-{os.getpid()}", points_path)
+
+    selected = set(images.names if names is None else names)
+    tasks = [
+        (os.path.join(image_dir, name), os.path.join(output_dir, name), tables[camera_id], sources[camera_id])
+        for name, camera_id in zip(images.names, images.camera_ids.tolist()) if name in selected
+    ]
+    workers = workers or available_cores()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(_remap, tasks, chunksize=max(1, len(tasks) // (workers * 4))):
+            pass
+    elapsed = time.perf_counter() - started
+    logger.info(f"Undistorted {len(tasks)} images in {elapsed:.1f}s with {workers} processes")
+    return {
+        "method": "in_process",
+        "images": len(tasks),
+        "workers": workers,
+        "cameras": {
+            str(camera_id): {"width": pinhole.width, "height": pinhole.height, "source_size": list(sources[camera_id])}
+            for camera_id, pinhole in pinholes.items()
+        },
+        "target": list(target) if target else None,
+        "tables_seconds": tables_seconds,
+        "seconds": elapsed,
+    }
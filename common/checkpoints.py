@@ -0,0 +1,95 @@
+"""Periodic training checkpoints and resume from the latest one.
+
+train.py in all three implementations accepts ``--checkpoint_iterations``
+(saves ``<model_path>/chkpnt<iteration>.pth``) and ``--start_checkpoint``.
+A job whose train.py dies mid-run continues from the newest checkpoint
+instead of iteration 0; a job resubmitted on the same output_dir does so
+only when it asks for it with ``resume``, since the checkpoints there may
+come from a run with other data or params.
+"""
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+_CHECKPOINT = re.compile(r"^chkpnt(?P<iteration>\d+)\.pth$")
+
+# Parametri gestiti qui, da non passare tali e quali a train.py
+CHECKPOINT_PARAMS = ("checkpoint_iterations", "start_checkpoint")
+
+Checkpoint = namedtuple("Checkpoint", ["iteration", "path"])
+
+
+def find_latest_checkpoint(output_dir, ignore=()):
+    """Return the newest ``chkpnt*.pth`` in ``output_dir`` not in ``ignore``, or None."""
+    if not os.path.isdir(output_dir):
+        return None
+    latest = None
+    for name in os.listdir(output_dir):
+        match = _CHECKPOINT.match(name)
+        if not match or name in ignore:
+            continue
+        iteration = int(match["iteration"])
+        if latest is None or iteration > latest.iteration:
+            latest = Checkpoint(iteration, os.path.join(output_dir, name))
+    return latest
+
+
+def checkpoint_schedule(iterations, interval=None, explicit=()):
+    """Iterations at which train.py should save a checkpoint.
+
+    ``interval`` defaults to the CHECKPOINT_INTERVAL env var (5000); 0
+    disables the periodic schedule and keeps only ``explicit`` iterations.
+    """
+    if interval is None:
+        interval = int(os.environ.get("CHECKPOINT_INTERVAL", "5000"))
+    schedule = {int(i) for i in explicit if 0 < int(i) <= iterations}
+    if interval > 0:
+        # All'ultima iterazione train.py salva comunque il modello finale
+        schedule.update(range(interval, iterations, interval))
+    return sorted(schedule)
+
+
+def checkpoint_arguments(params, interval=None, explicit=()):
+    """``--checkpoint_iterations`` for a train.py run with ``params``."""
+    extra = params.get("checkpoint_iterations") or ()
+    if not isinstance(extra, (list, tuple)):
+        extra = str(extra).split()
+    schedule = checkpoint_schedule(int(params.get("iterations", 30000)), interval, [*explicit, *extra])
+    if not schedule:
+        return []
+    return ["--checkpoint_iterations", *map(str, schedule)]
+
+
+def run_training(job, command, output_dir, resume=False, max_attempts=0, **kwargs):
+    """Run train.py, restarting from the latest checkpoint if it dies.
+
+    A failed run is retried at most ``max_attempts`` times and only while it
+    keeps producing newer checkpoints, so a deterministic crash is not
+    replayed forever. Without ``resume`` the checkpoints already in
+    ``output_dir`` are never used, not even by the retries. Returns ``(process, resumed_from)`` where
+    ``resumed_from`` lists the checkpoint iterations each attempt started at.
+    """
+    resumed_from = []
+    attempts = 0
+    # Senza resume i chkpnt di un run precedente non sono di questo job
+    stale = () if resume or not os.path.isdir(output_dir) else set(os.listdir(output_dir))
+    while True:
+        start = find_latest_checkpoint(output_dir, stale) if resume or attempts else None
+        attempt_command = list(command)
+        if start is not None:
+            logger.info(f"Resuming training from {start.path} (iteration {start.iteration})")
+            attempt_command.extend(["--start_checkpoint", start.path])
+            resumed_from.append(start.iteration)
+        process = job.run_process(attempt_command, **kwargs)
+        if process.returncode == 0 or job.cancel_requested or attempts >= max_attempts:
+            return process, resumed_from
+        latest = find_latest_checkpoint(output_dir, stale)
+        if latest is None or (start is not None and latest.iteration <= start.iteration):
+            logger.warning("Training failed without a newer checkpoint, not retrying")
+            return process, resumed_from
+        attempts += 1
+        logger.warning(f"Training exited with code {process.returncode}, "
+                       f"retry {attempts}/{max_attempts} from iteration {latest.iteration}")
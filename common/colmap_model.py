@@ -0,0 +1,347 @@
+"""Reader for COLMAP binary sparse models (cameras/images/points3D.bin).
+
+The files are memory-mapped and decoded with numpy structured dtypes into
+column arrays (``read_images_arrays``, ``read_points3D_arrays``); the only
+Python loop is the walk over the variable-length record offsets. The
+per-record ``read_*_binary`` functions keep the records of COLMAP's
+``read_write_model.py`` so code ported from the training repositories'
+utils keeps working unchanged.
+"""
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+Camera = namedtuple("Camera", ["id", "model", "width", "height", "params"])
+Image = namedtuple("Image", ["id", "qvec", "tvec", "camera_id", "name", "xys", "point3D_ids"])
+Point3D = namedtuple("Point3D", ["id", "xyz", "rgb", "error", "image_ids", "point2D_idxs"])
+
+# Colonne di un intero file: i punti 2D/le track dell'elemento i sono [offsets[i], offsets[i + 1])
+ImageArrays = namedtuple(
+    "ImageArrays", ["ids", "qvecs", "tvecs", "camera_ids", "names", "point_offsets", "xys", "point3D_ids"]
+)
+PointArrays = namedtuple(
+    "PointArrays", ["ids", "xyz", "rgb", "errors", "track_offsets", "image_ids", "point2D_idxs"]
+)
+
+IMAGE_HEADER = np.dtype([("id", "<i4"), ("qvec", "<f8", 4), ("tvec", "<f8", 3), ("camera_id", "<i4")])
+POINT2D = np.dtype([("xy", "<f8", 2), ("point3D_id", "<i8")])
+POINT3D_HEADER = np.dtype([
+    ("id", "<u8"), ("xyz", "<f8", 3), ("rgb", "u1", 3), ("error", "<f8"), ("track_length", "<u8"),
+])
+TRACK_ELEMENT = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+# Vertice di points3D.ply come lo scrive storePly dei loader di training (normali a zero)
+PLY_VERTEX = np.dtype([
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("nx", "<f4"), ("ny", "<f4"), ("nz", "<f4"),
+    ("red", "u1"), ("green", "u1"), ("blue", "u1"),
+])
+# Indici di gather per blocco: limita la memoria su modelli con milioni di punti
+_GATHER_CHUNK = 1 << 16
+
+# model_id -> (nome, numero di parametri)
+CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3),
+    1: ("PINHOLE", 4),
+    2: ("SIMPLE_RADIAL", 4),
+    3: ("RADIAL", 5),
+    4: ("OPENCV", 8),
+    5: ("OPENCV_FISHEYE", 8),
+    6: ("FULL_OPENCV", 12),
+    7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4),
+    9: ("RADIAL_FISHEYE", 5),
+    10: ("THIN_PRISM_FISHEYE", 12),
+}
+
+CAMERA_MODEL_IDS = {name: model_id for model_id, (name, _) in CAMERA_MODELS.items()}
+
+MODEL_FILES = ("cameras.bin", "images.bin", "points3D.bin")
+
+
+def _read(f, fmt):
+    return struct.unpack("<" + fmt, f.read(struct.calcsize("<" + fmt)))
+
+
+def read_cameras_binary(path):
+    cameras = {}
+    with open(path, "rb") as f:
+        (count,) = _read(f, "Q")
+        for _ in range(count):
+            camera_id, model_id, width, height = _read(f, "iiQQ")
+            name, num_params = CAMERA_MODELS[model_id]
+            params = np.array(_read(f, "d" * num_params))
+            cameras[camera_id] = Camera(camera_id, name, width, height, params)
+    return cameras
+
+
+def _map(path):
+    """Read-only memory map of ``path`` (an empty buffer for empty files)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _gather(buffer, offsets, dtype):
+    """Records of ``dtype`` starting at arbitrary (unaligned) byte ``offsets``."""
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    out = np.empty(len(offsets), dtype=dtype)
+    out_bytes = out.view(np.uint8).reshape(len(offsets), dtype.itemsize)
+    columns = np.arange(dtype.itemsize)
+    for start in range(0, len(offsets), _GATHER_CHUNK):
+        chunk = offsets[start:start + _GATHER_CHUNK]
+        out_bytes[start:start + len(chunk)] = raw[chunk[:, None] + columns]
+    return out
+
+
+def _scatter(data, offsets, records):
+    """Inverse of ``_gather``: write ``records`` at the byte ``offsets`` of ``data``."""
+    record_bytes = records.view(np.uint8).reshape(len(offsets), records.dtype.itemsize)
+    columns = np.arange(records.dtype.itemsize)
+    for start in range(0, len(offsets), _GATHER_CHUNK):
+        chunk = offsets[start:start + _GATHER_CHUNK]
+        data[chunk[:, None] + columns] = record_bytes[start:start + len(chunk)]
+
+
+def _ranges(starts, lengths, itemsize):
+    """Byte offsets of the ``lengths[i]`` consecutive items from every ``starts[i]``."""
+    ends = np.cumsum(lengths)
+    first = np.repeat(ends - lengths, lengths)
+    return np.repeat(starts, lengths) + (np.arange(ends[-1] if len(ends) else 0) - first) * itemsize
+
+
+def read_images_arrays(path):
+    buffer = _map(path)
+    if len(buffer) == 0:
+        count = 0
+    else:
+        (count,) = struct.unpack_from("<Q", buffer, 0)
+    headers = np.empty(count, dtype=np.int64)
+    blocks = np.empty(count, dtype=np.int64)
+    lengths = np.empty(count, dtype=np.int64)
+    names = []
+    offset = 8
+    for i in range(count):
+        headers[i] = offset
+        end = buffer.find(b"\x00", offset + IMAGE_HEADER.itemsize)
+        names.append(buffer[offset + IMAGE_HEADER.itemsize:end].decode("utf-8"))
+        (lengths[i],) = struct.unpack_from("<Q", buffer, end + 1)
+        blocks[i] = end + 9
+        offset = blocks[i] + lengths[i] * POINT2D.itemsize
+
+    header = _gather(buffer, headers, IMAGE_HEADER)
+    # I punti 2D di un'immagine sono contigui: una vista per immagine, nessun gather per punto
+    points2d = np.concatenate([
+        np.frombuffer(buffer, dtype=POINT2D, count=int(length), offset=int(block))
+        for block, length in zip(blocks, lengths)
+    ]) if count else np.empty(0, dtype=POINT2D)
+    return ImageArrays(
+        header["id"], header["qvec"], header["tvec"], header["camera_id"], names,
+        np.concatenate([[0], np.cumsum(lengths)]), points2d["xy"], points2d["point3D_id"],
+    )
+
+
+def _point_offsets(buffer):
+    """Byte offset of every points3D.bin record."""
+    if len(buffer) == 0:
+        count = 0
+    else:
+        (count,) = struct.unpack_from("<Q", buffer, 0)
+    # Record a lunghezza variabile: l'offset del successivo dipende dalla track del precedente,
+    # letta all'offset del precedente. È una catena, nessun passo strided/cumsum la evita:
+    # qui si legge solo track_length (8 byte per punto), header e track li raccoglie _gather
+    length_at = POINT3D_HEADER.fields["track_length"][1]
+    header_size, track_size = POINT3D_HEADER.itemsize, TRACK_ELEMENT.itemsize
+    unpack_length = struct.Struct("<Q").unpack_from
+    headers = [0] * count
+    offset = 8
+    for i in range(count):
+        headers[i] = offset
+        offset += header_size + track_size * unpack_length(buffer, offset + length_at)[0]
+    return np.array(headers, dtype=np.int64)
+
+
+def read_points3D_arrays(path):
+    buffer = _map(path)
+    headers = _point_offsets(buffer)
+    header = _gather(buffer, headers, POINT3D_HEADER)
+    lengths = header["track_length"].astype(np.int64)
+    track = _gather(buffer, _ranges(headers + POINT3D_HEADER.itemsize, lengths, TRACK_ELEMENT.itemsize), TRACK_ELEMENT)
+    return PointArrays(
+        header["id"].astype(np.int64), header["xyz"], header["rgb"], header["error"],
+        np.concatenate([[0], np.cumsum(lengths)]), track["image_id"], track["point2D_idx"],
+    )
+
+
+def read_points3D_colors(path):
+    """``(xyz, rgb)`` of points3D.bin without gathering the tracks."""
+    buffer = _map(path)
+    header = _gather(buffer, _point_offsets(buffer), POINT3D_HEADER)
+    return header["xyz"], header["rgb"]
+
+
+def read_images_binary(path):
+    arrays = read_images_arrays(path)
+    images = {}
+    for i, image_id in enumerate(arrays.ids.tolist()):
+        start, end = arrays.point_offsets[i], arrays.point_offsets[i + 1]
+        images[image_id] = Image(
+            image_id, arrays.qvecs[i], arrays.tvecs[i], int(arrays.camera_ids[i]), arrays.names[i],
+            arrays.xys[start:end], arrays.point3D_ids[start:end],
+        )
+    return images
+
+
+def read_points3D_binary(path):
+    arrays = read_points3D_arrays(path)
+    points = {}
+    for i, point_id in enumerate(arrays.ids.tolist()):
+        start, end = arrays.track_offsets[i], arrays.track_offsets[i + 1]
+        points[point_id] = Point3D(
+            point_id, arrays.xyz[i], arrays.rgb[i], float(arrays.errors[i]),
+            arrays.image_ids[start:end], arrays.point2D_idxs[start:end],
+        )
+    return points
+
+
+def read_model(path):
+    return (
+        read_cameras_binary(os.path.join(path, "cameras.bin")),
+        read_images_binary(os.path.join(path, "images.bin")),
+        read_points3D_binary(os.path.join(path, "points3D.bin")),
+    )
+
+
+def _write_atomic(path, data):
+    # Nuovo file + rename: i modelli in cache sono hardlink e non vanno modificati sul posto
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_cameras_binary(cameras, path):
+    data = bytearray(struct.pack("<Q", len(cameras)))
+    for camera in cameras.values():
+        data += struct.pack("<iiQQ", camera.id, CAMERA_MODEL_IDS[camera.model], camera.width, camera.height)
+        data += np.asarray(camera.params, dtype="<f8").tobytes()
+    _write_atomic(path, data)
+
+
+def write_images_arrays(images, path):
+    data = bytearray(struct.pack("<Q", len(images.ids)))
+    header = np.empty(len(images.ids), dtype=IMAGE_HEADER)
+    header["id"], header["qvec"], header["tvec"], header["camera_id"] = (
+        images.ids, images.qvecs, images.tvecs, images.camera_ids,
+    )
+    points2d = np.empty(len(images.xys), dtype=POINT2D)
+    points2d["xy"], points2d["point3D_id"] = images.xys, images.point3D_ids
+    for i in range(len(images.ids)):
+        start, end = images.point_offsets[i], images.point_offsets[i + 1]
+        data += header[i].tobytes()
+        data += images.names[i].encode("utf-8") + b"\x00"
+        data += struct.pack("<Q", end - start)
+        data += points2d[start:end].tobytes()
+    _write_atomic(path, data)
+
+
+def write_points3D_arrays(points, path):
+    lengths = np.diff(points.track_offsets)
+    # Offset di ogni record nel file, poi header e track scritti con un solo scatter ciascuno
+    sizes = POINT3D_HEADER.itemsize + TRACK_ELEMENT.itemsize * lengths
+    offsets = 8 + np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64) if len(sizes) else sizes
+    data = np.zeros(8 + int(sizes.sum()), dtype=np.uint8)
+    data[:8] = np.frombuffer(struct.pack("<Q", len(points.ids)), dtype=np.uint8)
+
+    header = np.empty(len(points.ids), dtype=POINT3D_HEADER)
+    header["id"], header["xyz"], header["rgb"], header["error"], header["track_length"] = (
+        points.ids, points.xyz, points.rgb, points.errors, lengths,
+    )
+    _scatter(data, offsets, header)
+    track = np.empty(int(lengths.sum()), dtype=TRACK_ELEMENT)
+    track["image_id"], track["point2D_idx"] = points.image_ids, points.point2D_idxs
+    _scatter(data, _ranges(offsets + POINT3D_HEADER.itemsize, lengths, TRACK_ELEMENT.itemsize), track)
+    _write_atomic(path, data.tobytes())
+
+
+def write_points3D_ply(xyz, rgb, path):
+    """Binary little-endian points3D.ply, the file the scene loaders build on first load."""
+    vertices = np.zeros(len(xyz), dtype=PLY_VERTEX)
+    vertices["x"], vertices["y"], vertices["z"] = np.asarray(xyz, dtype=np.float32).T.reshape(3, -1)
+    vertices["red"], vertices["green"], vertices["blue"] = np.asarray(rgb, dtype=np.uint8).T.reshape(3, -1)
+    header = "".join([
+        "ply\n",
+        "format binary_little_endian 1.0\n",
+        f"element vertex {len(vertices)}\n",
+        *(f"property {'float' if PLY_VERTEX[name].kind == 'f' else 'uchar'} {name}\n" for name in PLY_VERTEX.names),
+        "end_header\n",
+    ])
+    _write_atomic(path, header.encode("ascii") + vertices.tobytes())
+    return len(header) + vertices.nbytes
+
+
+def select_points(points, mask):
+    """Subset of ``points`` (boolean mask or indices) with their tracks."""
+    keep = np.zeros(len(points.ids), dtype=bool)
+    keep[mask] = True
+    lengths = np.diff(points.track_offsets)
+    in_track = np.repeat(keep, lengths)
+    return PointArrays(
+        points.ids[keep], points.xyz[keep], points.rgb[keep], points.errors[keep],
+        np.concatenate([[0], np.cumsum(lengths[keep])]).astype(np.int64),
+        points.image_ids[in_track], points.point2D_idxs[in_track],
+    )
+
+
+def qvec2rotmat(qvec):
+    w, x, y, z = qvec
+    return np.array([
+        [1 - 2 * y * y - 2 * z * z, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y],
+        [2 * x * y + 2 * w * z, 1 - 2 * x * x - 2 * z * z, 2 * y * z - 2 * w * x],
+        [2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x * x - 2 * y * y],
+    ])
+
+
+def rotmat2qvec(R):
+    """Rotation matrix to ``[w, x, y, z]`` with w >= 0, as in read_write_model.py."""
+    Rxx, Ryx, Rzx, Rxy, Ryy, Rzy, Rxz, Ryz, Rzz = R.flat
+    K = np.array([
+        [Rxx - Ryy - Rzz, 0, 0, 0],
+        [Ryx + Rxy, Ryy - Rxx - Rzz, 0, 0],
+        [Rzx + Rxz, Rzy + Ryz, Rzz - Rxx - Ryy, 0],
+        [Ryz - Rzy, Rzx - Rxz, Rxy - Ryx, Rxx + Ryy + Rzz],
+    ]) / 3.0
+    eigvals, eigvecs = np.linalg.eigh(K)
+    qvec = eigvecs[[3, 0, 1, 2], np.argmax(eigvals)]
+    if qvec[0] < 0:
+        qvec *= -1
+    return qvec
+
+
+def model_stats(path):
+    """Registered images, points, mean track length and mean reprojection error."""
+    images = read_images_arrays(os.path.join(path, "images.bin"))
+    points = read_points3D_arrays(os.path.join(path, "points3D.bin"))
+    track_lengths = np.diff(points.track_offsets)
+    # Come Reconstruction::ComputeMeanReprojectionError: media sui punti con errore valido (-1 = non calcolato)
+    errors = points.errors[points.errors >= 0]
+    return {
+        "registered_images": len(images.ids),
+        "points": len(points.ids),
+        "observations": int(track_lengths.sum()),
+        "mean_track_length": float(track_lengths.mean()) if len(track_lengths) else 0.0,
+        "mean_reprojection_error": float(errors.mean()) if len(errors) else None,
+    }
+
+
+def model_fingerprint(path):
+    """Cheap identity of a model directory: size and mtime of its files."""
+    fingerprint = {}
+    for name in MODEL_FILES:
+        file_path = os.path.join(path, name)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            fingerprint[name] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
@@ -0,0 +1,269 @@
+"""Resident Depth Anything V2 inference for /depth_regularization.
+
+``run.py`` reloads the ViT-L checkpoint on every call and infers one image at
+a time. With ``DEPTH_MODE=resident`` a ResidentWorker hosts a DepthService
+that loads the model once, decodes and pre-processes images on a prefetch
+thread pool while the GPU works, groups images of the same resolution into
+batches and writes every depth map as soon as its batch is done.
+
+Outputs match ``run.py --pred-only --grayscale``: per-image min-max
+normalised uint8 depth, replicated on three channels, saved as
+``<outdir>/<image stem>.png``. With ``bits=16`` the same normalised depth
+is written as a single-channel uint16 PNG, which train.py reads as is.
+
+The worker is stopped (model unloaded) as soon as a job of another kind
+takes the GPU, see ``JobManager.add_resident``; consecutive depth jobs
+keep it loaded.
+
+The model is pluggable through ``DEPTH_BACKEND`` (``"module:Class"``);
+TinyDepthBackend is a numpy stand-in for tests without a GPU or weights.
+"""
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from common.worker import ResidentWorker, load_object
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "common.depth:DepthAnythingV2Backend"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+# Stesse configurazioni di run.py
+MODEL_CONFIGS = {
+    "vits": {"encoder": "vits", "features": 64, "out_channels": [48, 96, 192, 384]},
+    "vitb": {"encoder": "vitb", "features": 128, "out_channels": [96, 192, 384, 768]},
+    "vitl": {"encoder": "vitl", "features": 256, "out_channels": [256, 512, 1024, 1024]},
+    "vitg": {"encoder": "vitg", "features": 384, "out_channels": [1536, 1536, 1536, 1536]},
+}
+
+
+def depth_mode():
+    return os.environ.get("DEPTH_MODE", "subprocess")
+
+
+def create_depth_worker():
+    """The depth worker of a service, or None in subprocess mode."""
+    if depth_mode() != "resident":
+        return None
+    return ResidentWorker(
+        "common.depth:DepthService",
+        {
+            "backend": os.environ.get("DEPTH_BACKEND", DEFAULT_BACKEND),
+            "backend_options": {"encoder": os.environ.get("DEPTH_ENCODER", "vitl")},
+            "batch_size": int(os.environ.get("DEPTH_BATCH_SIZE", "4")),
+            "decode_workers": int(os.environ.get("DEPTH_DECODE_WORKERS", "4")),
+        },
+        name="depth",
+    )
+
+
+def depth_identity(bits=8):
+    """``(model, encoder)`` of the depth maps produced in the current mode."""
+    backend = os.environ.get("DEPTH_BACKEND", DEFAULT_BACKEND)
+    # Le mappe a 16 bit sono altre mappe: cambiare precisione le rigenera
+    suffix = "" if bits == 8 else f"@{bits}bit"
+    if depth_mode() == "resident" and backend != DEFAULT_BACKEND:
+        return backend, os.environ.get("DEPTH_ENCODER", "vitl") + suffix
+    # run.py e il worker residente producono le stesse mappe
+    encoder = os.environ.get("DEPTH_ENCODER", "vitl") if depth_mode() == "resident" else "vitl"
+    return "depth_anything_v2", encoder + suffix
+
+
+def list_images(images_dir):
+    return sorted(
+        name for name in os.listdir(images_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def depth_to_png(depth, bits=8):
+    """run.py post-processing: min-max to uint8, grayscale on 3 channels (one uint16 channel with 16 bits)."""
+    depth = depth.astype(np.float32)
+    span = depth.max() - depth.min()
+    depth = (depth - depth.min()) / (span if span > 0 else 1.0)
+    if bits == 16:
+        return np.round(depth * 65535.0).astype(np.uint16)
+    depth = depth * 255.0
+    return np.repeat(depth.astype(np.uint8)[..., np.newaxis], 3, axis=-1)
+
+
+class DepthAnythingV2Backend:
+    """Depth Anything V2 from the cloned repository, kept on the GPU."""
+
+    def __init__(self, encoder="vitl", input_size=518, repo_root="/workspace/Depth-Anything-V2",
+                 checkpoint=None):
+        if repo_root not in sys.path:
+            sys.path.insert(0, repo_root)
+        import cv2
+        import torch
+        import torch.nn.functional as F
+        from depth_anything_v2.dpt import DepthAnythingV2
+        from depth_anything_v2.util.transform import NormalizeImage, PrepareForNet, Resize
+        from torchvision.transforms import Compose
+
+        self.cv2 = cv2
+        self.torch = torch
+        self.F = F
+        self.name = f"depth_anything_v2_{encoder}"
+        self.encoder = encoder
+        self.input_size = input_size
+        if torch.cuda.is_available():
+            self.device = "cuda"
+        elif torch.backends.mps.is_available():
+            self.device = "mps"
+        else:
+            self.device = "cpu"
+
+        checkpoint = checkpoint or os.path.join(repo_root, "checkpoints", f"depth_anything_v2_{encoder}.pth")
+        started = time.perf_counter()
+        model = DepthAnythingV2(**MODEL_CONFIGS[encoder])
+        model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+        self.model = model.to(self.device).eval()
+        logger.info(f"Loaded {checkpoint} on {self.device} in {time.perf_counter() - started:.1f}s")
+
+        # Stessa pipeline di DepthAnythingV2.image2tensor, ma eseguita nei thread di prefetch
+        self.transform = Compose([
+            Resize(
+                width=input_size, height=input_size, resize_target=False, keep_aspect_ratio=True,
+                ensure_multiple_of=14, resize_method="lower_bound", image_interpolation_method=cv2.INTER_CUBIC,
+            ),
+            NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+            PrepareForNet(),
+        ])
+
+    def prepare(self, raw_image):
+        image = self.cv2.cvtColor(raw_image, self.cv2.COLOR_BGR2RGB) / 255.0
+        return self.transform({"image": image})["image"]
+
+    def infer(self, batch, size):
+        torch = self.torch
+        with torch.no_grad():
+            depth = self.model(torch.from_numpy(batch).to(self.device))
+            depth = self.F.interpolate(depth[:, None], size, mode="bilinear", align_corners=True)[:, 0]
+        return depth.cpu().numpy()
+
+
+class TinyDepthBackend:
+    """CPU stand-in: box-blurred inverse luminance at 1/``stride`` resolution."""
+
+    def __init__(self, encoder="tiny", stride=8, radius=2):
+        self.name = "tiny"
+        self.encoder = encoder
+        self.stride = stride
+        self.radius = radius
+
+    def prepare(self, raw_image):
+        gray = raw_image.astype(np.float32).mean(axis=2)[::self.stride, ::self.stride] / 255.0
+        return gray[np.newaxis]
+
+    def infer(self, batch, size):
+        r = self.radius
+        padded = np.pad(batch[:, 0], ((0, 0), (r, r), (r, r)), mode="edge")
+        sums = padded.cumsum(axis=1).cumsum(axis=2)
+        sums = np.pad(sums, ((0, 0), (1, 0), (1, 0)))
+        k = 2 * r + 1
+        blurred = (sums[:, k:, k:] - sums[:, :-k, k:] - sums[:, k:, :-k] + sums[:, :-k, :-k]) / (k * k)
+        depth = 1.0 - blurred
+        full = np.repeat(np.repeat(depth, self.stride, axis=1), self.stride, axis=2)
+        return full[:, :size[0], :size[1]]
+
+
+class DepthService:
+    """Runs inside the worker: prefetch, same-resolution batching, streaming writes."""
+
+    def __init__(self, backend=DEFAULT_BACKEND, backend_options=None, batch_size=4, decode_workers=4):
+        import cv2
+
+        self.cv2 = cv2
+        self.backend = load_object(backend)(**(backend_options or {}))
+        self.batch_size = batch_size
+        self.decode_workers = decode_workers
+        logger.info(f"Depth service ready with {self.backend.name} (batch {batch_size})")
+
+    def handle(self, op, payload, emit):
+        if op == "infer":
+            return self.infer(emit=emit, **payload)
+        if op == "info":
+            return {"model": self.backend.name, "encoder": self.backend.encoder}
+        raise ValueError(f"Unknown depth op: {op}")
+
+    def _load(self, path):
+        raw = self.cv2.imread(path)
+        if raw is None:
+            raise ValueError(f"Cannot read image {path}")
+        return path, raw.shape[:2], self.backend.prepare(raw)
+
+    def _write(self, path, depth, bits):
+        if not self.cv2.imwrite(path, depth_to_png(depth, bits)):
+            raise OSError(f"Cannot write depth map {path}")
+
+    def infer(self, images_dir, outdir, images=None, batch_size=None, bits=8, emit=None):
+        names = list_images(images_dir) if images is None else list(images)
+        batch_size = batch_size or self.batch_size
+        os.makedirs(outdir, exist_ok=True)
+        total = len(names)
+        done = 0
+        batches = 0
+        infer_s = 0.0
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(self.decode_workers, thread_name_prefix="depth-decode") as decode_pool, \
+                ThreadPoolExecutor(2, thread_name_prefix="depth-write") as write_pool:
+            writes = []
+
+            def run_batch(group, size):
+                nonlocal done, batches, infer_s
+                t0 = time.perf_counter()
+                depths = self.backend.infer(np.stack([tensor for _, tensor in group]), size)
+                infer_s += time.perf_counter() - t0
+                batches += 1
+                for (path, _), depth in zip(group, depths):
+                    stem = os.path.splitext(os.path.basename(path))[0]
+                    writes.append(write_pool.submit(self._write, os.path.join(outdir, f"{stem}.png"), depth, bits))
+                done += len(group)
+                if emit is not None:
+                    emit({"type": "progress", "iteration": done, "total": total,
+                          "percent": int(100 * done / total)})
+
+            # Finestra di prefetch limitata: la decodifica resta avanti di qualche batch, non di tutta la scena
+            window = max(batch_size * 2, self.decode_workers)
+            pending = deque()
+            groups = {}
+            for name in names:
+                pending.append(decode_pool.submit(self._load, os.path.join(images_dir, name)))
+                if len(pending) < window:
+                    continue
+                self._collect(pending.popleft().result(), groups, batch_size, run_batch)
+            while pending:
+                self._collect(pending.popleft().result(), groups, batch_size, run_batch)
+            for size, group in groups.items():
+                if group:
+                    run_batch(group, size)
+            for write in writes:
+                write.result()
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"✅ {total} depth maps in {elapsed:.1f}s ({batches} batches, inference {infer_s:.1f}s)")
+        return {
+            "model": self.backend.name,
+            "count": total,
+            "batches": batches,
+            "infer_s": infer_s,
+            "elapsed_s": elapsed,
+            "images_per_s": total / elapsed if elapsed > 0 else None,
+        }
+
+    @staticmethod
+    def _collect(loaded, groups, batch_size, run_batch):
+        path, size, tensor = loaded
+        group = groups.setdefault(size, [])
+        group.append((path, tensor))
+        if len(group) >= batch_size:
+            run_batch(group, size)
+            groups[size] = []
@@ -0,0 +1,116 @@
+"""Manifest of the depth maps already generated for a scene.
+
+``<depths_dir>/depth_manifest.json`` records, for every source image, the
+content hash it was generated from, the depth model/encoder and the size of
+the written map. A re-run of /depth_regularization only sends new or
+changed images through inference and only re-fits depth_params.json for
+those, unless the COLMAP model itself changed.
+"""
+import json
+import logging
+import os
+import struct
+
+from common.colmap_model import model_fingerprint
+from common.depth import list_images
+from common.hashing import file_sha1
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "depth_manifest.json"
+VERSION = 1
+
+
+def png_size(path):
+    """``[width, height]`` from the IHDR chunk, without decoding the image."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(24)
+    except OSError:
+        return None
+    if len(header) < 24 or header[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    return list(struct.unpack(">II", header[16:24]))
+
+
+def depth_name(image_name):
+    return os.path.splitext(image_name)[0] + ".png"
+
+
+class DepthManifest:
+    def __init__(self, depths_dir, model, encoder):
+        self.depths_dir = depths_dir
+        self.path = os.path.join(depths_dir, MANIFEST_FILE)
+        self.model = model
+        self.encoder = encoder
+        self.images = {}
+        self.colmap = None
+        self._hashes = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == VERSION:
+                self.images = data.get("images", {})
+                self.colmap = data.get("colmap")
+
+    def _hash(self, images_dir, name):
+        """Content hash, reusing the recorded one while size and mtime match."""
+        stat = os.stat(os.path.join(images_dir, name))
+        key = [stat.st_size, stat.st_mtime_ns]
+        entry = self.images.get(name)
+        if entry and entry.get("stat") == key:
+            return entry["sha1"], key
+        cached = self._hashes.get(name)
+        if cached is None or cached[1] != key:
+            cached = self._hashes[name] = (file_sha1(os.path.join(images_dir, name)), key)
+        return cached
+
+    def _up_to_date(self, images_dir, name):
+        entry = self.images.get(name)
+        if entry is None or entry.get("model") != self.model or entry.get("encoder") != self.encoder:
+            return False
+        if self._hash(images_dir, name)[0] != entry["sha1"]:
+            return False
+        return png_size(os.path.join(self.depths_dir, depth_name(name))) == entry.get("size")
+
+    def plan(self, images_dir):
+        """Return ``(stale, removed)`` image names."""
+        names = list_images(images_dir)
+        stale = [name for name in names if not self._up_to_date(images_dir, name)]
+        present = set(names)
+        removed = [name for name in self.images if name not in present]
+        return stale, removed
+
+    def record(self, images_dir, names):
+        missing = []
+        for name in names:
+            size = png_size(os.path.join(self.depths_dir, depth_name(name)))
+            if size is None:
+                missing.append(name)
+                self.images.pop(name, None)
+                continue
+            sha1, stat = self._hash(images_dir, name)
+            self.images[name] = {"sha1": sha1, "stat": stat, "model": self.model,
+                                 "encoder": self.encoder, "size": size}
+        return missing
+
+    def forget(self, names):
+        """Drop images that left the scene, together with their depth maps."""
+        for name in names:
+            self.images.pop(name, None)
+            path = os.path.join(self.depths_dir, depth_name(name))
+            if os.path.exists(path):
+                os.remove(path)
+
+    def colmap_changed(self, sparse_dir):
+        return self.colmap != model_fingerprint(sparse_dir)
+
+    def record_colmap(self, sparse_dir):
+        self.colmap = model_fingerprint(sparse_dir)
+
+    def save(self):
+        os.makedirs(self.depths_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": VERSION, "images": self.images, "colmap": self.colmap}, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,193 @@
+"""Per-scene pack of the depth maps, memory-mapped by training.
+
+train.py decodes ``depths/<stem>.png`` with cv2 for every camera it
+loads. ``build_pack`` stores every map of a scene, single channel and in
+the dtype of its PNG (uint8 from run.py, uint16 from the resident worker
+with ``bits=16``), in one ``depths.pack`` file with a JSON index; a
+rebuild copies the unchanged maps from the previous pack and decodes only
+the new ones.
+
+``DepthPack.get`` returns a zero-copy view of the memory-mapped file.
+Training uses it through a shim: ``python -m common.depth_pack train.py
+...`` wraps ``cv2.imread`` so that a depth map found in the pack next to
+the requested PNG is returned without decoding, with the same values the
+PNG would have (the ``/ 2**16`` of the training code still applies).
+"""
+import json
+import logging
+import os
+import random
+import runpy
+import sys
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PACK_FILE = "depths.pack"
+INDEX_FILE = "depths_pack.json"
+VERSION = 1
+# Ogni mappa inizia a un offset allineato: la vista numpy non attraversa mai un confine di riga di cache
+ALIGNMENT = 64
+COMPARE_SAMPLE = 20
+
+
+def pack_paths(depths_dir):
+    return os.path.join(depths_dir, PACK_FILE), os.path.join(depths_dir, INDEX_FILE)
+
+
+def _read_png(path):
+    depth = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if depth is None:
+        raise ValueError(f"Cannot read depth map {path}")
+    # run.py replica il grigio su tre canali: ne basta uno
+    return depth if depth.ndim == 2 else depth[..., 0]
+
+
+class DepthPack:
+    """Read-only, memory-mapped view of ``depths.pack``."""
+
+    def __init__(self, depths_dir):
+        pack_path, index_path = pack_paths(depths_dir)
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("version") != VERSION:
+            raise ValueError(f"Unsupported depth pack version in {index_path}")
+        self.entries = index["entries"]
+        self._data = np.memmap(pack_path, dtype=np.uint8, mode="r") if self.entries else None
+
+    def __contains__(self, stem):
+        return stem in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, stem):
+        entry = self.entries[stem]
+        return np.ndarray(entry["shape"], dtype=entry["dtype"], buffer=self._data, offset=entry["offset"])
+
+
+def build_pack(depths_dir, changed=()):
+    """Write the pack of every PNG in ``depths_dir``; ``changed`` stems are always re-read."""
+    started = time.perf_counter()
+    pack_path, index_path = pack_paths(depths_dir)
+    stems = sorted(name[:-4] for name in os.listdir(depths_dir) if name.endswith(".png"))
+    changed = set(changed)
+    try:
+        previous = DepthPack(depths_dir)
+    except (OSError, ValueError):
+        previous = None
+
+    entries = {}
+    reused = 0
+    offset = 0
+    tmp_path = f"{pack_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        for stem in stems:
+            if previous is not None and stem in previous and stem not in changed:
+                depth = previous.get(stem)
+                reused += 1
+            else:
+                depth = _read_png(os.path.join(depths_dir, f"{stem}.png"))
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            offset += padding
+            f.write(np.ascontiguousarray(depth).tobytes())
+            entries[stem] = {"offset": offset, "shape": list(depth.shape), "dtype": depth.dtype.str}
+            offset += depth.nbytes
+    del previous
+    os.replace(tmp_path, pack_path)
+
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": VERSION, "entries": entries}, f)
+    os.replace(tmp_path, index_path)
+
+    stats = {
+        "maps": len(entries),
+        "reused": reused,
+        "dtypes": sorted({entry["dtype"] for entry in entries.values()}),
+        "seconds": time.perf_counter() - started,
+    }
+    logger.info(f"Depth pack: {stats['maps']} maps ({reused} reused) in {stats['seconds']:.1f}s")
+    return stats
+
+
+def remove_pack(depths_dir):
+    """Drop the pack (the scene went back to PNG storage): the shim would serve stale maps."""
+    for path in pack_paths(depths_dir):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def compare_loading(depths_dir, sample=COMPARE_SAMPLE):
+    """Bytes on disk and per-map load time to float32, PNG decode against the pack."""
+    pack = DepthPack(depths_dir)
+    stems = sorted(pack.entries)
+    png_bytes = sum(os.path.getsize(os.path.join(depths_dir, f"{stem}.png")) for stem in stems)
+    timed = random.Random(0).sample(stems, min(sample, len(stems)))
+
+    # Stessa conversione del training: astype(float32) dopo la lettura
+    started = time.perf_counter()
+    for stem in timed:
+        _read_png(os.path.join(depths_dir, f"{stem}.png")).astype(np.float32)
+    png_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for stem in timed:
+        pack.get(stem).astype(np.float32)
+    pack_s = time.perf_counter() - started
+
+    count = max(len(timed), 1)
+    return {
+        "png_bytes": png_bytes,
+        "pack_bytes": os.path.getsize(pack_paths(depths_dir)[0]),
+        "sampled_maps": len(timed),
+        "png_load_ms": 1000 * png_s / count,
+        "pack_load_ms": 1000 * pack_s / count,
+    }
+
+
+def training_command(command, depths_dir):
+    """``command`` run through the shim when ``depths_dir`` has a pack."""
+    if not os.path.exists(pack_paths(depths_dir)[1]):
+        return command
+    return [command[0], "-m", "common.depth_pack", *command[1:]]
+
+
+def install():
+    """Serve ``cv2.imread(<depths>/<stem>.png, IMREAD_UNCHANGED)`` from the pack of that directory."""
+    imread = cv2.imread
+    packs = {}
+
+    def pack_for(directory):
+        if directory not in packs:
+            try:
+                packs[directory] = DepthPack(directory)
+            except (OSError, ValueError):
+                packs[directory] = None
+        return packs[directory]
+
+    def packed_imread(filename, flags=cv2.IMREAD_COLOR, *args):
+        if flags == cv2.IMREAD_UNCHANGED and not args and str(filename).endswith(".png"):
+            directory, name = os.path.split(os.path.abspath(filename))
+            pack = pack_for(directory)
+            if pack is not None and name[:-4] in pack:
+                return pack.get(name[:-4])
+        return imread(filename, flags, *args)
+
+    cv2.imread = packed_imread
+
+
+def main():
+    """``python -m common.depth_pack <script> [args...]``: run ``script`` with the shim installed."""
+    script = sys.argv[1]
+    install()
+    sys.argv = sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Per-image scale/offset between monocular depth and the COLMAP points.
+
+Replaces ``utils/make_depth_scale.py`` of the training repositories, which
+re-reads the model with per-record Python objects and fits every image
+serially once all depth maps exist. Here the model is read once into
+arrays and the inverse depth of every observed point is computed for all
+images in one batched projection (``SparseDepths``); each image is then a
+slice. ``DepthScaleFitter`` fits images on a thread pool as soon as their
+depth map is complete on disk, so the fit overlaps depth inference.
+
+The fit itself is the one of ``make_depth_scale.get_scales`` (median /
+mean absolute deviation), depth_params.json keeps its format.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from common.colmap_model import read_cameras_binary, read_images_arrays, read_points3D_arrays
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.2
+# Ultimo chunk di ogni PNG: se c'è, cv2.imwrite ha finito di scrivere il file
+_PNG_END = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+def depth_params_path(base_dir):
+    return os.path.join(base_dir, "sparse", "0", "depth_params.json")
+
+
+def image_stem(name):
+    n_remove = len(name.split(".")[-1]) + 1
+    return name[:-n_remove]
+
+
+def png_complete(path):
+    try:
+        with open(path, "rb") as f:
+            f.seek(-len(_PNG_END), os.SEEK_END)
+            return f.read() == _PNG_END
+    except OSError:
+        return False
+
+
+def _third_rows(qvecs):
+    """Last row of the rotation matrix of every quaternion: all the depth needs."""
+    w, x, y, z = np.asarray(qvecs, dtype=np.float64).reshape(-1, 4).T
+    return np.stack([2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x * x - 2 * y * y], axis=1)
+
+
+class SparseDepths:
+    """Observed 2D points and their COLMAP inverse depth, for every image of a model."""
+
+    def __init__(self, sparse_dir):
+        cameras = read_cameras_binary(os.path.join(sparse_dir, "cameras.bin"))
+        images = read_images_arrays(os.path.join(sparse_dir, "images.bin"))
+        points = read_points3D_arrays(os.path.join(sparse_dir, "points3D.bin"))
+        points3d_ordered = np.zeros([points.ids.max() + 1 if len(points.ids) else 1, 3])
+        points3d_ordered[points.ids] = points.xyz
+
+        owner = np.repeat(np.arange(len(images.ids)), np.diff(images.point_offsets))
+        ids = images.point3D_ids
+        valid = (ids >= 0) & (ids < len(points3d_ordered))
+        owner, ids = owner[valid], ids[valid]
+        # Solo la z in camera: terza riga di R per punto 3D, più tz
+        rows = _third_rows(images.qvecs)
+        depth = np.einsum("ij,ij->i", rows[owner], points3d_ordered[ids]) + images.tvecs[owner, 2]
+
+        with np.errstate(divide="ignore"):
+            self.invdepth = 1. / depth
+        self.xys = images.xys[valid]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(owner, minlength=len(images.ids)))])
+        self.cameras = [cameras[camera_id] for camera_id in images.camera_ids.tolist()]
+        self.index = {image_stem(name): i for i, name in enumerate(images.names)}
+
+    def observations(self, stem):
+        i = self.index[stem]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.xys[start:end], self.invdepth[start:end], self.cameras[i]
+
+
+def fit_scale(invmonodepthmap, xys, invcolmapdepth, camera):
+    """Same fit as make_depth_scale.get_scales: ``(scale, offset)``, zeros if too few points."""
+    if invmonodepthmap.ndim != 2:
+        invmonodepthmap = invmonodepthmap[..., 0]
+
+    invmonodepthmap = invmonodepthmap.astype(np.float32) / (2**16)
+    s = invmonodepthmap.shape[0] / camera.height
+
+    maps = (xys * s).astype(np.float32)
+    valid = (
+        (maps[..., 0] >= 0) &
+        (maps[..., 1] >= 0) &
+        (maps[..., 0] < camera.width * s) &
+        (maps[..., 1] < camera.height * s) & (invcolmapdepth > 0))
+
+    if valid.sum() > 10 and (invcolmapdepth.max() - invcolmapdepth.min()) > 1e-3:
+        maps = maps[valid, :]
+        invcolmapdepth = invcolmapdepth[valid]
+        # reshape invece di [..., 0]: a seconda della versione di OpenCV il risultato è (N, 1) o (1, N)
+        invmonodepth = cv2.remap(invmonodepthmap, maps[..., 0], maps[..., 1],
+                                 interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE).reshape(-1)
+
+        t_colmap = np.median(invcolmapdepth)
+        s_colmap = np.mean(np.abs(invcolmapdepth - t_colmap))
+
+        t_mono = np.median(invmonodepth)
+        s_mono = np.mean(np.abs(invmonodepth - t_mono))
+        scale = s_colmap / s_mono
+        offset = t_colmap - t_mono * scale
+    else:
+        scale = 0
+        offset = 0
+    return float(scale), float(offset)
+
+
+class DepthScaleFitter:
+    """Fit depth_params.json entries while the depth maps are being written.
+
+    ``start`` loads the model on a background thread and fits each
+    requested image once ``<depths_dir>/<stem>.png`` is complete; ``finish``
+    (called after inference) fits what is left, skips images without a
+    depth map, as make_depth_scale.py does, and writes depth_params.json.
+    """
+
+    def __init__(self, base_dir, depths_dir, workers=None):
+        self.base_dir = base_dir
+        self.depths_dir = depths_dir
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.results = {}
+        self.started_early = 0
+        self._stems = None
+        self._model = None
+        self._error = None
+        self._done = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._load_s = 0.0
+        self._started = None
+
+    def start(self, stems=None):
+        """Fit ``stems`` (every image of the model if None) as their depth maps appear."""
+        self._stems = None if stems is None else set(stems)
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="depth-scale", daemon=True)
+        self._thread.start()
+        return self
+
+    def _fit(self, stem):
+        path = os.path.join(self.depths_dir, f"{stem}.png")
+        invmonodepthmap = cv2.imread(path, cv2.IMREAD_UNCHANGED) if os.path.exists(path) else None
+        if invmonodepthmap is None:
+            return
+        xys, invdepth, camera = self._model.observations(stem)
+        self.results[stem] = fit_scale(invmonodepthmap, xys, invdepth, camera)
+
+    def _run(self):
+        if self._stems is not None and not self._stems:
+            return
+        try:
+            started = time.perf_counter()
+            self._model = SparseDepths(os.path.join(self.base_dir, "sparse", "0"))
+            self._load_s = time.perf_counter() - started
+            pending = set(self._model.index) if self._stems is None else self._stems & set(self._model.index)
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="depth-scale-fit") as pool:
+                futures = []
+                while pending and not self._stop.is_set():
+                    inference_done = self._done.is_set()
+                    ready = [stem for stem in pending
+                             if inference_done or png_complete(os.path.join(self.depths_dir, f"{stem}.png"))]
+                    if not inference_done:
+                        self.started_early += len(ready)
+                    pending.difference_update(ready)
+                    futures.extend(pool.submit(self._fit, stem) for stem in ready)
+                    if pending and self._stop.wait(0 if inference_done else POLL_INTERVAL):
+                        return
+                for future in futures:
+                    future.result()
+        except Exception as e:
+            self._error = e
+
+    def close(self):
+        """Stop without writing (the job failed or was cancelled)."""
+        self._stop.set()
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def finish(self, removed=()):
+        """Wait for the last fits and write depth_params.json; returns the statistics."""
+        self._done.set()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+        path = depth_params_path(self.base_dir)
+        depth_params = {}
+        # Con un sottoinsieme di immagini si aggiorna il file esistente
+        if self._stems is not None and os.path.exists(path):
+            with open(path) as f:
+                depth_params = json.load(f)
+        for stem in removed:
+            depth_params.pop(stem, None)
+        for stem, (scale, offset) in self.results.items():
+            depth_params[stem] = {"scale": scale, "offset": offset}
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(depth_params, f, indent=2)
+        os.replace(tmp_path, path)
+        stats = {
+            "fitted": len(self.results),
+            "started_during_inference": self.started_early,
+            "removed": len(removed),
+            "model_load_s": self._load_s,
+            "elapsed_s": time.perf_counter() - self._started,
+        }
+        logger.info(f"depth_params.json: {stats['fitted']} fitted "
+                    f"({stats['started_during_inference']} during inference), {stats['removed']} removed")
+        return stats
+
+
+def update_depth_params(base_dir, depths_dir, changed, removed=()):
+    """Re-fit ``changed`` image stems and drop ``removed`` ones in depth_params.json."""
+    fitter = DepthScaleFitter(base_dir, depths_dir).start(changed)
+    return fitter.finish(removed)
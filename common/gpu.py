@@ -0,0 +1,89 @@
+"""Small helpers to read GPU and process memory without extra dependencies."""
+import logging
+import os
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+def _nvidia_smi(*query):
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", *query, "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if output.returncode != 0:
+        return None
+    return [line.split(",") for line in output.stdout.strip().splitlines() if line.strip()]
+
+
+def process_gpu_memory():
+    """Return ``{pid: used MiB}`` for the compute processes visible here."""
+    rows = _nvidia_smi("--query-compute-apps=pid,used_memory") or []
+    usage = {}
+    for row in rows:
+        try:
+            usage[int(row[0])] = usage.get(int(row[0]), 0.0) + float(row[1])
+        except (ValueError, IndexError):
+            continue
+    return usage
+
+
+def device_gpu_memory():
+    """Return the used MiB summed over all visible GPUs, or None."""
+    rows = _nvidia_smi("--query-gpu=memory.used")
+    if not rows:
+        return None
+    try:
+        return sum(float(row[0]) for row in rows)
+    except (ValueError, IndexError):
+        return None
+
+
+def gpu_memory_mb(pids):
+    """GPU memory used by ``pids``; falls back to the device total.
+
+    Inside a container nvidia-smi often cannot map host PIDs, in which case
+    the per-process list is empty and the whole-device figure is the best
+    available estimate.
+    """
+    usage = process_gpu_memory()
+    if usage:
+        return sum(usage.get(pid, 0.0) for pid in pids)
+    return device_gpu_memory()
+
+
+def rss_mb(pid):
+    """Resident set size of ``pid`` in MiB, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def process_tree(pid):
+    """``pid`` plus all its descendants, read from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Il nome del comando può contenere spazi: il ppid segue la ")" finale
+        fields = stat[stat.rfind(")") + 2:].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
@@ -0,0 +1,46 @@
+"""Content hashes of input files, memoised on size and mtime."""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(directory, names, index_path=None, workers=8):
+    """``{name: sha1}`` for files in ``directory``.
+
+    With ``index_path`` the hashes are remembered in a small JSON index and
+    only files whose size or mtime changed are read again.
+    """
+    index = {}
+    if index_path and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    stats = {}
+    todo = []
+    for name in names:
+        stat = os.stat(os.path.join(directory, name))
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+        entry = index.get(name)
+        if entry is None or entry["stat"] != stats[name]:
+            todo.append(name)
+
+    # hashlib rilascia il GIL: i thread bastano a saturare il disco
+    with ThreadPoolExecutor(workers) as pool:
+        for name, sha1 in zip(todo, pool.map(lambda n: file_sha1(os.path.join(directory, n)), todo)):
+            index[name] = {"sha1": sha1, "stat": stats[name]}
+
+    if index_path and todo:
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({name: index[name] for name in names}, f)
+        os.replace(tmp_path, index_path)
+    return {name: index[name]["sha1"] for name in names}
@@ -0,0 +1,407 @@
+"""Submit-and-poll job handling shared by the service APIs.
+
+A POST endpoint registers a job and returns its id straight away; the job
+body runs in a worker thread, so the uvicorn event loop stays free to answer
+health checks and status requests while a multi-hour subprocess is running.
+A queued or running job can be cancelled with DELETE /jobs/{id}.
+"""
+import asyncio
+import logging
+import math
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from common.gpu import process_gpu_memory, process_tree
+from common.progress import ProgressChannel, sse_stream
+from common.scheduler import QueueFull, SlotScheduler
+from common.supervisor import SupervisedProcess
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Timeout dei passi render.py/metrics.py lanciati come processo (run_step)
+RENDER_TIMEOUT = 3600
+METRICS_TIMEOUT = 1800
+
+
+class JobFailed(Exception):
+    """Raised by a job body to report a failure with an HTTP-style detail."""
+
+    def __init__(self, message, detail=None):
+        super().__init__(message)
+        self.message = message
+        self.detail = detail or {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, target, args, priority, tail_size=200):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.priority = priority
+        self.expected_wait_s = None
+        self.target = target
+        self.args = args
+        self.state = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.return_code = None
+        self.result = None
+        self.error = None
+        self.log_tail = deque(maxlen=tail_size)
+        self.process = None
+        self.progress = ProgressChannel()
+        self.done = threading.Event()
+        self.cancel_requested = False
+        self.cleanup_paths = []
+        self.cancellation = None
+        self._lock = threading.Lock()
+
+    def add_cleanup(self, path):
+        """Mark ``path`` as partial output to delete if the job is cancelled.
+
+        Paths that already exist are left alone: only what this job creates
+        counts as its partial output.
+        """
+        if not os.path.exists(path):
+            self.cleanup_paths.append(path)
+
+    def run_process(self, command, timeout=None, **kwargs):
+        """Run one subprocess step of this job and wait for it."""
+        on_line = kwargs.pop("on_line", None)
+
+        def collect(stream, line):
+            self.log_tail.append(line)
+            if on_line is not None:
+                on_line(stream, line)
+
+        with self._lock:
+            if self.cancel_requested:
+                raise JobCancelled()
+            self.process = SupervisedProcess(command, on_line=collect, **kwargs).start()
+        try:
+            self.return_code = self.process.wait(timeout=timeout)
+        except BaseException:
+            self.process.kill()
+            raise
+        return self.process
+
+    def run_step(self, command, what, timeout=None, **kwargs):
+        """``run_process`` that turns a timeout or a non-zero exit into ``JobFailed``."""
+        logger.info(f"{what} command: {' '.join(command)}")
+        try:
+            process = self.run_process(command, timeout=timeout, **kwargs)
+        except subprocess.TimeoutExpired:
+            raise JobFailed(f"{what} process timed out")
+        logger.info(f"{what} process completed with return code: {process.returncode}")
+        if process.returncode != 0:
+            raise JobFailed(
+                f"{what} failed with return code: {process.returncode}",
+                {
+                    "return_code": process.returncode,
+                    "stderr": "\n".join(process.stderr_tail),
+                    "stdout": "\n".join(process.stdout_tail),
+                },
+            )
+        return process
+
+    def run_in_worker(self, worker, op, payload=None):
+        """Run ``op`` on a ResidentWorker; its events go to the progress channel."""
+        def attach():
+            with self._lock:
+                if self.cancel_requested:
+                    raise JobCancelled()
+                # Annullare il job ferma il worker (verrà riavviato alla prossima richiesta)
+                self.process = worker
+
+        return worker.call(op, payload, on_event=self.progress.publish, on_start=attach)
+
+    def to_dict(self, tail=50):
+        now = time.time()
+        duration = None
+        if self.started_at is not None:
+            duration = (self.finished_at or now) - self.started_at
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "priority": self.priority,
+            "expected_wait_s": self.expected_wait_s if self.state == QUEUED else None,
+            "return_code": self.return_code,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_s": duration,
+            "result": self.result,
+            "error": self.error,
+            "cancellation": self.cancellation,
+            "progress": self.progress.latest,
+            "log_tail": list(self.log_tail)[-tail:] if tail else [],
+        }
+
+
+class JobManager:
+    """Registry of jobs submitted to this service instance.
+
+    Jobs are run by a SlotScheduler: ``GPU_SLOTS`` jobs at a time, at most
+    ``JOB_QUEUE_SIZE`` waiting; a full queue answers 429 with Retry-After.
+    """
+
+    def __init__(self, history=200, **scheduler_options):
+        self.history = history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._residents = []
+        self.scheduler = SlotScheduler(self._execute, **scheduler_options)
+
+    def add_resident(self, worker, kind):
+        """Release ``worker`` (None in subprocess mode) while jobs other than ``kind`` use the GPU."""
+        if worker is not None:
+            self._residents.append((worker, kind))
+
+    def _release_residents(self, finished=None):
+        """Release the residents whose kind has no running job, if another kind is running."""
+        kinds = self.scheduler.running_kinds()
+        if finished is not None:
+            kinds.remove(finished.kind)
+        for worker, kind in self._residents:
+            # Il worker del job in corso non si tocca; da solo sulla GPU può restare caldo
+            if kinds and kind not in kinds and worker.alive:
+                try:
+                    worker.release()
+                except Exception:
+                    logger.exception(f"Could not release the {kind} worker")
+
+    def submit(self, kind, target, *args, priority=None):
+        """Queue ``target(job, *args)`` on the scheduler."""
+        job = Job(kind, target, args, self.scheduler.priority_for(kind, priority))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        try:
+            self.scheduler.submit(job)
+        except QueueFull as e:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            retry_after = max(1, math.ceil(e.retry_after))
+            logger.warning(f"Job queue full, rejecting {kind} (retry after {retry_after}s)")
+            raise HTTPException(
+                status_code=429,
+                detail={"error": "Job queue is full", "queued": e.queued, "retry_after_s": retry_after},
+                headers={"Retry-After": str(retry_after)},
+            )
+        logger.info(f"Job {job.id} ({kind}) queued with priority {job.priority}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job, keep_output=True, grace=5.0, gpu_timeout=30.0):
+        """Stop ``job`` and free its GPU; blocking, call it off the event loop."""
+        started = time.time()
+        with job._lock:
+            if job.state in FINISHED_STATES:
+                return False
+            job.cancel_requested = True
+            process = job.process
+        if self.scheduler.remove(job):
+            # Mai partito: nessun processo da fermare
+            job.state = CANCELLED
+            job.finished_at = time.time()
+            job.progress.publish({"type": "state", "state": CANCELLED})
+            job.progress.close()
+            job.done.set()
+            job.cancellation = {"was_running": False, "removed_paths": []}
+            logger.info(f"Job {job.id} ({job.kind}) removed from the queue")
+            return True
+
+        pids = []
+        if process is not None and process.returncode is None:
+            pids = process_tree(process.pid)
+            logger.info(f"Cancelling job {job.id}: terminating process group {process.pid}")
+            process.terminate(grace=grace)
+        job.done.wait()
+        gpu_released = self._wait_gpu_release(pids, gpu_timeout)
+
+        removed = []
+        if not keep_output:
+            for path in job.cleanup_paths:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+                else:
+                    continue
+                removed.append(path)
+            if removed:
+                logger.info(f"Removed partial output of job {job.id}: {removed}")
+
+        job.cancellation = {
+            "was_running": True,
+            "gpu_released": gpu_released,
+            "duration_s": time.time() - started,
+            "removed_paths": removed,
+        }
+        return True
+
+    @staticmethod
+    def _wait_gpu_release(pids, timeout):
+        """Wait until none of ``pids`` holds GPU memory any more."""
+        if not pids:
+            return True
+        deadline = time.time() + timeout
+        while True:
+            usage = process_gpu_memory()
+            if not any(pid in usage for pid in pids):
+                return True
+            if time.time() >= deadline:
+                logger.warning(f"GPU memory still held by {pids} after {timeout}s")
+                return False
+            time.sleep(0.5)
+
+    def _execute(self, job):
+        with job._lock:
+            if job.cancel_requested:
+                job.state = CANCELLED
+            else:
+                job.state = RUNNING
+                job.started_at = time.time()
+        if job.state == CANCELLED:
+            job.finished_at = time.time()
+            job.progress.close()
+            job.done.set()
+            return
+        job.progress.publish({"type": "state", "state": RUNNING})
+        try:
+            # Modelli tenuti sulla GPU da worker residenti di altri tipi di job: il training non li vede
+            self._release_residents()
+            job.result = job.target(job, *job.args)
+            if job.cancel_requested:
+                raise JobCancelled()
+            job.state = SUCCEEDED
+            logger.info(f"Job {job.id} ({job.kind}) succeeded")
+        except Exception as e:
+            if job.cancel_requested:
+                # Il processo ucciso esce con errore: non è un fallimento
+                job.state = CANCELLED
+                logger.info(f"Job {job.id} ({job.kind}) cancelled")
+            elif isinstance(e, JobFailed):
+                job.error = {"error": e.message, **e.detail}
+                job.state = FAILED
+                logger.error(f"Job {job.id} ({job.kind}) failed: {e.message}")
+            else:
+                logger.exception(f"Unexpected error in job {job.id} ({job.kind})")
+                job.error = {"error": f"{job.kind} failed", "stderr": str(e)}
+                job.state = FAILED
+        finally:
+            job.finished_at = time.time()
+            # Slot liberato mentre altri job usano la GPU: i residenti di questo tipo la lasciano
+            self._release_residents(finished=job)
+            job.progress.publish({"type": "state", "state": job.state, "return_code": job.return_code})
+            job.progress.close()
+            job.done.set()
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.state in FINISHED_STATES]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+
+async def respond(job, wait=False):
+    """Answer a submit request.
+
+    By default the job id is returned immediately (202). With ``wait`` the
+    coroutine awaits completion without blocking the event loop and answers
+    the way the synchronous endpoints used to.
+    """
+    if not wait:
+        return JSONResponse(
+            status_code=202,
+            content={
+                "job_id": job.id,
+                "state": job.state,
+                "expected_wait_s": job.expected_wait_s,
+                "status_url": f"/jobs/{job.id}",
+            },
+        )
+    await asyncio.to_thread(job.done.wait)
+    if job.state == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.state == CANCELLED:
+        raise HTTPException(status_code=409, detail={"error": f"{job.kind} cancelled", "job_id": job.id})
+    return {"job_id": job.id, **(job.result or {})}
+
+
+def create_jobs_router(manager):
+    router = APIRouter()
+
+    @router.get("/jobs")
+    async def list_jobs():
+        return [job.to_dict(tail=0) for job in manager.list()]
+
+    @router.get("/jobs/{job_id}")
+    async def get_job(job_id: str, tail: int = 50):
+        job = manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail={"error": "Job not found", "job_id": job_id})
+        return job.to_dict(tail=tail)
+
+    @router.delete("/jobs/{job_id}")
+    async def cancel_job(job_id: str, keep_output: bool = True, gpu_timeout: float = 30.0):
+        """Cancel a job, killing its whole process group.
+
+        Returns once the processes are gone and their GPU memory is released
+        (or ``gpu_timeout`` expires). With ``keep_output=false`` the partial
+        outputs created by the job are removed as well.
+        """
+        job = manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail={"error": "Job not found", "job_id": job_id})
+        cancelled = await asyncio.to_thread(manager.cancel, job, keep_output, gpu_timeout=gpu_timeout)
+        if not cancelled:
+            raise HTTPException(
+                status_code=409,
+                detail={"error": "Job already finished", "job_id": job_id, "state": job.state},
+            )
+        return job.to_dict()
+
+    @router.get("/jobs/{job_id}/events")
+    async def job_events(job_id: str, min_interval: float = 0.5):
+        """Server-Sent Events stream of the job's parsed progress."""
+        job = manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail={"error": "Job not found", "job_id": job_id})
+        return StreamingResponse(
+            sse_stream(job.progress, min_interval=min_interval),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @router.get("/health")
+    async def health():
+        return {"status": "ok", **manager.scheduler.stats()}
+
+    return router
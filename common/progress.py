@@ -0,0 +1,196 @@
+"""Structured training progress parsed from train.py output.
+
+gaussian-splatting, taming-3dgs and 3dgs-mcmc all report progress through a
+tqdm bar ("Training progress: 23%|... 7000/30000 [05:12<17:05, 22.43it/s,
+Loss=0.0452311]") plus "[ITER n] Evaluating test: L1 x PSNR y" lines. The
+parser turns those lines into typed events and publishes them on a
+ProgressChannel, which SSE clients read at their own pace.
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_TQDM = re.compile(
+    r"(?P<percent>\d+)%\|[^|]*\|\s*(?P<n>\d+)/(?P<total>\d+)\s*"
+    r"\[(?P<elapsed>[\d:]+)<(?P<remaining>[\d:?]+),\s*(?P<rate>[\d.?]+)(?P<unit>it/s|s/it)"
+    r"(?:,\s*(?P<postfix>[^\]]*))?\]"
+)
+_EVAL = re.compile(
+    r"\[ITER (?P<iteration>\d+)\] Evaluating (?P<split>\w+): L1 (?P<l1>[\d.eE+-]+) PSNR (?P<psnr>[\d.eE+-]+)"
+)
+_GAUSSIANS = re.compile(
+    r"(?:Number of points at initialisation|num(?:ber)?[ _]of[ _]gaussians|gaussians)\s*[:=]\s*(?P<count>\d+)",
+    re.IGNORECASE,
+)
+_POSTFIX_ITEM = re.compile(r"(?P<key>[^=,]+)=(?P<value>[^,]+)")
+
+
+def _seconds(value):
+    if not value or "?" in value:
+        return None
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_training_line(line):
+    """Return the progress events contained in one line of train.py output."""
+    events = []
+
+    match = _TQDM.search(line)
+    if match:
+        rate = _number(match["rate"])
+        if rate and match["unit"] == "s/it":
+            rate = 1.0 / rate
+        event = {
+            "type": "progress",
+            "iteration": int(match["n"]),
+            "total": int(match["total"]),
+            "percent": int(match["percent"]),
+            "it_s": rate,
+            "elapsed_s": _seconds(match["elapsed"]),
+            "eta_s": _seconds(match["remaining"]),
+        }
+        for item in _POSTFIX_ITEM.finditer(match["postfix"] or ""):
+            key = item["key"].strip().lower().replace(" ", "_")
+            value = _number(item["value"].strip())
+            if value is None:
+                continue
+            if "gauss" in key or key in ("points", "num_points"):
+                event["gaussians"] = int(value)
+            else:
+                event[key] = value
+        events.append(event)
+        return events
+
+    match = _EVAL.search(line)
+    if match:
+        events.append({
+            "type": "eval",
+            "iteration": int(match["iteration"]),
+            "split": match["split"],
+            "l1": float(match["l1"]),
+            "psnr": float(match["psnr"]),
+        })
+        return events
+
+    match = _GAUSSIANS.search(line)
+    if match:
+        events.append({"type": "gaussians", "count": int(match["count"])})
+    return events
+
+
+class ProgressChannel:
+    """Latest-value fan-out of progress events to any number of readers.
+
+    ``publish`` never blocks: tqdm updates are coalesced into a single
+    "latest progress" slot and discrete events (evaluations, gaussian
+    counts, state changes) go into a bounded history. A slow reader simply
+    skips intermediate progress updates instead of backing up the pipe.
+    """
+
+    def __init__(self, history=256):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._events = deque(maxlen=history)
+        self._latest = None
+        self._waiters = set()
+        self._listeners = []
+        self.closed = False
+
+    @property
+    def latest(self):
+        with self._lock:
+            return self._latest[1] if self._latest else None
+
+    def add_listener(self, listener):
+        """Call ``listener(event)`` synchronously for every published event."""
+        self._listeners.append(listener)
+
+    def publish(self, event):
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Progress listener failed")
+        with self._lock:
+            self._seq += 1
+            entry = (self._seq, event)
+            if event.get("type") == "progress":
+                self._latest = entry
+            else:
+                self._events.append(entry)
+            waiters = list(self._waiters)
+        self._wake(waiters)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            waiters = list(self._waiters)
+        self._wake(waiters)
+
+    def feed(self, stream, line):
+        """SupervisedProcess ``on_line`` callback."""
+        for event in parse_training_line(line):
+            self.publish(event)
+
+    @staticmethod
+    def _wake(waiters):
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _since(self, seq):
+        with self._lock:
+            entries = [entry for entry in self._events if entry[0] > seq]
+            if self._latest and self._latest[0] > seq:
+                entries.append(self._latest)
+                entries.sort(key=lambda entry: entry[0])
+            return entries, self._seq, self.closed
+
+    async def subscribe(self, min_interval=0.5, heartbeat=15.0):
+        """Yield ``(seq, event)`` pairs; ``None`` is yielded as a keep-alive."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        seq = 0
+        try:
+            while True:
+                waiter[1].clear()
+                entries, seq, closed = self._since(seq)
+                for entry in entries:
+                    yield entry
+                if closed:
+                    return
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                # Finestra di coalescenza: gli aggiornamenti intermedi vengono scartati
+                await asyncio.sleep(min_interval)
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+async def sse_stream(channel, min_interval=0.5):
+    """Format a channel subscription as a text/event-stream body."""
+    async for entry in channel.subscribe(min_interval=min_interval):
+        if entry is None:
+            yield ": keep-alive\n\n"
+            continue
+        seq, event = entry
+        yield f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,348 @@
+"""Resident render mode: trained models stay loaded between /render calls.
+
+With ``RENDER_MODE=resident`` /render no longer spawns ``render.py``. A
+ResidentWorker hosts a RenderService that keeps recently used models (the
+Gaussians plus the Scene cameras) in an LRU bounded by ``RENDER_CACHE_MB``
+and renders the requested views in-process, writing the same
+``<model>/<split>/ours_<iter>/{renders,gt}/NNNNN.png`` layout as render.py,
+so /metrics keeps working unchanged.
+The cache is emptied when a job of another kind (a training) takes the
+GPU, so a warm render worker never competes with it for memory.
+
+The renderer is pluggable through ``RENDER_BACKEND`` (``"module:Class"``):
+GaussianSplattingBackend drives the CUDA code of the service's repository,
+PointSplatBackend is a numpy stand-in that needs neither a GPU nor torch.
+"""
+import gc
+import inspect
+import json
+import logging
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+from argparse import ArgumentParser, Namespace
+
+import numpy as np
+
+from common.worker import ModelCache, ResidentWorker, load_object
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "common.rendering:GaussianSplattingBackend"
+
+_ITERATION_DIR = re.compile(r"^iteration_(\d+)$")
+
+
+def render_mode():
+    return os.environ.get("RENDER_MODE", "subprocess")
+
+
+def create_render_worker(repo_root):
+    """The render worker of a service, or None in subprocess mode."""
+    if render_mode() != "resident":
+        return None
+    return ResidentWorker(
+        "common.rendering:RenderService",
+        {
+            "backend": os.environ.get("RENDER_BACKEND", DEFAULT_BACKEND),
+            "backend_options": {"repo_root": repo_root},
+            "cache_mb": float(os.environ.get("RENDER_CACHE_MB", "2048")),
+        },
+        name="render",
+        # La cache si svuota quando un job di altro tipo prende la GPU (JobManager.add_resident)
+        release_op="clear",
+    )
+
+
+def latest_iteration(model_dir):
+    """Highest ``point_cloud/iteration_N`` saved in ``model_dir``."""
+    point_cloud_dir = os.path.join(model_dir, "point_cloud")
+    iterations = [
+        int(match.group(1))
+        for match in map(_ITERATION_DIR.match, os.listdir(point_cloud_dir))
+        if match
+    ] if os.path.isdir(point_cloud_dir) else []
+    if not iterations:
+        raise FileNotFoundError(f"No trained model found in {point_cloud_dir}")
+    return max(iterations)
+
+
+def point_cloud_path(model_dir, iteration):
+    return os.path.join(model_dir, "point_cloud", f"iteration_{iteration}", "point_cloud.ply")
+
+
+class RenderBackend:
+    """What RenderService needs from a renderer.
+
+    ``load`` returns ``(model, nbytes)`` where ``nbytes`` is the memory the
+    model keeps resident; ``views`` returns the cameras of a split, each
+    with an ``image_name``.
+    """
+
+    def __init__(self, repo_root=None):
+        self.repo_root = repo_root
+
+    def load(self, model_dir, iteration):
+        raise NotImplementedError
+
+    def views(self, model, split):
+        raise NotImplementedError
+
+    def render_view(self, model, view, render_path, gts_path, index):
+        raise NotImplementedError
+
+    def release(self, model):
+        pass
+
+
+class RenderService:
+    """Runs inside the worker: model cache plus the render loop."""
+
+    def __init__(self, backend=DEFAULT_BACKEND, backend_options=None, cache_mb=2048):
+        self.backend = load_object(backend)(**(backend_options or {}))
+        self.cache = ModelCache(
+            int(cache_mb * 2**20),
+            lambda key: self.backend.load(key[0], key[1]),
+            self.backend.release,
+        )
+        logger.info(f"Render service ready with {backend} ({cache_mb:.0f} MB model cache)")
+
+    def handle(self, op, payload, emit):
+        if op == "render":
+            return self.render(emit=emit, **payload)
+        if op == "stats":
+            return self.cache.stats()
+        if op == "clear":
+            self.cache.clear()
+            return self.cache.stats()
+        raise ValueError(f"Unknown render op: {op}")
+
+    def render(self, model_dir, iteration=-1, skip_train=False, skip_test=False, views=None, emit=None):
+        if iteration == -1:
+            iteration = latest_iteration(model_dir)
+        ply_path = point_cloud_path(model_dir, iteration)
+        # mtime nella chiave: un modello ri-addestrato non riusa la copia in cache
+        key = (model_dir, iteration, os.path.getmtime(ply_path))
+
+        started = time.perf_counter()
+        model, hit = self.cache.get(key)
+        load_s = time.perf_counter() - started
+
+        wanted = set(views) if views else None
+        splits = [split for split, skip in (("train", skip_train), ("test", skip_test)) if not skip]
+        counts = {}
+        started = time.perf_counter()
+        for split in splits:
+            # L'indice resta quello della lista completa: i nomi file coincidono con render.py
+            selected = [
+                (index, view) for index, view in enumerate(self.backend.views(model, split))
+                if wanted is None or view.image_name in wanted
+            ]
+            base = os.path.join(model_dir, split, f"ours_{iteration}")
+            render_path = os.path.join(base, "renders")
+            gts_path = os.path.join(base, "gt")
+            os.makedirs(render_path, exist_ok=True)
+            os.makedirs(gts_path, exist_ok=True)
+            for done, (index, view) in enumerate(selected, 1):
+                self.backend.render_view(model, view, render_path, gts_path, index)
+                if emit is not None:
+                    emit({"type": "progress", "split": split, "iteration": done, "total": len(selected),
+                          "percent": int(100 * done / len(selected))})
+            counts[split] = len(selected)
+        render_s = time.perf_counter() - started
+
+        logger.info(f"Rendered {counts} views of {model_dir} "
+                    f"({'cached' if hit else f'loaded in {load_s:.1f}s'}, {render_s:.1f}s)")
+        return {
+            "iteration": iteration,
+            "cache_hit": hit,
+            "load_s": load_s,
+            "render_s": render_s,
+            "views": counts,
+            "cache": self.cache.stats(),
+        }
+
+
+class GaussianSplattingBackend(RenderBackend):
+    """Renders with the repository's own Scene/GaussianModel/render code.
+
+    Works for gaussian-splatting, taming-3dgs and 3dgs-mcmc, which share
+    the original module layout; optional ``render()`` keyword arguments are
+    only passed where the implementation accepts them.
+    """
+
+    def __init__(self, repo_root=None):
+        super().__init__(repo_root)
+        if repo_root and repo_root not in sys.path:
+            sys.path.insert(0, repo_root)
+        import torch
+        import torchvision
+        from arguments import ModelParams, PipelineParams
+        from gaussian_renderer import GaussianModel, render
+        from scene import Scene
+
+        self.torch = torch
+        self.save_image = torchvision.utils.save_image
+        self.ModelParams = ModelParams
+        self.PipelineParams = PipelineParams
+        self.GaussianModel = GaussianModel
+        self.Scene = Scene
+        self.render = render
+        self.render_parameters = inspect.signature(render).parameters
+        try:
+            from diff_gaussian_rasterization import SparseGaussianAdam  # noqa: F401
+            self.separate_sh = True
+        except ImportError:
+            self.separate_sh = False
+
+    def _arguments(self, model_dir):
+        """Same merge as ``get_combined_args``: cfg_args plus ``-m``."""
+        parser = ArgumentParser()
+        model = self.ModelParams(parser, sentinel=True)
+        pipeline = self.PipelineParams(parser)
+        args = parser.parse_args(["-m", model_dir])
+        merged = {}
+        cfg_path = os.path.join(model_dir, "cfg_args")
+        if os.path.exists(cfg_path):
+            with open(cfg_path) as f:
+                merged.update(vars(eval(f.read(), {"Namespace": Namespace})))
+        merged.update({key: value for key, value in vars(args).items() if value is not None})
+        args = Namespace(**merged)
+        return model.extract(args), pipeline.extract(args)
+
+    def load(self, model_dir, iteration):
+        torch = self.torch
+        before = torch.cuda.memory_allocated()
+        with torch.no_grad():
+            dataset, pipeline = self._arguments(model_dir)
+            gaussians = self.GaussianModel(dataset.sh_degree)
+            scene = self.Scene(dataset, gaussians, load_iteration=iteration, shuffle=False)
+            background = torch.tensor(
+                [1, 1, 1] if dataset.white_background else [0, 0, 0],
+                dtype=torch.float32, device="cuda",
+            )
+        kwargs = {}
+        train_test_exp = getattr(dataset, "train_test_exp", False)
+        if "use_trained_exp" in self.render_parameters:
+            kwargs["use_trained_exp"] = train_test_exp
+        if "separate_sh" in self.render_parameters:
+            kwargs["separate_sh"] = self.separate_sh
+        model = {
+            "scene": scene,
+            "gaussians": gaussians,
+            "pipeline": pipeline,
+            "background": background,
+            "train_test_exp": train_test_exp,
+            "render_kwargs": kwargs,
+        }
+        return model, torch.cuda.memory_allocated() - before
+
+    def views(self, model, split):
+        scene = model["scene"]
+        return scene.getTrainCameras() if split == "train" else scene.getTestCameras()
+
+    def render_view(self, model, view, render_path, gts_path, index):
+        with self.torch.no_grad():
+            rendering = self.render(
+                view, model["gaussians"], model["pipeline"], model["background"], **model["render_kwargs"]
+            )["render"]
+        gt = view.original_image[0:3, :, :]
+        if model["train_test_exp"]:
+            rendering = rendering[..., rendering.shape[-1] // 2:]
+            gt = gt[..., gt.shape[-1] // 2:]
+        name = f"{index:05d}.png"
+        self.save_image(rendering, os.path.join(render_path, name))
+        self.save_image(gt, os.path.join(gts_path, name))
+
+    def release(self, model):
+        model.clear()
+        gc.collect()
+        self.torch.cuda.empty_cache()
+
+
+def read_ply_vertices(path):
+    """Vertex properties of a binary little-endian PLY as a structured array."""
+    types = {"float": "<f4", "float32": "<f4", "double": "<f8", "uchar": "u1", "uint8": "u1",
+             "int": "<i4", "int32": "<i4", "uint": "<u4", "short": "<i2", "ushort": "<u2"}
+    with open(path, "rb") as f:
+        fields, count, in_vertex = [], 0, False
+        while True:
+            line = f.readline().decode("ascii").strip()
+            if line == "end_header":
+                break
+            parts = line.split()
+            if parts[:2] == ["element", "vertex"]:
+                count, in_vertex = int(parts[2]), True
+            elif parts[:1] == ["element"]:
+                in_vertex = False
+            elif parts[:1] == ["property"] and in_vertex:
+                fields.append((parts[2], types[parts[1]]))
+        return np.fromfile(f, dtype=np.dtype(fields), count=count)
+
+
+def _write_png(path, image):
+    """Minimal RGB8 PNG writer, so the stand-in needs no imaging library."""
+    height, width, _ = image.shape
+    raw = np.concatenate([np.zeros((height, 1), np.uint8), image.reshape(height, -1)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+class PointSplatBackend(RenderBackend):
+    """CPU stand-in: z-buffered point splats of the Gaussians' centres.
+
+    Cameras come from the ``cameras.json`` written at training time, which
+    does not record the split, so every camera is a "train" view. Meant for
+    exercising the worker, cache and API without a GPU.
+    """
+
+    SH_C0 = 0.28209479177387814
+
+    def __init__(self, repo_root=None, scale=0.25):
+        super().__init__(repo_root)
+        self.scale = scale
+
+    def load(self, model_dir, iteration):
+        vertices = read_ply_vertices(point_cloud_path(model_dir, iteration))
+        xyz = np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1).astype(np.float32)
+        if "f_dc_0" in vertices.dtype.names:
+            dc = np.stack([vertices[f"f_dc_{i}"] for i in range(3)], axis=1)
+            colors = np.clip(0.5 + self.SH_C0 * dc, 0.0, 1.0)
+        else:
+            colors = np.stack([vertices[c] for c in ("red", "green", "blue")], axis=1) / 255.0
+        with open(os.path.join(model_dir, "cameras.json")) as f:
+            cameras = [Namespace(image_name=camera["img_name"], **camera) for camera in json.load(f)]
+        model = {"xyz": xyz, "colors": (colors * 255).astype(np.uint8), "cameras": cameras}
+        return model, xyz.nbytes + model["colors"].nbytes
+
+    def views(self, model, split):
+        return model["cameras"] if split == "train" else []
+
+    def render_view(self, model, view, render_path, gts_path, index):
+        width = max(1, int(view.width * self.scale))
+        height = max(1, int(view.height * self.scale))
+        # cameras.json: rotation/position sono camera→mondo
+        rotation = np.asarray(view.rotation, np.float32)
+        points = (model["xyz"] - np.asarray(view.position, np.float32)) @ rotation
+        depth = points[:, 2]
+        visible = depth > 1e-3
+        u = (view.fx * self.scale * points[visible, 0] / depth[visible] + width / 2).astype(np.int64)
+        v = (view.fy * self.scale * points[visible, 1] / depth[visible] + height / 2).astype(np.int64)
+        inside = (u >= 0) & (u < width) & (v >= 0) & (v < height)
+        u, v = u[inside], v[inside]
+        colors = model["colors"][visible][inside]
+        # Dal più lontano al più vicino: l'ultimo scritto vince
+        order = np.argsort(-depth[visible][inside])
+        image = np.zeros((height, width, 3), np.uint8)
+        image[v[order], u[order]] = colors[order]
+        _write_png(os.path.join(render_path, f"{index:05d}.png"), image)
@@ -0,0 +1,140 @@
+"""GPU-slot scheduler for the jobs of one service instance.
+
+Jobs wait in a bounded priority queue and are started by one worker thread
+per GPU slot, so a second /train no longer launches a second train.py on a
+GPU that is already full. Lower priority values run first; within the same
+priority jobs are served in submission order.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Lavori brevi (render/metrics) scavalcano i training lunghi
+DEFAULT_PRIORITIES = {
+    "render": 0,
+    "metrics": 0,
+    "depth_regularization": 1,
+    "train": 2,
+}
+
+# Stime iniziali della durata (secondi), poi aggiornate con le durate osservate
+DEFAULT_DURATIONS = {
+    "render": 120.0,
+    "metrics": 60.0,
+    "depth_regularization": 600.0,
+    "train": 3600.0,
+}
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after, queued):
+        super().__init__(f"Job queue is full ({queued} queued)")
+        self.retry_after = retry_after
+        self.queued = queued
+
+
+class SlotScheduler:
+    def __init__(self, run, slots=None, max_queue=None, priorities=None,
+                 durations=None, smoothing=0.3):
+        self.run = run
+        self.slots = slots if slots is not None else int(os.environ.get("GPU_SLOTS", "1"))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get("JOB_QUEUE_SIZE", "8"))
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+        self.durations = {**DEFAULT_DURATIONS, **(durations or {})}
+        self.smoothing = smoothing
+        self._heap = []
+        self._counter = itertools.count()
+        self._running = {}
+        self._cond = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"gpu-slot-{i}", daemon=True)
+            for i in range(self.slots)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def priority_for(self, kind, priority=None):
+        return priority if priority is not None else self.priorities.get(kind, 1)
+
+    def submit(self, job):
+        """Queue ``job`` or raise QueueFull with a Retry-After estimate."""
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                # Si libera un posto in coda appena parte il primo job in attesa
+                raise QueueFull(self._expected_wait_locked(float("-inf")), len(self._heap))
+            job.expected_wait_s = self._expected_wait_locked(job.priority)
+            heapq.heappush(self._heap, (job.priority, next(self._counter), job))
+            self._cond.notify()
+
+    def expected_wait(self, priority):
+        with self._cond:
+            return self._expected_wait_locked(priority)
+
+    def remove(self, job):
+        """Drop a job that has not started yet; returns False if it is running."""
+        with self._cond:
+            for i, entry in enumerate(self._heap):
+                if entry[2] is job:
+                    self._heap.pop(i)
+                    heapq.heapify(self._heap)
+                    return True
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "running": len(self._running),
+                "queued": len(self._heap),
+                "max_queue": self.max_queue,
+            }
+
+    def running_kinds(self):
+        with self._cond:
+            return [job.kind for job in self._running.values()]
+
+    def _expected_wait_locked(self, priority):
+        """Simulate the queue to estimate when a job of ``priority`` would start."""
+        now = time.time()
+        free_at = [0.0] * (self.slots - len(self._running))
+        for job in self._running.values():
+            elapsed = now - (job.started_at or now)
+            free_at.append(max(0.0, self.durations.get(job.kind, 0.0) - elapsed))
+        heapq.heapify(free_at)
+        for job_priority, _, job in sorted(self._heap):
+            if job_priority > priority:
+                break
+            start = heapq.heappop(free_at)
+            heapq.heappush(free_at, start + self.durations.get(job.kind, 0.0))
+        return free_at[0] if free_at else 0.0
+
+    def _record_duration(self, kind, seconds):
+        previous = self.durations.get(kind)
+        if previous is None:
+            self.durations[kind] = seconds
+        else:
+            self.durations[kind] = (1 - self.smoothing) * previous + self.smoothing * seconds
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                self._running[job.id] = job
+            started = time.time()
+            try:
+                self.run(job)
+            except Exception:
+                logger.exception(f"Scheduler worker failed on job {job.id}")
+            finally:
+                with self._cond:
+                    self._running.pop(job.id, None)
+                    # I job falliti in pochi secondi falserebbero la stima
+                    if job.state == "succeeded":
+                        self._record_duration(job.kind, time.time() - started)
@@ -0,0 +1,132 @@
+"""Subprocess supervision shared by the service APIs.
+
+Each child pipe is drained by a single thread blocked in ``readline()``, so a
+long-running job costs no CPU while it is quiet: there is no queue to poll and
+no spin loop. Lines are logged as they arrive and the most recent ones are
+kept for error reports.
+
+Children are started in their own session, so ``terminate()`` can signal the
+whole process group (a shell plus its python child, or train.py plus any
+workers it forked) instead of only the direct child.
+"""
+import logging
+import os
+import signal
+import subprocess
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class SupervisedProcess:
+    """A child process whose stdout/stderr are streamed to the logger."""
+
+    def __init__(self, command, shell=False, cwd=None, env=None, on_line=None,
+                 tail_size=200, log=None):
+        self.command = command
+        self.shell = shell
+        self.cwd = cwd
+        self.env = env
+        self.on_line = on_line
+        self.log = log or logger
+        self.stdout_tail = deque(maxlen=tail_size)
+        self.stderr_tail = deque(maxlen=tail_size)
+        self.process = None
+        self._readers = []
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    @property
+    def returncode(self):
+        return self.process.returncode if self.process else None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command,
+            shell=self.shell,
+            cwd=self.cwd,
+            env=self.env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1,  # Line buffered
+            start_new_session=True,
+        )
+        self._readers = [
+            threading.Thread(
+                target=self._pump,
+                args=(self.process.stdout, "stdout", self.stdout_tail),
+                daemon=True,
+            ),
+            threading.Thread(
+                target=self._pump,
+                args=(self.process.stderr, "stderr", self.stderr_tail),
+                daemon=True,
+            ),
+        ]
+        for reader in self._readers:
+            reader.start()
+        return self
+
+    def _pump(self, pipe, stream, tail):
+        """Block on the pipe and forward every line until EOF."""
+        try:
+            for line in pipe:
+                line = line.strip()
+                if not line:
+                    continue
+                tail.append(line)
+                self.log.info(line)
+                if self.on_line is not None:
+                    try:
+                        self.on_line(stream, line)
+                    except Exception:
+                        logger.exception("Output callback failed")
+        finally:
+            pipe.close()
+
+    def wait(self, timeout=None):
+        """Wait for the child to exit and for its output to be drained."""
+        self.process.wait(timeout=timeout)
+        for reader in self._readers:
+            reader.join()
+        return self.process.returncode
+
+    def kill(self):
+        self._signal_group(signal.SIGKILL)
+
+    def terminate(self, grace=5.0):
+        """SIGTERM the process group, then SIGKILL it after ``grace`` seconds."""
+        if self.process is None:
+            return
+        self._signal_group(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Process group {self.process.pid} ignored SIGTERM, killing it")
+        # Il leader può essere uscito lasciando figli nel gruppo
+        self._signal_group(signal.SIGKILL)
+        self.wait()
+
+    def _signal_group(self, sig):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def run_supervised(command, timeout=None, **kwargs):
+    """Run ``command`` to completion, streaming its output to the logger."""
+    process = SupervisedProcess(command, **kwargs).start()
+    try:
+        process.wait(timeout=timeout)
+    except BaseException:
+        process.kill()
+        raise
+    return process
@@ -0,0 +1,201 @@
+"""Per-job training telemetry stored as append-only columns in output_dir.
+
+Every column lives in its own raw little-endian file under
+``<output_dir>/telemetry/`` (``loss.f4``, ``iteration.f8``, ...) described by
+``schema.json``. Appending a row is a handful of small writes, and reading a
+run back is one ``np.fromfile`` per column instead of re-parsing the text
+log, which keeps comparisons across hundreds of benchmark runs cheap.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from fastapi import APIRouter, HTTPException
+
+from common.gpu import gpu_memory_mb, process_tree, rss_mb
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_DIR = "telemetry"
+SCHEMA_FILE = "schema.json"
+
+# wall_time è in secondi dall'avvio del job
+COLUMNS = {
+    "wall_time": "<f8",
+    "iteration": "<f8",
+    "loss": "<f4",
+    "test_psnr": "<f4",
+    "test_l1": "<f4",
+    "gaussians": "<f8",
+    "gpu_mem_mb": "<f4",
+    "rss_mb": "<f4",
+}
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, f"{name}.{COLUMNS[name][1:]}")
+
+
+class TelemetryRecorder:
+    """Turns progress events into telemetry rows and appends them to disk.
+
+    Used as a ProgressChannel listener. Progress rows are throttled to one
+    every ``min_interval`` seconds, evaluation rows are always kept, and
+    GPU/RSS figures are refreshed every ``resource_interval`` seconds.
+    """
+
+    def __init__(self, output_dir, pid=None, min_interval=1.0, resource_interval=10.0,
+                 flush_rows=64, flush_interval=10.0):
+        self.directory = os.path.join(output_dir, TELEMETRY_DIR)
+        self.pid = pid
+        self.min_interval = min_interval
+        self.resource_interval = resource_interval
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._rows = []
+        self._last_row = 0.0
+        self._last_flush = time.monotonic()
+        self._last_resources = 0.0
+        self._state = {"iteration": math.nan, "gaussians": math.nan,
+                       "gpu_mem_mb": math.nan, "rss_mb": math.nan}
+        os.makedirs(self.directory, exist_ok=True)
+        schema_path = os.path.join(self.directory, SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            # Stesso output_dir (es. ripresa da checkpoint): si accoda alla serie esistente
+            with open(schema_path) as f:
+                self.started_at = json.load(f)["started_at"]
+        else:
+            self.started_at = time.time()
+            with open(schema_path, "w") as f:
+                json.dump({"columns": COLUMNS, "started_at": self.started_at}, f, indent=2)
+
+    def record(self, event):
+        kind = event.get("type")
+        now = time.time()
+        row = None
+        if kind == "progress":
+            self._state["iteration"] = event["iteration"]
+            if "gaussians" in event:
+                self._state["gaussians"] = event["gaussians"]
+            if now - self._last_row >= self.min_interval:
+                row = {"loss": event.get("loss", math.nan)}
+        elif kind == "eval" and event.get("split") == "test":
+            self._state["iteration"] = event["iteration"]
+            row = {"test_psnr": event["psnr"], "test_l1": event["l1"]}
+        elif kind == "gaussians":
+            self._state["gaussians"] = event["count"]
+        if row is None:
+            return
+        self._sample_resources(now)
+        self._last_row = now
+        values = {**self._state, **row, "wall_time": now - self.started_at}
+        with self._lock:
+            self._rows.append(tuple(values.get(name, math.nan) for name in COLUMNS))
+            due = (len(self._rows) >= self.flush_rows
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def _sample_resources(self, now):
+        if self.pid is None or now - self._last_resources < self.resource_interval:
+            return
+        self._last_resources = now
+        pid = self.pid() if callable(self.pid) else self.pid
+        if pid is None:
+            return
+        pids = process_tree(pid)
+        rss = [value for value in (rss_mb(p) for p in pids) if value is not None]
+        self._state["rss_mb"] = sum(rss) if rss else math.nan
+        gpu = gpu_memory_mb(pids)
+        self._state["gpu_mem_mb"] = gpu if gpu is not None else math.nan
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._last_flush = time.monotonic()
+        if not rows:
+            return
+        table = list(zip(*rows))
+        for name, values in zip(COLUMNS, table):
+            with open(_column_path(self.directory, name), "ab") as f:
+                np.asarray(values, dtype=COLUMNS[name]).tofile(f)
+
+    def close(self):
+        self.flush()
+
+
+def load_series(output_dir, columns=None):
+    """Read a run's telemetry columns; truncates to the shortest column."""
+    directory = os.path.join(output_dir, TELEMETRY_DIR)
+    if not os.path.exists(os.path.join(directory, SCHEMA_FILE)):
+        return None
+    names = list(COLUMNS) if not columns else ["wall_time", *[c for c in columns if c in COLUMNS and c != "wall_time"]]
+    series = {}
+    for name in names:
+        path = _column_path(directory, name)
+        series[name] = np.fromfile(path, dtype=COLUMNS[name]) if os.path.exists(path) else np.empty(0, COLUMNS[name])
+    # Un flush interrotto può lasciare colonne di lunghezza diversa
+    length = min(len(values) for values in series.values())
+    return {name: values[:length] for name, values in series.items()}
+
+
+def downsample(series, max_points):
+    """Bucket-average every column down to at most ``max_points`` rows."""
+    length = len(series["wall_time"])
+    if length <= max_points:
+        return series
+    starts = np.linspace(0, length, max_points, endpoint=False).astype(np.int64)
+    reduced = {}
+    for name, values in series.items():
+        values = values.astype(np.float64)
+        valid = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        counts = np.add.reduceat(valid.astype(np.int64), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            reduced[name] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    return reduced
+
+
+def query_series(output_dir, t0=None, t1=None, max_points=500, columns=None):
+    series = load_series(output_dir, columns)
+    if series is None:
+        return None
+    wall_time = series["wall_time"]
+    lo = 0 if t0 is None else int(np.searchsorted(wall_time, t0, side="left"))
+    hi = len(wall_time) if t1 is None else int(np.searchsorted(wall_time, t1, side="right"))
+    window = {name: values[lo:hi] for name, values in series.items()}
+    reduced = downsample(window, max(1, max_points))
+    return {
+        "output_dir": output_dir,
+        "rows": len(wall_time),
+        "selected": hi - lo,
+        "returned": len(reduced["wall_time"]),
+        # NaN non è JSON valido: i buchi diventano null
+        "series": {
+            name: [None if math.isnan(v) else v for v in values.tolist()]
+            for name, values in reduced.items()
+        },
+    }
+
+
+def create_telemetry_router():
+    router = APIRouter()
+
+    @router.get("/telemetry")
+    def get_telemetry(output_dir: str, t0: float = None, t1: float = None,
+                      max_points: int = 500, columns: str = None):
+        """Downsampled telemetry of a run; ``t0``/``t1`` are seconds from job start."""
+        result = query_series(
+            output_dir, t0, t1, max_points,
+            columns.split(",") if columns else None,
+        )
+        if result is None:
+            raise HTTPException(status_code=404, detail={"error": "No telemetry found", "output_dir": output_dir})
+        return result
+
+    return router
@@ -0,0 +1,271 @@
+"""Long-lived worker process that keeps an expensive runtime warm.
+
+Spawning ``python3 render.py`` for every request pays interpreter start-up,
+torch/CUDA initialisation, extension loading and model parsing each time.
+A ResidentWorker starts one child process (``spawn``, CUDA-safe) that builds
+a service object once and then answers ``(op, payload)`` requests over a
+pipe. The service class is given as ``"module:Name"`` so the heavy imports
+only ever happen in the child and backends can be swapped from the env.
+
+The parent side duck-types the parts of SupervisedProcess that job
+cancellation uses (``pid``, ``returncode``, ``terminate``), so cancelling a
+job kills the worker; the next request starts a fresh one.
+
+What the worker keeps on the GPU is outside the slot scheduler: the
+JobManager calls ``release`` before a job of another kind uses the GPU
+(``release_op`` in the service, or the worker is stopped).
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import traceback
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerError(Exception):
+    """An exception raised by the service inside the worker."""
+
+    def __init__(self, message, detail=None):
+        super().__init__(message)
+        self.message = message
+        self.detail = detail or {}
+
+
+class WorkerDied(Exception):
+    pass
+
+
+def load_object(path):
+    """Import ``"package.module:Name"``."""
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def _serve(conn, factory, options):
+    # Processo figlio: niente handler ereditati, SIGTERM deve terminare davvero
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        service = load_object(factory)(**options)
+    except Exception as e:
+        conn.send(("error", {"error": str(e), "type": type(e).__name__,
+                             "traceback": traceback.format_exc()}))
+        return
+    conn.send(("ready", os.getpid()))
+
+    def emit(event):
+        conn.send(("event", event))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        op, payload = request
+        try:
+            result = service.handle(op, payload, emit)
+        except Exception as e:
+            logger.exception(f"Worker op {op} failed")
+            conn.send(("error", {"error": str(e), "type": type(e).__name__,
+                                 "traceback": traceback.format_exc()}))
+        else:
+            conn.send(("ok", result))
+
+
+class ResidentWorker:
+    def __init__(self, factory, options=None, name="worker", start_timeout=600.0, release_op=None):
+        self.factory = factory
+        self.options = options or {}
+        self.name = name
+        self.release_op = release_op
+        self.start_timeout = start_timeout
+        self.lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+        self._conn = None
+
+    @property
+    def pid(self):
+        return self._process.pid if self._process else None
+
+    @property
+    def returncode(self):
+        return self._process.exitcode if self._process else None
+
+    @property
+    def alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def _start(self):
+        parent, child = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_serve, args=(child, self.factory, self.options),
+            name=self.name, daemon=True,
+        )
+        self._process.start()
+        child.close()
+        self._conn = parent
+        logger.info(f"Starting {self.name} worker (pid {self._process.pid})")
+        if not parent.poll(self.start_timeout):
+            self.kill()
+            raise WorkerDied(f"{self.name} worker did not start within {self.start_timeout}s")
+        status, value = self._receive()
+        if status == "error":
+            self._process.join(5)
+            raise WorkerError(f"{self.name} worker failed to start: {value['error']}", value)
+        logger.info(f"✅ {self.name} worker ready")
+
+    def _receive(self):
+        try:
+            return self._conn.recv()
+        except (EOFError, OSError):
+            self._process.join(5)
+            raise WorkerDied(f"{self.name} worker exited with code {self.returncode}")
+
+    def call(self, op, payload=None, on_event=None, on_start=None):
+        """Run ``op`` in the worker and return its result.
+
+        Calls are serialised. ``on_start`` runs once the worker is ready and
+        owned by this call (it may raise to abort); ``on_event`` receives the
+        events the service emits while working.
+        """
+        with self.lock:
+            if not self.alive:
+                self._start()
+            if on_start is not None:
+                on_start()
+            return self._request(op, payload, on_event)
+
+    def _request(self, op, payload, on_event=None):
+        self._conn.send((op, payload))
+        while True:
+            status, value = self._receive()
+            if status == "event":
+                if on_event is not None:
+                    on_event(value)
+                continue
+            if status == "error":
+                raise WorkerError(value["error"], value)
+            return value
+
+    def release(self):
+        """Free the GPU memory held between calls; a no-op if the worker is not running."""
+        with self.lock:
+            if not self.alive:
+                return
+            if self.release_op is None:
+                logger.info(f"Stopping idle {self.name} worker to free the GPU")
+                self.close()
+                return
+            try:
+                self._request(self.release_op, None)
+            except (WorkerError, WorkerDied) as e:
+                logger.warning(f"{self.name} worker release failed ({e}), stopping it")
+                self.terminate()
+
+    def _signal(self, sig):
+        try:
+            os.kill(self._process.pid, sig)
+        except (ProcessLookupError, PermissionError, TypeError):
+            pass
+
+    def terminate(self, grace=5.0):
+        if self._process is None:
+            return
+        self._signal(signal.SIGTERM)
+        self._process.join(grace)
+        if self._process.is_alive():
+            logger.warning(f"{self.name} worker ignored SIGTERM for {grace}s, killing it")
+            self.kill()
+
+    def kill(self):
+        if self._process is None:
+            return
+        self._signal(signal.SIGKILL)
+        self._process.join(5)
+
+    def close(self):
+        if self.alive:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass
+            self._process.join(10)
+        self.terminate()
+
+
+class ModelCache:
+    """LRU of loaded models bounded by their estimated memory footprint.
+
+    ``load(key)`` returns ``(model, nbytes)``; ``release(model)`` frees it.
+    The newest entry is always kept even if it alone exceeds the budget.
+    """
+
+    def __init__(self, max_bytes, load, release=None):
+        self.max_bytes = max_bytes
+        self._load = load
+        self._release = release
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def used_bytes(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def get(self, key):
+        """Return ``(model, hit)``."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0], True
+        self.misses += 1
+        try:
+            model, nbytes = self._load(key)
+        except (MemoryError, RuntimeError) as e:
+            if not self._entries or "out of memory" not in str(e).lower() and not isinstance(e, MemoryError):
+                raise
+            # Memoria esaurita: si svuota la cache e si riprova una volta
+            logger.warning(f"Out of memory loading {key}, clearing {len(self._entries)} cached models")
+            self.clear()
+            model, nbytes = self._load(key)
+        self._entries[key] = (model, nbytes)
+        self._evict(keep=key)
+        return model, False
+
+    def evict(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and self._release is not None:
+            self._release(entry[0])
+        return entry is not None
+
+    def clear(self):
+        for key in list(self._entries):
+            self.evict(key)
+
+    def _evict(self, keep):
+        while self.used_bytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            logger.info(f"Evicting {key} from model cache")
+            self.evict(key)
+
+    def stats(self):
+        return {
+            "models": [
+                {"key": list(key) if isinstance(key, tuple) else key, "mb": nbytes / 2**20}
+                for key, (_, nbytes) in self._entries.items()
+            ],
+            "used_mb": self.used_bytes / 2**20,
+            "max_mb": self.max_bytes / 2**20,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
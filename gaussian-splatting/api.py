@@ -1,11 +1,18 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI
 from pydantic import BaseModel,Field
-import subprocess
-import threading
-import queue
 import logging
 import os
-from typing import  Dict, Any
+from typing import  Dict, Any, List, Optional
+
+from common.checkpoints import CHECKPOINT_PARAMS, checkpoint_arguments, run_training
+from common.depth import create_depth_worker, depth_identity
+from common.depth_manifest import DepthManifest
+from common.depth_pack import build_pack, compare_loading, remove_pack, training_command
+from common.depth_scale import DepthScaleFitter, depth_params_path, image_stem
+from common.jobs import METRICS_TIMEOUT, RENDER_TIMEOUT, JobFailed, JobManager, create_jobs_router, respond
+from common.rendering import create_render_worker
+from common.telemetry import TelemetryRecorder, create_telemetry_router
+from common.worker import WorkerDied, WorkerError
 
 app = FastAPI()
 
@@ -16,49 +23,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+jobs = JobManager()
+app.include_router(create_jobs_router(jobs))
+app.include_router(create_telemetry_router())
+
+# RENDER_MODE=resident: i modelli restano caricati tra una /render e l'altra
+render_worker = create_render_worker("/workspace/gaussian-splatting")
+# Svuota la cache dei modelli quando la GPU passa a un job di altro tipo
+jobs.add_resident(render_worker, "render")
+# DEPTH_MODE=resident: Depth Anything V2 caricato una volta sola
+depth_worker = create_depth_worker()
+# ViT-L fuori dallo scheduler: il worker si ferma quando la GPU passa a un job di altro tipo
+jobs.add_resident(depth_worker, "depth_regularization")
+
 
 class TrainRequest(BaseModel):
-    input_dir: str  
+    input_dir: str
     output_dir: str
     has_depths: bool
     params: Dict[str, Any] = Field(
-        default_factory=dict, 
+        default_factory=dict,
         description="Parametri specifici dell'algoritmo (generati auto se quality_level specificato)"
-    )  
+    )
+    priority: Optional[int] = None  # Default per tipo di job (render/metrics prima del training)
+    # Checkpoint ogni N iterazioni (default CHECKPOINT_INTERVAL, 0 = solo quelli espliciti)
+    checkpoint_interval: Optional[int] = None
+    checkpoint_iterations: List[int] = Field(default_factory=list)
+    resume: bool = False  # Riparte dall'ultimo chkpnt*.pth in output_dir (deve venire da questa scena/params)
+    max_resume_attempts: int = 0  # Riavvii automatici se train.py muore a metà
 
 class RenderRequest(BaseModel):
-    output_dir: str  
+    output_dir: str
+    iteration: int = -1
+    skip_train: bool = False
+    skip_test: bool = False
+    views: Optional[List[str]] = None  # Nomi immagine da renderizzare (solo worker residente)
+    priority: Optional[int] = None
 
 class MetricsRequest(BaseModel):
-    output_dir: str  
+    output_dir: str
+    priority: Optional[int] = None
 
 class DepthRegularizationRequest(BaseModel):
-    input_dir: str  
-
-def stream_output(pipe, q):
-    """Read output from pipe and put it in queue"""
-    try:
-        for line in iter(pipe.readline, ''):
-            if line:
-                q.put(line.strip())
-    finally:
-        pipe.close()
-
-def log_from_queue(q, process):
-    """Log messages from queue until process completes"""
-    while process.poll() is None or not q.empty():
-        try:
-            line = q.get_nowait()
-            logger.info(line)
-        except queue.Empty:
-            continue
+    input_dir: str
+    # "pack": mappe a 16 bit (worker residente) in depths/depths.pack, lette in memory-map dal training
+    depth_storage: str = "png"
+    priority: Optional[int] = None
 
-@app.post("/train")
-async def run_train(request: TrainRequest):
+def train_job(job, request: TrainRequest):
     logger.info(f"Starting training - Input directory: {request.input_dir}")
     logger.info(f"Output directory: {request.output_dir}")
-    logger.info(f"Training params: {request.params}")   
-    
+    logger.info(f"Training params: {request.params}")
+
     params = request.params
 
     # ✅ Fix: Inizializza come LISTA
@@ -73,423 +89,254 @@ async def run_train(request: TrainRequest):
 
     # Tutti gli altri parametri automaticamente
     boolean_flags = {"eval"}  # Flag senza valori
-    
+
     for param_key, value in params.items():
         if param_key in boolean_flags:
             # Flag booleani
             if value:
                 command.append(f"--{param_key}")
-        elif param_key != 'resolution':
+        elif param_key != 'resolution' and param_key not in CHECKPOINT_PARAMS:
             # Parametri normali con valore
             command.extend([f"--{param_key}", str(value)])
 
     if request.has_depths:
         depths_dir = os.path.join(request.input_dir, 'depths')
         command.extend([f"-d", depths_dir])
+        # Con depths/depths.pack train.py parte dietro lo shim che legge le mappe dal pack
+        command = training_command(command, depths_dir)
 
     #command.append(f"--antialiasing")
-    logger.info(f"Command: {' '.join(command)}")
-    
-    # ✅ Fix: Rimuovi shell=True quando usi lista
-    process = subprocess.Popen(
-        command,  # Lista invece di stringa
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,
-    )
+    command.extend(checkpoint_arguments(params, request.checkpoint_interval, request.checkpoint_iterations))
 
-    # Create queues for stdout and stderr
-    stdout_queue = queue.Queue()
-    stderr_queue = queue.Queue()
+    logger.info(f"Command: {' '.join(command)}")
 
-    # Create and start output reader threads
-    stdout_thread = threading.Thread(
-        target=stream_output, 
-        args=(process.stdout, stdout_queue)
-    )
-    stderr_thread = threading.Thread(
-        target=stream_output, 
-        args=(process.stderr, stderr_queue)
-    )
+    # Se il job viene annullato con keep_output=false si butta solo ciò che ha creato lui
+    job.add_cleanup(request.output_dir)
 
-    # Create and start logging threads
-    stdout_log_thread = threading.Thread(
-        target=log_from_queue,
-        args=(stdout_queue, process)
-    )
-    stderr_log_thread = threading.Thread(
-        target=log_from_queue,
-        args=(stderr_queue, process)
+    # Metriche del run salvate in output_dir/telemetry (interrogabili da /telemetry)
+    telemetry = TelemetryRecorder(
+        request.output_dir, pid=lambda: job.process.pid if job.process else None
     )
+    job.progress.add_listener(telemetry.record)
 
-    # Start all threads
-    stdout_thread.start()
-    stderr_thread.start()
-    stdout_log_thread.start()
-    stderr_log_thread.start()
-
+    # Le righe di tqdm/eval diventano eventi su /jobs/{id}/events
     try:
-        # Wait for process to complete with timeout
-        process.wait()
-
-        # Wait for threads to finish
-        stdout_thread.join()
-        stderr_thread.join()
-        stdout_log_thread.join()
-        stderr_log_thread.join()
-
-        if process.returncode != 0:
-            error_message = "Training failed"
-            logger.error(error_message)
-            raise HTTPException(
-                status_code=500,
-                detail={"error": error_message, "stderr": "Process error"}
-            )
-
-        logger.info("Training completed successfully")
-        return {"message": "Training completed successfully"}
-
-    except Exception as e:
-        logger.error(f"Unexpected error during training: {str(e)}")
-        # Ensure process is terminated if something goes wrong
-        process.kill()
-        raise HTTPException(
-            status_code=500,
-            detail={"error": "Training failed", "stderr": str(e)}
+        process, resumed_from = run_training(
+            job, command, request.output_dir,
+            resume=request.resume, max_attempts=request.max_resume_attempts,
+            on_line=job.progress.feed,
         )
-    
-@app.post("/render")
-async def run_render(request: RenderRequest):
-    logger.info(f"Output directory: {request.output_dir}")
-
-    command = f"python3 /workspace/gaussian-splatting/render.py -m {request.output_dir}"
-
-    
-    # Create process with pipes
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,  # Line buffered
-    )
+    finally:
+        telemetry.close()
 
-    # Create queues for stdout and stderr
-    stdout_queue = queue.Queue()
-    stderr_queue = queue.Queue()
+    if process.returncode != 0:
+        raise JobFailed("Training failed", {"stderr": "Process error", "resumed_from": resumed_from})
 
-    # Create and start output reader threads
-    stdout_thread = threading.Thread(
-        target=stream_output, 
-        args=(process.stdout, stdout_queue)
-    )
-    stderr_thread = threading.Thread(
-        target=stream_output, 
-        args=(process.stderr, stderr_queue)
-    )
+    logger.info("Training completed successfully")
+    return {"message": "Training completed successfully", "resumed_from": resumed_from}
 
-    # Create and start logging threads
-    stdout_log_thread = threading.Thread(
-        target=log_from_queue,
-        args=(stdout_queue, process)
-    )
-    stderr_log_thread = threading.Thread(
-        target=log_from_queue,
-        args=(stderr_queue, process)
-    )
+@app.post("/train")
+async def run_train(request: TrainRequest, wait: bool = False):
+    return await respond(jobs.submit("train", train_job, request, priority=request.priority), wait)
 
-    # Start all threads
-    stdout_thread.start()
-    stderr_thread.start()
-    stdout_log_thread.start()
-    stderr_log_thread.start()
+def render_job(job, request: RenderRequest):
+    logger.info(f"Output directory: {request.output_dir}")
 
-    try:
-        # Wait for process to complete with timeout
-        process.wait()
-
-        # Wait for threads to finish
-        stdout_thread.join()
-        stderr_thread.join()
-        stdout_log_thread.join()
-        stderr_log_thread.join()
-
-        if process.returncode != 0:
-            error_message = "Render failed"
-            logger.error(error_message)
-            raise HTTPException(
-                status_code=500,
-                detail={"error": error_message, "stderr": "Process error"}
-            )
+    for split in ("train", "test"):
+        job.add_cleanup(os.path.join(request.output_dir, split))
 
+    if render_worker is not None:
+        try:
+            result = job.run_in_worker(render_worker, "render", {
+                "model_dir": request.output_dir,
+                "iteration": request.iteration,
+                "skip_train": request.skip_train,
+                "skip_test": request.skip_test,
+                "views": request.views,
+            })
+        except (WorkerError, WorkerDied) as e:
+            raise JobFailed("Render failed", {"stderr": str(e)})
         logger.info("Render completed successfully")
-        return {"message": "Render completed successfully"}
-
-    except Exception as e:
-        logger.error(f"Unexpected error during render: {str(e)}")
-        # Ensure process is terminated if something goes wrong
-        process.kill()
-        raise HTTPException(
-            status_code=500,
-            detail={"error": "Render failed", "stderr": str(e)}
-        )
+        return {"message": "Render completed successfully", **result}
 
-@app.post("/metrics")
-async def run_render(request: MetricsRequest):
-    logger.info(f"Output directory: {request.output_dir}")
+    command = ["python3", "/workspace/gaussian-splatting/render.py", "-m", request.output_dir]
+    if request.iteration != -1:
+        command.extend(["--iteration", str(request.iteration)])
+    if request.skip_train:
+        command.append("--skip_train")
+    if request.skip_test:
+        command.append("--skip_test")
+    if request.views:
+        logger.warning("views is only honoured by the resident render worker, rendering every view")
 
-    command = f"python3 /workspace/gaussian-splatting/metrics.py -m {request.output_dir}"
-
-    
-    # Create process with pipes
-    process = subprocess.Popen(
-        command,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,  # Line buffered
-    )
+    job.run_step(command, "Render", timeout=RENDER_TIMEOUT)
 
-    # Create queues for stdout and stderr
-    stdout_queue = queue.Queue()
-    stderr_queue = queue.Queue()
+    logger.info("Render completed successfully")
+    return {"message": "Render completed successfully"}
 
-    # Create and start output reader threads
-    stdout_thread = threading.Thread(
-        target=stream_output, 
-        args=(process.stdout, stdout_queue)
-    )
-    stderr_thread = threading.Thread(
-        target=stream_output, 
-        args=(process.stderr, stderr_queue)
-    )
+@app.post("/render")
+async def run_render(request: RenderRequest, wait: bool = False):
+    return await respond(jobs.submit("render", render_job, request, priority=request.priority), wait)
 
-    # Create and start logging threads
-    stdout_log_thread = threading.Thread(
-        target=log_from_queue,
-        args=(stdout_queue, process)
-    )
-    stderr_log_thread = threading.Thread(
-        target=log_from_queue,
-        args=(stderr_queue, process)
-    )
+def metrics_job(job, request: MetricsRequest):
+    logger.info(f"Output directory: {request.output_dir}")
 
-    # Start all threads
-    stdout_thread.start()
-    stderr_thread.start()
-    stdout_log_thread.start()
-    stderr_log_thread.start()
+    command = ["python3", "/workspace/gaussian-splatting/metrics.py", "-m", request.output_dir]
+    for name in ("results.json", "per_view.json"):
+        job.add_cleanup(os.path.join(request.output_dir, name))
 
-    try:
-        # Wait for process to complete with timeout
-        process.wait()
-
-        # Wait for threads to finish
-        stdout_thread.join()
-        stderr_thread.join()
-        stdout_log_thread.join()
-        stderr_log_thread.join()
-
-        if process.returncode != 0:
-            error_message = "Generating metrics failed"
-            logger.error(error_message)
-            raise HTTPException(
-                status_code=500,
-                detail={"error": error_message, "stderr": "Process error"}
-            )
-
-        logger.info("Metrics generated successfully")
-        return {"message": "Metrics generated successfully"}
-
-    except Exception as e:
-        logger.error(f"Unexpected error during metrics generation: {str(e)}")
-        # Ensure process is terminated if something goes wrong
-        process.kill()
-        raise HTTPException(
-            status_code=500,
-            detail={"error": "Generating metrics failed", "stderr": str(e)}
-        )
+    job.run_step(command, "Metrics generation", timeout=METRICS_TIMEOUT)
 
-@app.post("/depth_regularization")
-async def make_depth_regularization(request: DepthRegularizationRequest):
+    logger.info("Metrics generated successfully")
+    return {"message": "Metrics generated successfully"}
+
+@app.post("/metrics")
+async def run_metrics(request: MetricsRequest, wait: bool = False):
+    return await respond(jobs.submit("metrics", metrics_job, request, priority=request.priority), wait)
+
+def depth_regularization_job(job, request: DepthRegularizationRequest):
     logger.info(f"Starting depth generation and scaling - Input directory: {request.input_dir}")
-        
+    if request.depth_storage not in ("png", "pack"):
+        raise JobFailed(f"Unknown depth_storage: {request.depth_storage}", {"allowed": ["png", "pack"]})
+
+    # =================================================================
+    # STEP 1: Genera depth maps con Depth Anything V2
+    # =================================================================
+    logger.info("Step 1: Generating depth maps with Depth Anything V2...")
+
+    # Crea directory per depth maps se non esiste
+    images_dir = os.path.join(request.input_dir, 'images')
+    depths_dir = os.path.join(request.input_dir, 'depths')
+    sparse_dir = os.path.join(request.input_dir, 'sparse', '0')
+    job.add_cleanup(depths_dir)
+
+    # Solo le immagini nuove o modificate passano dall'inferenza
+    # run.py scrive solo mappe a 8 bit: i 16 bit richiedono il worker residente
+    bits = 16 if request.depth_storage == "pack" and depth_worker is not None else 8
+    if request.depth_storage == "pack" and bits == 8:
+        logger.warning("depth_storage=pack without the resident depth worker: packing 8-bit maps")
+    manifest = DepthManifest(depths_dir, *depth_identity(bits))
+    stale, removed = manifest.plan(images_dir)
+    logger.info(f"Depth maps: {len(stale)} to generate, {len(removed)} removed images")
+    manifest.forget(removed)
+    # Anche le mappe vecchie delle immagini modificate: il fitter non deve leggerle prima che vengano riscritte
+    manifest.forget(stale)
+
+    # Il fit di depth_params.json parte subito e segue l'inferenza, immagine per immagine
+    full_fit = manifest.colmap_changed(sparse_dir) or not os.path.exists(depth_params_path(request.input_dir))
+    fitter = None
+    if full_fit or stale or removed:
+        fitter = DepthScaleFitter(request.input_dir, depths_dir)
+        fitter.start(None if full_fit else [image_stem(name) for name in stale])
+
     try:
-        # =================================================================
-        # STEP 1: Genera depth maps con Depth Anything V2
-        # =================================================================
-        logger.info("Step 1: Generating depth maps with Depth Anything V2...")
-        
-        # Crea directory per depth maps se non esiste
-        images_dir = os.path.join(request.input_dir, 'images')
-        depths_dir = os.path.join(request.input_dir, 'depths')
-        depth_command = (
-            f"cd /workspace/Depth-Anything-V2 && "
-            f"python3 run.py --encoder vitl --pred-only --grayscale "
-            f"--img-path {images_dir} --outdir {depths_dir}"
-        )
-        
-        logger.info(f"Running depth generation: {depth_command}")
-        
-        # Esegui generazione depth maps
-        depth_process = subprocess.Popen(
-            depth_command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-        
-        # Create queues for depth generation output
-        depth_stdout_queue = queue.Queue()
-        depth_stderr_queue = queue.Queue()
-        
-        # Create and start output reader threads for depth generation
-        depth_stdout_thread = threading.Thread(
-            target=stream_output,
-            args=(depth_process.stdout, depth_stdout_queue)
-        )
-        depth_stderr_thread = threading.Thread(
-            target=stream_output,
-            args=(depth_process.stderr, depth_stderr_queue)
-        )
-        
-        # Create and start logging threads for depth generation
-        depth_stdout_log_thread = threading.Thread(
-            target=log_from_queue,
-            args=(depth_stdout_queue, depth_process)
-        )
-        depth_stderr_log_thread = threading.Thread(
-            target=log_from_queue,
-            args=(depth_stderr_queue, depth_process)
-        )
-        
-        # Start all depth generation threads
-        depth_stdout_thread.start()
-        depth_stderr_thread.start()
-        depth_stdout_log_thread.start()
-        depth_stderr_log_thread.start()
-        
-        # Wait for depth generation to complete
-        depth_process.wait()
-        
-        # Wait for depth generation threads to finish
-        depth_stdout_thread.join()
-        depth_stderr_thread.join()
-        depth_stdout_log_thread.join()
-        depth_stderr_log_thread.join()
-        
-        if depth_process.returncode != 0:
-            error_message = "Depth generation failed"
-            logger.error(error_message)
-            raise HTTPException(
-                status_code=500,
-                detail={"error": error_message, "step": "depth_regularization"}
-            )
-        
-        logger.info("✅ Depth maps generated successfully")
-        
-        # =================================================================
-        # STEP 2: Genera depth_params.json con make_depth_scale.py
-        # =================================================================
-        logger.info("Step 2: Generating depth_params.json...")
-        
-        params_command = (
-            f"python3 /workspace/gaussian-splatting/utils/make_depth_scale.py "
-            f"--base_dir {request.input_dir} --depths_dir {depths_dir}"
-        )
-        
-        logger.info(f"Running depth params generation: {params_command}")
-        
-        # Esegui generazione depth_params.json
-        params_process = subprocess.Popen(
-            params_command,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-        
-        # Create queues for params generation output
-        params_stdout_queue = queue.Queue()
-        params_stderr_queue = queue.Queue()
-        
-        # Create and start output reader threads for params generation
-        params_stdout_thread = threading.Thread(
-            target=stream_output,
-            args=(params_process.stdout, params_stdout_queue)
-        )
-        params_stderr_thread = threading.Thread(
-            target=stream_output,
-            args=(params_process.stderr, params_stderr_queue)
-        )
-        
-        # Create and start logging threads for params generation
-        params_stdout_log_thread = threading.Thread(
-            target=log_from_queue,
-            args=(params_stdout_queue, params_process)
-        )
-        params_stderr_log_thread = threading.Thread(
-            target=log_from_queue,
-            args=(params_stderr_queue, params_process)
-        )
-        
-        # Start all params generation threads
-        params_stdout_thread.start()
-        params_stderr_thread.start()
-        params_stdout_log_thread.start()
-        params_stderr_log_thread.start()
-        
-        # Wait for params generation to complete
-        params_process.wait()
-        
-        # Wait for params generation threads to finish
-        params_stdout_thread.join()
-        params_stderr_thread.join()
-        params_stdout_log_thread.join()
-        params_stderr_log_thread.join()
-        
-        if params_process.returncode != 0:
-            error_message = "Depth params generation failed"
-            logger.error(error_message)
-            raise HTTPException(
-                status_code=500,
-                detail={"error": error_message, "step": "depth_params"}
-            )
-        
-        logger.info("✅ depth_params.json generated successfully")
-        
-        # Conta le depth maps generate
-        depth_files = [f for f in os.listdir(depths_dir) 
-                      if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        depth_count = len(depth_files)
-        
-        if depth_count == 0:
-            logger.error("No depth maps were generated")
-            raise HTTPException(
-                status_code=500,
-                detail={"error": "No depth maps were generated", "dir": depths_dir}
-            )
-        
-        logger.info(f"✅ Depth generation completed successfully - {depth_count} depth maps generated")
-        
-        return {
-            "message": "Depth generation and params completed successfully",
-            "depth_maps_count": depth_count,
-            "depth_maps_dir": depths_dir
-        }
-        
-    except HTTPException:
-        # Re-raise HTTP exceptions
+        infer_depths(job, images_dir, depths_dir, stale, manifest, bits)
+    except BaseException:
+        if fitter is not None:
+            fitter.close()
         raise
-    except Exception as e:
-        logger.error(f"Unexpected error during depth processing: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail={"error": "Depth processing failed", "stderr": str(e)}
-        )
+
+    missing = manifest.record(images_dir, stale)
+    manifest.save()
+    if missing:
+        if fitter is not None:
+            fitter.close()
+        raise JobFailed("Depth generation failed", {"step": "depth_regularization", "missing": missing[:20]})
+
+    logger.info("✅ Depth maps generated successfully")
+
+    # Il pack si costruisce mentre il fitter finisce le ultime immagini
+    depth_storage = {"mode": request.depth_storage, "bits": bits}
+    if request.depth_storage == "pack":
+        try:
+            depth_storage.update(build_pack(depths_dir, [image_stem(name) for name in stale]))
+            depth_storage.update(compare_loading(depths_dir))
+        except BaseException:
+            if fitter is not None:
+                fitter.close()
+            raise
+        logger.info(f"Depth pack: {depth_storage['pack_bytes'] / 2**20:.1f} MB "
+                    f"(PNG {depth_storage['png_bytes'] / 2**20:.1f} MB), load "
+                    f"{depth_storage['pack_load_ms']:.2f} ms/map (PNG {depth_storage['png_load_ms']:.2f} ms/map)")
+    else:
+        remove_pack(depths_dir)
+
+    # =================================================================
+    # STEP 2: Genera depth_params.json (common.depth_scale, al posto di make_depth_scale.py)
+    # =================================================================
+    logger.info("Step 2: Generating depth_params.json...")
+
+    depth_scale = None
+    if fitter is not None:
+        try:
+            depth_scale = fitter.finish([image_stem(name) for name in removed])
+        except Exception as e:
+            raise JobFailed("Depth params generation failed", {"step": "depth_params", "error": str(e)})
+    else:
+        logger.info("depth_params.json is up to date")
+
+    manifest.record_colmap(sparse_dir)
+    manifest.save()
+
+    logger.info("✅ depth_params.json generated successfully")
+
+    # Conta le depth maps generate
+    depth_files = [f for f in os.listdir(depths_dir)
+                  if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    depth_count = len(depth_files)
+
+    if depth_count == 0:
+        raise JobFailed("No depth maps were generated", {"dir": depths_dir})
+
+    logger.info(f"✅ Depth generation completed successfully - {depth_count} depth maps generated")
+
+    return {
+        "message": "Depth generation and params completed successfully",
+        "depth_maps_count": depth_count,
+        "depth_maps_generated": len(stale),
+        "depth_maps_removed": len(removed),
+        "depth_maps_dir": depths_dir,
+        "depth_scale": depth_scale,
+        "depth_storage": depth_storage,
+    }
+
+def infer_depths(job, images_dir, depths_dir, stale, manifest, bits=8):
+    """Depth Anything V2 on the ``stale`` images, in the resident worker or with run.py."""
+    if not stale:
+        logger.info("All depth maps are up to date, skipping inference")
+    elif depth_worker is not None:
+        try:
+            inference = job.run_in_worker(depth_worker, "infer", {
+                "images_dir": images_dir, "outdir": depths_dir, "images": stale, "bits": bits,
+            })
+        except (WorkerError, WorkerDied) as e:
+            raise JobFailed("Depth generation failed", {"step": "depth_regularization", "stderr": str(e)})
+        logger.info(f"Depth inference: {inference['images_per_s']:.2f} images/s in {inference['batches']} batches")
+    else:
+        # run.py accetta anche un .txt con l'elenco delle immagini
+        os.makedirs(depths_dir, exist_ok=True)
+        image_list = os.path.join(depths_dir, "depth_pending.txt")
+        with open(image_list, "w") as f:
+            f.write("\n".join(os.path.join(images_dir, name) for name in stale))
+        depth_command = [
+            "python3", "run.py", "--encoder", "vitl", "--pred-only", "--grayscale",
+            "--img-path", image_list, "--outdir", depths_dir,
+        ]
+
+        logger.info(f"Running depth generation: {' '.join(depth_command)}")
+
+        # Esegui generazione depth maps (niente shell: l'annullamento raggiunge python)
+        try:
+            depth_process = job.run_process(depth_command, cwd="/workspace/Depth-Anything-V2")
+        finally:
+            os.remove(image_list)
+
+        if depth_process.returncode != 0:
+            # Le mappe già scritte restano valide per il prossimo tentativo
+            manifest.record(images_dir, stale)
+            manifest.save()
+            raise JobFailed("Depth generation failed", {"step": "depth_regularization"})
+
+@app.post("/depth_regularization")
+async def make_depth_regularization(request: DepthRegularizationRequest, wait: bool = False):
+    return await respond(jobs.submit("depth_regularization", depth_regularization_job, request, priority=request.priority), wait)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# common/ si importa dalla radice, i moduli del converter dalla loro cartella (come nel container)
+for path in (ROOT, os.path.join(ROOT, "colmap-converter")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
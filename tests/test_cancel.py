@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+
+from common.jobs import CANCELLED, JobManager
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # Zombie (già uscito, non ancora raccolto): conta come terminato
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().split(")")[-1].split()[0] != "Z"
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+def test_queued_job_is_removed_without_running():
+    release = threading.Event()
+    ran = []
+    manager = JobManager(slots=1, max_queue=4)
+    try:
+        manager.submit("train", lambda job: release.wait(5))
+        queued = manager.submit("render", lambda job: ran.append(job.id))
+        assert manager.cancel(queued)
+        assert queued.state == CANCELLED and queued.cancellation["was_running"] is False
+        assert not manager.cancel(queued)
+    finally:
+        release.set()
+    time.sleep(0.1)
+    assert ran == []
+
+
+def test_running_job_kills_the_process_group_and_its_partial_output(tmp_path):
+    existing = tmp_path / "existing"
+    existing.mkdir()
+    partial = tmp_path / "partial"
+    pid_file = tmp_path / "child.pid"
+    # Una shell che lancia un figlio: il SIGTERM deve arrivare a tutto il gruppo
+    script = f"import subprocess, time; p = subprocess.Popen(['sleep', '60']); open({str(pid_file)!r}, 'w').write(str(p.pid)); time.sleep(60)"
+
+    def body(job):
+        job.add_cleanup(str(existing))
+        job.add_cleanup(str(partial))
+        partial.mkdir()
+        job.run_process([sys.executable, "-c", script])
+
+    manager = JobManager(slots=1, max_queue=4)
+    job = manager.submit("train", body)
+    _wait_for(lambda: pid_file.exists() and pid_file.read_text())
+    child = int(pid_file.read_text())
+    leader = job.process.pid
+
+    assert manager.cancel(job, keep_output=False, grace=2, gpu_timeout=0)
+    assert job.state == CANCELLED and job.error is None
+    assert job.cancellation["was_running"] and job.cancellation["removed_paths"] == [str(partial)]
+    assert existing.exists() and not partial.exists()
+    _wait_for(lambda: not _alive(leader) and not _alive(child))
+
+
+def test_cancel_keeps_output_by_default(tmp_path):
+    started = threading.Event()
+    partial = tmp_path / "partial"
+
+    def body(job):
+        job.add_cleanup(str(partial))
+        partial.mkdir()
+        started.set()
+        job.run_process([sys.executable, "-c", "import time; time.sleep(60)"])
+
+    manager = JobManager(slots=1, max_queue=4)
+    job = manager.submit("train", body)
+    assert started.wait(5)
+    _wait_for(lambda: job.process is not None)
+    assert manager.cancel(job, grace=2, gpu_timeout=0)
+    assert partial.exists() and job.cancellation["removed_paths"] == []
@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+from common.checkpoints import checkpoint_arguments, checkpoint_schedule, find_latest_checkpoint, run_training
+
+
+class FakeJob:
+    """Stand-in for Job.run_process: every attempt writes its checkpoints, then exits with the next code."""
+
+    def __init__(self, output_dir, attempts):
+        self.output_dir = output_dir
+        self.attempts = list(attempts)
+        self.commands = []
+        self.cancel_requested = False
+
+    def run_process(self, command, **kwargs):
+        self.commands.append(command)
+        returncode, saved = self.attempts.pop(0)
+        for iteration in saved:
+            (self.output_dir / f"chkpnt{iteration}.pth").write_bytes(b"")
+        return SimpleNamespace(returncode=returncode)
+
+
+def _start(command):
+    return command[command.index("--start_checkpoint") + 1] if "--start_checkpoint" in command else None
+
+
+def test_schedule_interval_and_explicit():
+    assert checkpoint_schedule(20000, 5000) == [5000, 10000, 15000]
+    assert checkpoint_schedule(10000, 0, explicit=[7000, 0, 12000]) == [7000]
+    assert checkpoint_schedule(10000, 4000, explicit=["8000"]) == [4000, 8000]
+
+
+def test_schedule_reads_the_interval_from_the_environment(monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_INTERVAL", "3000")
+    assert checkpoint_schedule(10000) == [3000, 6000, 9000]
+
+
+def test_arguments_merge_params_and_skip_empty_schedules():
+    params = {"iterations": 10000, "checkpoint_iterations": "2500 7500"}
+    assert checkpoint_arguments(params, interval=5000) == ["--checkpoint_iterations", "2500", "5000", "7500"]
+    assert checkpoint_arguments({"iterations": 10000}, interval=0) == []
+
+
+def test_latest_checkpoint_is_the_highest_iteration(tmp_path):
+    assert find_latest_checkpoint(str(tmp_path / "missing")) is None
+    for name in ("chkpnt900.pth", "chkpnt10000.pth", "chkpnt2000.pth", "chkpnt.pth", "point_cloud.ply"):
+        (tmp_path / name).write_bytes(b"")
+    assert find_latest_checkpoint(str(tmp_path)).iteration == 10000
+    assert find_latest_checkpoint(str(tmp_path), ignore={"chkpnt10000.pth"}).iteration == 2000
+
+
+def test_existing_checkpoints_are_ignored_without_resume(tmp_path):
+    (tmp_path / "chkpnt20000.pth").write_bytes(b"")
+    job = FakeJob(tmp_path, [(0, [])])
+    process, resumed_from = run_training(job, ["train.py"], str(tmp_path))
+    assert process.returncode == 0 and resumed_from == []
+    assert _start(job.commands[0]) is None
+
+
+def test_resume_starts_from_the_latest_checkpoint(tmp_path):
+    (tmp_path / "chkpnt5000.pth").write_bytes(b"")
+    job = FakeJob(tmp_path, [(0, [])])
+    _, resumed_from = run_training(job, ["train.py"], str(tmp_path), resume=True)
+    assert resumed_from == [5000]
+    assert _start(job.commands[0]) == str(tmp_path / "chkpnt5000.pth")
+
+
+def test_retry_uses_only_checkpoints_of_this_job(tmp_path):
+    # Un run precedente ha lasciato un chkpnt più avanti di quelli di questo job
+    (tmp_path / "chkpnt20000.pth").write_bytes(b"")
+    job = FakeJob(tmp_path, [(1, [5000]), (0, [])])
+    process, resumed_from = run_training(job, ["train.py"], str(tmp_path), max_attempts=2)
+    assert process.returncode == 0 and resumed_from == [5000]
+
+
+def test_retry_stops_without_a_newer_checkpoint(tmp_path):
+    job = FakeJob(tmp_path, [(1, [5000]), (1, []), (0, [])])
+    process, resumed_from = run_training(job, ["train.py"], str(tmp_path), max_attempts=5)
+    assert process.returncode == 1 and resumed_from == [5000]
+    assert len(job.commands) == 2
@@ -0,0 +1,61 @@
+import os
+
+import cv2
+import numpy as np
+
+from coarse_to_fine import rescale_model
+from common.colmap_model import (
+    Camera, ImageArrays, read_cameras_binary, read_images_arrays, write_cameras_binary, write_images_arrays,
+)
+
+
+def _coarse_model(tmp_path):
+    model = tmp_path / "sparse"
+    images = tmp_path / "images"
+    model.mkdir()
+    images.mkdir()
+    cv2.imwrite(str(images / "a.png"), np.zeros((200, 400, 3), dtype=np.uint8))
+    write_cameras_binary({1: Camera(1, "PINHOLE", 100, 50, [80.0, 80.0, 50.0, 25.0])}, str(model / "cameras.bin"))
+    arrays = ImageArrays(
+        np.array([1]), np.array([[1.0, 0, 0, 0]]), np.zeros((1, 3)), np.array([1]), ["a.png"],
+        np.array([0, 2]), np.array([[10.0, 5.0], [20.0, 10.0]]), np.array([-1, -1]),
+    )
+    write_images_arrays(arrays, str(model / "images.bin"))
+    return str(model), str(images)
+
+
+def test_rescale_scales_points_and_camera(tmp_path):
+    model, images = _coarse_model(tmp_path)
+    assert rescale_model(model, images) == {"1": [4.0, 4.0]}
+    camera = read_cameras_binary(os.path.join(model, "cameras.bin"))[1]
+    assert (camera.width, camera.height) == (400, 200)
+    assert np.allclose(camera.params, [320.0, 320.0, 200.0, 100.0])
+    assert np.allclose(read_images_arrays(os.path.join(model, "images.bin")).xys, [[40, 20], [80, 40]])
+
+
+def test_rerun_does_not_scale_twice(tmp_path):
+    model, images = _coarse_model(tmp_path)
+    rescale_model(model, images)
+    assert rescale_model(model, images) == {"1": [1.0, 1.0]}
+    assert np.allclose(read_images_arrays(os.path.join(model, "images.bin")).xys, [[40, 20], [80, 40]])
+
+
+def test_rerun_finishes_an_interrupted_swap(tmp_path):
+    model, images = _coarse_model(tmp_path)
+    rescale_model(model, images)
+    # Interrotto dopo il marker: images.bin già sostituito, cameras.bin ancora quello grezzo
+    os.replace(os.path.join(model, "cameras.bin"), os.path.join(model, "cameras.bin.rescaled"))
+    write_cameras_binary({1: Camera(1, "PINHOLE", 100, 50, [80.0, 80.0, 50.0, 25.0])}, os.path.join(model, "cameras.bin"))
+    open(os.path.join(model, "rescale.pending"), "w").close()
+    rescale_model(model, images)
+    assert read_cameras_binary(os.path.join(model, "cameras.bin"))[1].width == 400
+    assert np.allclose(read_images_arrays(os.path.join(model, "images.bin")).xys, [[40, 20], [80, 40]])
+    assert sorted(os.listdir(model)) == ["cameras.bin", "images.bin"]
+
+
+def test_partial_write_before_marker_is_discarded(tmp_path):
+    model, images = _coarse_model(tmp_path)
+    with open(os.path.join(model, "images.bin.rescaled"), "wb") as f:
+        f.write(b"\x01")
+    rescale_model(model, images)
+    assert np.allclose(read_images_arrays(os.path.join(model, "images.bin")).xys, [[40, 20], [80, 40]])
@@ -0,0 +1,80 @@
+import os
+
+from colmap_cache import ColmapCache, conversion_key, input_images, natural_key
+
+SETTINGS = {"camera": "OPENCV", "matcher": "sequential"}
+
+
+def _capture(path, frames=3):
+    input_dir = path / "input"
+    input_dir.mkdir(parents=True)
+    for i in range(frames):
+        (input_dir / f"frame_{i}.jpg").write_bytes(bytes([i]) * 64)
+    return input_dir
+
+
+def _converted(scene):
+    (scene / "images").mkdir()
+    (scene / "images" / "frame_0.jpg").write_bytes(b"undistorted")
+    (scene / "sparse" / "0").mkdir(parents=True)
+    (scene / "sparse" / "0" / "cameras.bin").write_bytes(b"cameras")
+    (scene / "distorted").mkdir()
+    (scene / "distorted" / "database.db").write_bytes(b"db")
+
+
+def test_key_follows_content_names_and_settings(tmp_path):
+    input_dir = _capture(tmp_path)
+    key, count = conversion_key(str(input_dir), SETTINGS)
+    assert count == 3
+    assert conversion_key(str(input_dir), dict(reversed(list(SETTINGS.items()))))[0] == key
+    assert conversion_key(str(input_dir), {**SETTINGS, "matcher": "exhaustive"})[0] != key
+    # Un file che non è un'immagine non cambia la chiave
+    (input_dir / "notes.txt").write_text("x")
+    assert conversion_key(str(input_dir), SETTINGS)[0] == key
+    (input_dir / "frame_1.jpg").write_bytes(b"changed")
+    assert conversion_key(str(input_dir), SETTINGS)[0] != key
+    os.rename(input_dir / "frame_1.jpg", input_dir / "frame_9.jpg")
+    assert conversion_key(str(input_dir), SETTINGS)[0] != key
+
+
+def test_input_order_is_natural(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for name in ("f10.JPG", "f2.jpg", "f1.png", ".hidden.jpg", "readme.md"):
+        (input_dir / name).write_bytes(b"x")
+    assert input_images(str(input_dir)) == ["f1.png", "f2.jpg", "f10.JPG"]
+    assert sorted(["a10", "a9", "b1", "a"], key=natural_key) == ["a", "a9", "a10", "b1"]
+
+
+def test_restore_hardlinks_outputs_and_copies_private_files(tmp_path):
+    cache = ColmapCache(str(tmp_path / "cache"))
+    first = tmp_path / "first"
+    _capture(first)
+    _converted(first)
+    key = conversion_key(str(first / "input"), SETTINGS)[0]
+    assert cache.store(key, str(first), ["images", "sparse/0", "missing"], SETTINGS, private=["distorted/database.db"])
+    assert not cache.store(key, str(first), ["images"], SETTINGS)
+
+    second = tmp_path / "second"
+    _capture(second)
+    (second / "images").mkdir()
+    (second / "images" / "stale.jpg").write_bytes(b"old")
+    (second / "old_pyramid").mkdir()
+    restored = cache.materialize(key, str(second), clear=["old_pyramid"])
+    assert restored["linked"] == 2 and restored["copied"] == 1
+    assert sorted(restored["restored"]) == ["distorted/database.db", "images", "sparse/0"]
+    assert os.listdir(second / "images") == ["frame_0.jpg"] and not (second / "old_pyramid").exists()
+    assert os.path.samefile(second / "sparse" / "0" / "cameras.bin", first / "sparse" / "0" / "cameras.bin")
+    # database.db viene modificato sul posto da --extend: mai condiviso
+    database = second / "distorted" / "database.db"
+    assert database.read_bytes() == b"db" and not os.path.samefile(database, first / "distorted" / "database.db")
+
+
+def test_miss_and_leftover_tmp_entry(tmp_path):
+    cache = ColmapCache(str(tmp_path / "cache"))
+    scene = tmp_path / "scene"
+    _capture(scene)
+    assert cache.materialize("nope", str(scene)) is False
+    # Un'entry temporanea lasciata da un crash non è un hit
+    os.makedirs(tmp_path / "cache" / "key.tmp-1")
+    assert cache.materialize("key", str(scene)) is False
@@ -0,0 +1,124 @@
+import struct
+
+import numpy as np
+
+from common.colmap_model import (
+    PLY_VERTEX, ImageArrays, PointArrays, read_images_arrays, read_points3D_arrays, read_points3D_binary,
+    read_points3D_colors, select_points, write_images_arrays, write_points3D_arrays, write_points3D_ply,
+)
+
+
+def _points(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    return PointArrays(
+        np.arange(10, 10 + len(lengths), dtype=np.int64), rng.normal(size=(len(lengths), 3)),
+        rng.integers(0, 256, size=(len(lengths), 3), dtype=np.uint8), rng.random(len(lengths)),
+        np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        rng.integers(1, 50, total).astype(np.int32), rng.integers(0, 5000, total).astype(np.int32),
+    )
+
+
+def _assert_points_equal(a, b):
+    for name in PointArrays._fields:
+        assert np.array_equal(getattr(a, name), getattr(b, name)), name
+
+
+def test_points_round_trip_with_variable_tracks(tmp_path):
+    points = _points([2, 0, 7, 1, 3])
+    path = str(tmp_path / "points3D.bin")
+    write_points3D_arrays(points, path)
+    _assert_points_equal(read_points3D_arrays(path), points)
+    xyz, rgb = read_points3D_colors(path)
+    assert np.array_equal(xyz, points.xyz) and np.array_equal(rgb, points.rgb)
+
+
+def test_points_match_a_record_by_record_reader(tmp_path):
+    points = _points(np.random.default_rng(1).integers(0, 12, 500))
+    path = str(tmp_path / "points3D.bin")
+    write_points3D_arrays(points, path)
+    with open(path, "rb") as f:
+        data = f.read()
+    offset, expected = 8, {}
+    for _ in range(struct.unpack_from("<Q", data, 0)[0]):
+        point_id, x, y, z, r, g, b, error, length = struct.unpack_from("<QdddBBBdQ", data, offset)
+        offset += 51
+        track = struct.unpack_from(f"<{2 * length}i", data, offset)
+        offset += 8 * length
+        expected[point_id] = ((x, y, z), track[0::2])
+    assert offset == len(data)
+    for point_id, point in read_points3D_binary(path).items():
+        assert tuple(point.xyz) == expected[point_id][0]
+        assert tuple(point.image_ids) == expected[point_id][1]
+
+
+def test_empty_points_file(tmp_path):
+    path = tmp_path / "points3D.bin"
+    path.write_bytes(b"")
+    assert len(read_points3D_arrays(str(path)).ids) == 0
+
+
+def test_select_points_keeps_the_tracks(tmp_path):
+    points = _points([2, 0, 3])
+    selected = select_points(points, np.array([False, True, True]))
+    assert selected.ids.tolist() == [11, 12]
+    assert selected.track_offsets.tolist() == [0, 0, 3]
+    assert np.array_equal(selected.image_ids, points.image_ids[2:])
+
+
+def test_images_round_trip(tmp_path):
+    images = ImageArrays(
+        np.array([3, 1], dtype=np.int32), np.array([[1.0, 0, 0, 0], [0.5, 0.5, 0.5, 0.5]]),
+        np.array([[0.0, 1, 2], [3, 4, 5]]), np.array([1, 2], dtype=np.int32), ["b.jpg", "ä/a.jpg"],
+        np.array([0, 0, 2]), np.array([[1.5, 2.5], [3.5, 4.5]]), np.array([-1, 7]),
+    )
+    path = str(tmp_path / "images.bin")
+    write_images_arrays(images, path)
+    read = read_images_arrays(path)
+    assert read.names == images.names
+    for name in ("ids", "qvecs", "tvecs", "camera_ids", "point_offsets", "xys", "point3D_ids"):
+        assert np.array_equal(getattr(read, name), getattr(images, name)), name
+
+
+def test_ply_has_the_training_loader_layout(tmp_path):
+    xyz = np.array([[1.0, 2.0, 3.0], [-1.0, 0.5, 0.25]])
+    rgb = np.array([[255, 0, 10], [1, 2, 3]], dtype=np.uint8)
+    path = tmp_path / "points3D.ply"
+    size = write_points3D_ply(xyz, rgb, str(path))
+    data = path.read_bytes()
+    assert len(data) == size
+    header, body = data.split(b"end_header\n", 1)
+    assert b"element vertex 2\n" in header
+    assert [line.split()[-1] for line in header.decode().splitlines() if line.startswith("property")] == list(
+        PLY_VERTEX.names
+    )
+    vertices = np.frombuffer(body, dtype=PLY_VERTEX)
+    assert np.array_equal(np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1), xyz.astype(np.float32))
+    assert np.array_equal(np.stack([vertices["red"], vertices["green"], vertices["blue"]], axis=1), rgb)
+    assert not vertices["nx"].any()
+
+
+def _parse_ply(data):
+    """Minimal binary PLY reader driven by the header only, as plyfile reads it in fetchPly."""
+    header, body = data.split(b"end_header\n", 1)
+    lines = header.decode("ascii").splitlines()
+    assert lines[:2] == ["ply", "format binary_little_endian 1.0"]
+    count = int(next(line for line in lines if line.startswith("element vertex")).split()[-1])
+    types = {"float": "<f4", "uchar": "u1", "double": "<f8"}
+    dtype = np.dtype([(line.split()[2], types[line.split()[1]]) for line in lines if line.startswith("property")])
+    return np.frombuffer(body, dtype=dtype, count=count)
+
+
+def test_ply_from_points3D_bin_matches_the_model(tmp_path):
+    points = _points(np.random.default_rng(2).integers(2, 6, 300), seed=2)
+    bin_path = str(tmp_path / "points3D.bin")
+    ply_path = tmp_path / "points3D.ply"
+    write_points3D_arrays(points, bin_path)
+    write_points3D_ply(*read_points3D_colors(bin_path), str(ply_path))
+    vertices = _parse_ply(ply_path.read_bytes())
+    model = read_points3D_binary(bin_path)
+    assert len(vertices) == len(model)
+    for vertex, point in zip(vertices, model.values()):
+        assert np.allclose([vertex["x"], vertex["y"], vertex["z"]], point.xyz, atol=1e-6)
+        assert [vertex["red"], vertex["green"], vertex["blue"]] == point.rgb.tolist()
@@ -0,0 +1,81 @@
+import os
+
+import cv2
+import numpy as np
+
+from common.depth import DepthService, TinyDepthBackend, depth_to_png, list_images
+from common.worker import ResidentWorker
+
+BACKEND = "common.depth:TinyDepthBackend"
+
+
+def images(images_dir, sizes):
+    os.makedirs(images_dir)
+    rng = np.random.default_rng(0)
+    names = []
+    for i, (width, height) in enumerate(sizes):
+        name = f"frame_{i:05d}.jpg"
+        cv2.imwrite(os.path.join(images_dir, name), (rng.random((height, width, 3)) * 255).astype(np.uint8))
+        names.append(name)
+    # Un file non immagine non va all'inferenza
+    open(os.path.join(images_dir, "notes.txt"), "w").close()
+    return names
+
+
+def single_image_depth(path, bits=8):
+    backend = TinyDepthBackend()
+    raw = cv2.imread(path)
+    return depth_to_png(backend.infer(backend.prepare(raw)[np.newaxis], raw.shape[:2])[0], bits)
+
+
+def test_batches_by_resolution_and_writes_each_map_to_its_image(tmp_path):
+    images_dir, outdir = str(tmp_path / "images"), str(tmp_path / "depths")
+    # Risoluzioni alternate: i batch si formano per dimensione, non per ordine
+    names = images(images_dir, [(64, 48), (80, 40)] * 3 + [(64, 48)] * 2)
+    service = DepthService(BACKEND, batch_size=2, decode_workers=2)
+    events = []
+
+    result = service.infer(images_dir, outdir, emit=events.append)
+
+    assert list_images(images_dir) == names
+    assert result["count"] == len(names)
+    # 5 immagini 64x48 in batch da 2 -> 3, 3 immagini 80x40 -> 2
+    assert result["batches"] == 5
+    assert events[-1]["iteration"] == len(names) and events[-1]["percent"] == 100
+    for name in names:
+        written = cv2.imread(os.path.join(outdir, name.replace(".jpg", ".png")), cv2.IMREAD_UNCHANGED)
+        np.testing.assert_array_equal(written, single_image_depth(os.path.join(images_dir, name)))
+
+
+def test_subset_and_16_bit_maps(tmp_path):
+    images_dir, outdir = str(tmp_path / "images"), str(tmp_path / "depths")
+    names = images(images_dir, [(64, 48)] * 3)
+    service = DepthService(BACKEND, batch_size=4, decode_workers=1)
+
+    service.infer(images_dir, outdir, images=names[1:], bits=16)
+
+    assert sorted(os.listdir(outdir)) == ["frame_00001.png", "frame_00002.png"]
+    written = cv2.imread(os.path.join(outdir, "frame_00001.png"), cv2.IMREAD_UNCHANGED)
+    assert written.dtype == np.uint16 and written.shape == (48, 64)
+    np.testing.assert_array_equal(written, single_image_depth(os.path.join(images_dir, names[1]), bits=16))
+
+
+def test_depth_to_png_handles_flat_depth():
+    png = depth_to_png(np.full((4, 5), 3.0))
+    assert png.shape == (4, 5, 3) and png.dtype == np.uint8 and not png.any()
+    assert depth_to_png(np.arange(6.0).reshape(2, 3), bits=16).max() == 65535
+
+
+def test_resident_depth_worker_is_stopped_on_release(tmp_path):
+    images_dir, outdir = str(tmp_path / "images"), str(tmp_path / "depths")
+    images(images_dir, [(64, 48)] * 2)
+    worker = ResidentWorker("common.depth:DepthService", {"backend": BACKEND, "batch_size": 2}, name="depth")
+    try:
+        assert worker.call("info") == {"model": "tiny", "encoder": "tiny"}
+        assert worker.call("infer", {"images_dir": images_dir, "outdir": outdir})["count"] == 2
+        # Senza release_op il rilascio ferma il worker: la chiamata successiva lo riavvia
+        worker.release()
+        assert not worker.alive
+        assert worker.call("info")["model"] == "tiny"
+    finally:
+        worker.close()
@@ -0,0 +1,80 @@
+import os
+
+import cv2
+import numpy as np
+
+from common.depth_manifest import DepthManifest, png_size
+
+
+def _scene(tmp_path, names=("a.jpg", "b.jpg", "c.jpg")):
+    images = tmp_path / "images"
+    depths = tmp_path / "depths"
+    images.mkdir()
+    depths.mkdir()
+    for i, name in enumerate(names):
+        cv2.imwrite(str(images / name), np.full((8, 12, 3), 40 * i, dtype=np.uint8))
+    return str(images), str(depths)
+
+
+def _write_depths(depths, names):
+    for name in names:
+        cv2.imwrite(os.path.join(depths, os.path.splitext(name)[0] + ".png"), np.zeros((8, 12), dtype=np.uint8))
+
+
+def _generated(images, depths, encoder="vitl"):
+    manifest = DepthManifest(depths, "depth-anything-v2", encoder)
+    stale, _ = manifest.plan(images)
+    _write_depths(depths, stale)
+    assert manifest.record(images, stale) == []
+    manifest.save()
+    return DepthManifest(depths, "depth-anything-v2", encoder)
+
+
+def test_second_run_has_nothing_to_do(tmp_path):
+    images, depths = _scene(tmp_path)
+    assert DepthManifest(depths, "depth-anything-v2", "vitl").plan(images) == (["a.jpg", "b.jpg", "c.jpg"], [])
+    assert _generated(images, depths).plan(images) == ([], [])
+    assert png_size(os.path.join(depths, "a.png")) == [12, 8]
+
+
+def test_changed_added_and_removed_images(tmp_path):
+    images, depths = _scene(tmp_path)
+    manifest = _generated(images, depths)
+    cv2.imwrite(os.path.join(images, "b.jpg"), np.full((8, 12, 3), 200, dtype=np.uint8))
+    cv2.imwrite(os.path.join(images, "d.jpg"), np.zeros((8, 12, 3), dtype=np.uint8))
+    os.remove(os.path.join(images, "c.jpg"))
+    assert manifest.plan(images) == (["b.jpg", "d.jpg"], ["c.jpg"])
+    manifest.forget(["c.jpg"])
+    assert not os.path.exists(os.path.join(depths, "c.png")) and "c.jpg" not in manifest.images
+
+
+def test_touched_image_with_same_content_is_not_stale(tmp_path):
+    images, depths = _scene(tmp_path)
+    manifest = _generated(images, depths)
+    os.utime(os.path.join(images, "a.jpg"), ns=(1, 1))
+    assert manifest.plan(images) == ([], [])
+
+
+def test_other_encoder_or_missing_map_regenerates(tmp_path):
+    images, depths = _scene(tmp_path)
+    _generated(images, depths)
+    assert DepthManifest(depths, "depth-anything-v2", "vits").plan(images)[0] == ["a.jpg", "b.jpg", "c.jpg"]
+    os.remove(os.path.join(depths, "b.png"))
+    manifest = DepthManifest(depths, "depth-anything-v2", "vitl")
+    assert manifest.plan(images)[0] == ["b.jpg"]
+    # Una mappa non scritta dall'inferenza non entra nel manifest
+    assert manifest.record(images, ["b.jpg"]) == ["b.jpg"] and "b.jpg" not in manifest.images
+
+
+def test_colmap_fingerprint(tmp_path):
+    images, depths = _scene(tmp_path)
+    sparse = tmp_path / "sparse"
+    sparse.mkdir()
+    (sparse / "images.bin").write_bytes(b"1")
+    manifest = _generated(images, depths)
+    assert manifest.colmap_changed(str(sparse))
+    manifest.record_colmap(str(sparse))
+    manifest.save()
+    assert not DepthManifest(depths, "depth-anything-v2", "vitl").colmap_changed(str(sparse))
+    (sparse / "images.bin").write_bytes(b"22")
+    assert manifest.colmap_changed(str(sparse))
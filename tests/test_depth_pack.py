@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+
+from common import depth_pack
+from common.depth_pack import ALIGNMENT, DepthPack, build_pack, compare_loading, remove_pack, training_command
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _depths(directory):
+    rng = np.random.default_rng(0)
+    maps = {
+        "a": rng.integers(0, 2**16, (30, 41), dtype=np.uint16),
+        "b": rng.integers(0, 256, (17, 23), dtype=np.uint8),
+    }
+    for stem, depth in maps.items():
+        cv2.imwrite(str(directory / f"{stem}.png"), depth)
+    # run.py replica il grigio su tre canali
+    gray = rng.integers(0, 256, (9, 13), dtype=np.uint8)
+    cv2.imwrite(str(directory / "c.png"), np.dstack([gray] * 3))
+    maps["c"] = gray
+    return maps
+
+
+def test_pack_round_trip_keeps_dtype_and_values(tmp_path):
+    maps = _depths(tmp_path)
+    stats = build_pack(str(tmp_path))
+    assert stats["maps"] == 3 and stats["reused"] == 0 and stats["dtypes"] == ["<u2", "|u1"]
+    pack = DepthPack(str(tmp_path))
+    assert len(pack) == 3 and "a" in pack and "z" not in pack
+    for stem, depth in maps.items():
+        packed = pack.get(stem)
+        assert packed.dtype == depth.dtype and np.array_equal(packed, depth)
+        assert pack.entries[stem]["offset"] % ALIGNMENT == 0
+        # Vista sul file mappato, nessuna copia
+        assert not packed.flags.owndata
+
+
+def test_rebuild_reuses_unchanged_maps(tmp_path):
+    _depths(tmp_path)
+    build_pack(str(tmp_path))
+    changed = np.full((30, 41), 7, dtype=np.uint16)
+    cv2.imwrite(str(tmp_path / "a.png"), changed)
+    os.remove(tmp_path / "b.png")
+    stats = build_pack(str(tmp_path), changed=["a"])
+    assert stats["maps"] == 2 and stats["reused"] == 1
+    assert np.array_equal(DepthPack(str(tmp_path)).get("a"), changed)
+
+
+def test_compare_and_remove(tmp_path):
+    _depths(tmp_path)
+    build_pack(str(tmp_path))
+    comparison = compare_loading(str(tmp_path), sample=2)
+    assert comparison["sampled_maps"] == 2 and comparison["pack_bytes"] > 0
+    assert training_command(["python3", "train.py", "-s", "x"], str(tmp_path)) == [
+        "python3", "-m", "common.depth_pack", "train.py", "-s", "x"]
+    remove_pack(str(tmp_path))
+    assert training_command(["python3", "train.py"], str(tmp_path)) == ["python3", "train.py"]
+
+
+def test_shim_serves_packed_maps_only_for_unchanged_reads(tmp_path, monkeypatch):
+    maps = _depths(tmp_path)
+    build_pack(str(tmp_path))
+    monkeypatch.setattr(cv2, "imread", cv2.imread)
+    depth_pack.install()
+    # Il PNG sparisce: la lettura arriva dal pack
+    os.remove(tmp_path / "a.png")
+    assert np.array_equal(cv2.imread(str(tmp_path / "a.png"), cv2.IMREAD_UNCHANGED), maps["a"])
+    # Altri flag o file fuori dal pack passano a OpenCV
+    assert cv2.imread(str(tmp_path / "c.png")).shape == (9, 13, 3)
+    other = tmp_path / "other"
+    other.mkdir()
+    cv2.imwrite(str(other / "a.png"), np.zeros((2, 2), dtype=np.uint8))
+    assert cv2.imread(str(other / "a.png"), cv2.IMREAD_UNCHANGED).shape == (2, 2)
+
+
+def test_module_runs_the_script_with_the_shim(tmp_path):
+    maps = _depths(tmp_path)
+    build_pack(str(tmp_path))
+    cv2.imwrite(str(tmp_path / "b.png"), np.zeros((17, 23), dtype=np.uint8))
+    script = tmp_path / "train.py"
+    script.write_text(
+        "import sys, cv2\n"
+        "depth = cv2.imread(sys.argv[1], cv2.IMREAD_UNCHANGED)\n"
+        "print(__name__, int(depth.sum()))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-m", "common.depth_pack", str(script), str(tmp_path / "b.png")],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    assert output == ["__main__", str(int(maps["b"].sum()))]
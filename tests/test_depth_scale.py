@@ -0,0 +1,152 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from common.colmap_model import (
+    Camera, ImageArrays, PointArrays, qvec2rotmat, read_model, rotmat2qvec, write_cameras_binary,
+    write_images_arrays, write_points3D_arrays,
+)
+from common.depth_scale import DepthScaleFitter, SparseDepths, depth_params_path, fit_scale, update_depth_params
+
+CAMERA = Camera(1, "PINHOLE", 160, 120, np.array([100.0, 100.0, 80.0, 60.0]))
+
+
+def reference_scales(base_dir, depths_dir):
+    """make_depth_scale.py of the training repositories (get_scales + main), one image at a time."""
+    cameras, images, points3d = read_model(os.path.join(base_dir, "sparse", "0"))
+    pts_indices = np.array([points3d[key].id for key in points3d])
+    pts_xyzs = np.array([points3d[key].xyz for key in points3d])
+    points3d_ordered = np.zeros([pts_indices.max() + 1, 3])
+    points3d_ordered[pts_indices] = pts_xyzs
+    depth_params = {}
+    for image_meta in images.values():
+        cam_intrinsic = cameras[image_meta.camera_id]
+        pts_idx = image_meta.point3D_ids
+        mask = (pts_idx >= 0) * (pts_idx < len(points3d_ordered))
+        pts_idx = pts_idx[mask]
+        valid_xys = image_meta.xys[mask]
+        pts = points3d_ordered[pts_idx] if len(pts_idx) > 0 else np.array([0, 0, 0])
+        R = qvec2rotmat(image_meta.qvec)
+        pts = np.dot(pts, R.T) + image_meta.tvec
+        invcolmapdepth = 1. / pts[..., 2]
+        n_remove = len(image_meta.name.split('.')[-1]) + 1
+        depth_path = f"{depths_dir}/{image_meta.name[:-n_remove]}.png"
+        if not os.path.exists(depth_path):
+            continue
+        invmonodepthmap = cv2.imread(depth_path, cv2.IMREAD_UNCHANGED)
+        if invmonodepthmap.ndim != 2:
+            invmonodepthmap = invmonodepthmap[..., 0]
+        invmonodepthmap = invmonodepthmap.astype(np.float32) / (2**16)
+        s = invmonodepthmap.shape[0] / cam_intrinsic.height
+        maps = (valid_xys * s).astype(np.float32)
+        valid = (
+            (maps[..., 0] >= 0) * (maps[..., 1] >= 0) * (maps[..., 0] < cam_intrinsic.width * s)
+            * (maps[..., 1] < cam_intrinsic.height * s) * (invcolmapdepth > 0))
+        if valid.sum() > 10 and (invcolmapdepth.max() - invcolmapdepth.min()) > 1e-3:
+            maps = maps[valid, :]
+            invcolmapdepth = invcolmapdepth[valid]
+            invmonodepth = cv2.remap(invmonodepthmap, maps[..., 0], maps[..., 1],
+                                     interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            # [..., 0] nell'originale: con l'OpenCV per cui è stato scritto il risultato è (N, 1)
+            invmonodepth = invmonodepth.reshape(-1)
+            t_colmap = np.median(invcolmapdepth)
+            s_colmap = np.mean(np.abs(invcolmapdepth - t_colmap))
+            t_mono = np.median(invmonodepth)
+            s_mono = np.mean(np.abs(invmonodepth - t_mono))
+            scale = s_colmap / s_mono
+            offset = t_colmap - t_mono * scale
+        else:
+            scale = 0
+            offset = 0
+        depth_params[image_meta.name[:-n_remove]] = {"scale": scale, "offset": offset}
+    return depth_params
+
+
+def _scene(tmp_path, count=4, missing=("frame_3",)):
+    rng = np.random.default_rng(0)
+    sparse = tmp_path / "sparse" / "0"
+    depths = tmp_path / "depths"
+    sparse.mkdir(parents=True)
+    depths.mkdir()
+    xyz = rng.uniform([-2, -2, 4], [2, 2, 8], size=(300, 3))
+    ids = np.arange(1, 301) * 3
+    qvecs, tvecs, xys, point_ids, offsets = [], [], [], [], [0]
+    for i in range(count):
+        R = cv2.Rodrigues(rng.normal(scale=0.05, size=3))[0]
+        t = rng.normal(scale=0.2, size=3)
+        camera_xyz = xyz @ R.T + t
+        projected = camera_xyz[:, :2] / camera_xyz[:, 2:] * 100 + [80, 60]
+        qvecs.append(rotmat2qvec(R))
+        tvecs.append(t)
+        xys.append(projected)
+        # Punti 2D senza punto 3D (-1) come nei modelli reali
+        point_ids.append(np.where(rng.random(300) < 0.1, -1, ids))
+        offsets.append(offsets[-1] + 300)
+        stem = f"frame_{i}"
+        if stem not in missing:
+            # Profondità inversa a metà risoluzione, con un'affinità diversa per immagine
+            grid = np.linspace(0, 1, 80)[None, :] + np.linspace(0, 1, 60)[:, None]
+            inverse = (1000 + 20000 * (i + 1) * grid + rng.normal(scale=50, size=(60, 80))).astype(np.uint16)
+            cv2.imwrite(str(depths / f"{stem}.png"), inverse)
+    names = [f"frame_{i}.jpg" for i in range(count)]
+    write_cameras_binary({1: CAMERA}, str(sparse / "cameras.bin"))
+    write_images_arrays(ImageArrays(
+        np.arange(1, count + 1), np.array(qvecs), np.array(tvecs), np.ones(count, dtype=np.int32), names,
+        np.array(offsets), np.concatenate(xys), np.concatenate(point_ids),
+    ), str(sparse / "images.bin"))
+    write_points3D_arrays(PointArrays(
+        ids, xyz, np.zeros((300, 3), dtype=np.uint8), np.zeros(300),
+        np.zeros(301, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+    ), str(sparse / "points3D.bin"))
+    return str(tmp_path), str(depths)
+
+
+def _assert_params_equal(actual, expected):
+    assert sorted(actual) == sorted(expected)
+    for stem, values in expected.items():
+        assert np.isclose(actual[stem]["scale"], values["scale"], rtol=1e-6)
+        assert np.isclose(actual[stem]["offset"], values["offset"], rtol=1e-6, atol=1e-9)
+
+
+def test_batched_fit_matches_make_depth_scale(tmp_path):
+    base_dir, depths_dir = _scene(tmp_path)
+    model = SparseDepths(os.path.join(base_dir, "sparse", "0"))
+    expected = reference_scales(base_dir, depths_dir)
+    assert len(expected) == 3
+    for stem, values in expected.items():
+        depth = cv2.imread(os.path.join(depths_dir, f"{stem}.png"), cv2.IMREAD_UNCHANGED)
+        scale, offset = fit_scale(depth, *model.observations(stem))
+        assert scale > 0
+        assert np.isclose(scale, values["scale"], rtol=1e-6) and np.isclose(offset, values["offset"], rtol=1e-6)
+
+
+def test_fitter_writes_the_same_depth_params(tmp_path):
+    base_dir, depths_dir = _scene(tmp_path)
+    stats = DepthScaleFitter(base_dir, depths_dir, workers=2).start().finish()
+    assert stats["fitted"] == 3
+    with open(depth_params_path(base_dir)) as f:
+        _assert_params_equal(json.load(f), reference_scales(base_dir, depths_dir))
+
+
+def test_update_refits_only_changed_images_and_drops_removed(tmp_path):
+    base_dir, depths_dir = _scene(tmp_path)
+    DepthScaleFitter(base_dir, depths_dir).start().finish()
+    path = depth_params_path(base_dir)
+    with open(path) as f:
+        before = json.load(f)
+    depth = cv2.imread(os.path.join(depths_dir, "frame_1.png"), cv2.IMREAD_UNCHANGED)
+    cv2.imwrite(os.path.join(depths_dir, "frame_1.png"), depth // 2)
+    stats = update_depth_params(base_dir, depths_dir, ["frame_1"], removed=["frame_2"])
+    assert stats["fitted"] == 1 and stats["removed"] == 1
+    with open(path) as f:
+        after = json.load(f)
+    assert sorted(after) == ["frame_0", "frame_1"]
+    assert after["frame_0"] == before["frame_0"]
+    assert np.isclose(after["frame_1"]["scale"], 2 * before["frame_1"]["scale"], rtol=0.01)
+
+
+def test_too_few_points_gives_zero_scale():
+    xys = np.array([[10.0, 10.0]] * 5)
+    assert fit_scale(np.ones((120, 160), dtype=np.uint16), xys, np.ones(5), CAMERA) == (0.0, 0.0)
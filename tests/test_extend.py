@@ -0,0 +1,41 @@
+import os
+import sqlite3
+
+from extend import database_images, merge_undistorted, write_pairs
+
+
+def test_database_images(tmp_path):
+    path = str(tmp_path / "database.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE images (image_id INTEGER, name TEXT, camera_id INTEGER)")
+        connection.execute("INSERT INTO images VALUES (4, 'a.jpg', 1)")
+    connection.close()
+    assert database_images(path) == {"a.jpg": (4, 1)}
+
+
+def test_pairs_cover_new_against_all_without_repeats(tmp_path):
+    path = tmp_path / "pairs.txt"
+    assert write_pairs(str(path), ["n1.jpg", "n2.jpg"], ["a.jpg", "b.jpg"]) == 5
+    pairs = [tuple(line.split()) for line in path.read_text().splitlines()]
+    assert len({frozenset(pair) for pair in pairs}) == 5
+    assert ("n1.jpg", "n2.jpg") in pairs and not any(set(pair) == {"a.jpg", "b.jpg"} for pair in pairs)
+
+
+def test_merge_replaces_entries_without_touching_cached_files(tmp_path):
+    scene = tmp_path / "scene"
+    (scene / "images").mkdir(parents=True)
+    (scene / "sparse" / "0").mkdir(parents=True)
+    cached = tmp_path / "cache_images.bin"
+    cached.write_bytes(b"cached")
+    # images.bin della scena è un hardlink dell'entry in cache
+    os.link(cached, scene / "sparse" / "0" / "images.bin")
+    undistorted = tmp_path / "undistorted"
+    (undistorted / "images").mkdir(parents=True)
+    (undistorted / "sparse").mkdir()
+    (undistorted / "images" / "new.jpg").write_bytes(b"new")
+    (undistorted / "sparse" / "images.bin").write_bytes(b"extended")
+
+    assert merge_undistorted(str(undistorted), str(scene), ["new.jpg", "gone.jpg"]) == 1
+    assert (scene / "images" / "new.jpg").read_bytes() == b"new"
+    assert (scene / "sparse" / "0" / "images.bin").read_bytes() == b"extended"
+    assert cached.read_bytes() == b"cached" and not undistorted.exists()
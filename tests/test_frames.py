@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+
+from frames import blurry_mask, filter_frames, select_frames
+
+
+def test_blur_is_relative_to_the_neighbourhood():
+    sharpness = np.full(30, 100.0)
+    sharpness[10] = 20.0
+    assert np.flatnonzero(blurry_mask(sharpness)).tolist() == [10]
+    # Una cattura uniformemente morbida non si svuota
+    assert not blurry_mask(np.full(30, 5.0)).any()
+    assert len(blurry_mask(np.empty(0))) == 0
+
+
+def test_duplicates_are_compared_with_the_last_kept_frame():
+    names = [f"f{i}.jpg" for i in range(6)]
+    # Ogni frame differisce di 2 bit dal precedente: deriva lenta
+    hashes = np.array([(1 << (2 * i)) - 1 for i in range(6)], dtype=np.uint64)
+    kept, counts = select_frames(names, np.full(6, 100.0), hashes, duplicate_distance=4)
+    assert kept == ["f0.jpg", "f3.jpg"]
+    assert counts["duplicates"] == 4
+
+
+def test_thinning_keeps_the_sharpest_of_each_bin():
+    names = [f"f{i}.jpg" for i in range(8)]
+    sharpness = np.array([10, 12, 11, 10, 13, 10, 10, 11], dtype=np.float64)
+    hashes = np.array([0xFF << (8 * i) for i in range(8)], dtype=np.uint64)
+    kept, counts = select_frames(names, sharpness, hashes, max_frames=2)
+    assert kept == ["f1.jpg", "f4.jpg"]
+    assert counts == {"input": 8, "kept": 2, "blurry": 0, "duplicates": 0, "thinned": 6}
+
+
+def test_filter_frames_drops_a_blurred_frame(tmp_path):
+    rng = np.random.default_rng(0)
+    names = []
+    for i in range(12):
+        image = rng.integers(0, 256, (64, 64), dtype=np.uint8)
+        if i == 5:
+            image = cv2.GaussianBlur(image, (15, 15), 5)
+        names.append(f"frame_{i:03d}.png")
+        cv2.imwrite(str(tmp_path / names[-1]), image)
+    kept, report = filter_frames(str(tmp_path), names, workers=2)
+    assert "frame_005.png" not in kept
+    assert report["blurry"] == 1 and report["kept"] == len(kept)
@@ -0,0 +1,26 @@
+import sys
+
+import pytest
+
+from common.jobs import Job, JobFailed
+
+
+def _job():
+    return Job("render", None, (), priority=0)
+
+
+def test_run_step_reports_exit_code_and_output():
+    command = [sys.executable, "-c", "import sys; print('out'); print('err', file=sys.stderr); sys.exit(3)"]
+    with pytest.raises(JobFailed) as failure:
+        _job().run_step(command, "Render")
+    assert failure.value.message == "Render failed with return code: 3"
+    assert failure.value.detail == {"return_code": 3, "stderr": "err", "stdout": "out"}
+
+
+def test_run_step_timeout_is_a_job_failure():
+    with pytest.raises(JobFailed, match="Metrics generation process timed out"):
+        _job().run_step([sys.executable, "-c", "import time; time.sleep(30)"], "Metrics generation", timeout=0.5)
+
+
+def test_run_step_returns_the_process_on_success():
+    assert _job().run_step([sys.executable, "-c", "pass"], "Render").returncode == 0
@@ -0,0 +1,76 @@
+import json
+import sqlite3
+
+import numpy as np
+
+from common.colmap_model import CAMERA_MODEL_IDS, qvec2rotmat, read_cameras_binary, read_images_arrays
+from known_poses import apply_intrinsics, load_poses, shared_intrinsics, write_prior_model
+
+
+def _transforms(tmp_path, c2w):
+    path = tmp_path / "transforms.json"
+    path.write_text(json.dumps({
+        "fl_x": 500.0, "fl_y": 510.0, "cx": 320.0, "cy": 240.0, "w": 640, "h": 480,
+        "frames": [
+            {"file_path": "./images/frame_0001", "transform_matrix": c2w.tolist()},
+            {"file_path": "images/frame_0002.png", "transform_matrix": c2w.tolist(), "k1": 0.1},
+            {"file_path": "images/unknown.png", "transform_matrix": c2w.tolist()},
+        ],
+    }))
+    return str(path)
+
+
+def test_transforms_json_becomes_world_to_camera(tmp_path):
+    c2w = np.eye(4)
+    c2w[:3, 3] = [1.0, 2.0, 3.0]
+    poses = load_poses(_transforms(tmp_path, c2w), str(tmp_path), ["frame_0001.jpg", "frame_0002.png"])
+    assert sorted(poses) == ["frame_0001.jpg", "frame_0002.png"]
+    camera, qvec, tvec = poses["frame_0001.jpg"]
+    assert camera.model == "PINHOLE" and np.allclose(camera.params, [500, 510, 320, 240])
+    assert poses["frame_0002.png"][0].model == "OPENCV"
+    R = qvec2rotmat(qvec)
+    assert np.allclose(-R.T @ tvec, [1, 2, 3])
+    # OpenGL guarda lungo -z: un punto davanti alla camera ha z > 0 per COLMAP
+    assert (R @ np.array([1.0, 2.0, 2.0]) + tvec)[2] > 0
+    assert not shared_intrinsics(poses)
+
+
+def test_colmap_style_json_and_field_of_view(tmp_path):
+    path = tmp_path / "poses.json"
+    path.write_text(json.dumps({
+        "camera": {"model": "SIMPLE_PINHOLE", "width": 100, "height": 50, "params": [80, 50, 25]},
+        "images": [{"name": "a.jpg", "qvec": [1, 0, 0, 0], "tvec": [0, 0, 1]}],
+    }))
+    poses = load_poses(str(path), str(tmp_path), ["a.jpg"])
+    assert poses["a.jpg"][0].model == "SIMPLE_PINHOLE" and shared_intrinsics(poses)
+    path.write_text(json.dumps({"camera_angle_x": np.pi / 2, "w": 200, "h": 100,
+                                "frames": [{"file_path": "a", "transform_matrix": np.eye(4).tolist()}]}))
+    assert np.allclose(load_poses(str(path), str(tmp_path), ["a.jpg"])["a.jpg"][0].params[:2], [100, 100])
+
+
+def _database(tmp_path, width, height):
+    path = str(tmp_path / "database.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE cameras (camera_id INTEGER, model INTEGER, width INTEGER, "
+                           "height INTEGER, params BLOB, prior_focal_length INTEGER)")
+        connection.execute("CREATE TABLE images (image_id INTEGER, name TEXT, camera_id INTEGER)")
+        connection.execute("INSERT INTO cameras VALUES (1, ?, ?, ?, ?, 0)",
+                           (CAMERA_MODEL_IDS["SIMPLE_RADIAL"], width, height, np.zeros(4).tobytes()))
+        for image_id, name in ((2, "frame_0002.png"), (1, "frame_0001.jpg"), (3, "extra.jpg")):
+            connection.execute("INSERT INTO images VALUES (?, ?, 1)", (image_id, name))
+    connection.close()
+    return path
+
+
+def test_prior_model_uses_database_ids_and_rescaled_intrinsics(tmp_path):
+    c2w = np.eye(4)
+    poses = load_poses(_transforms(tmp_path, c2w), str(tmp_path), ["frame_0001.jpg"])
+    # Copia coarse-to-fine a metà risoluzione
+    database = _database(tmp_path, 320, 240)
+    assert apply_intrinsics(database, poses) == 1
+    assert write_prior_model(database, poses, str(tmp_path / "prior")) == 1
+    camera = read_cameras_binary(str(tmp_path / "prior" / "cameras.bin"))[1]
+    assert camera.model == "PINHOLE" and np.allclose(camera.params, [250, 255, 160, 120])
+    images = read_images_arrays(str(tmp_path / "prior" / "images.bin"))
+    assert images.ids.tolist() == [1] and images.names == ["frame_0001.jpg"] and len(images.xys) == 0
+    assert (tmp_path / "prior" / "points3D.bin").read_bytes() == bytes(8)
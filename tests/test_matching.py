@@ -0,0 +1,65 @@
+import sqlite3
+
+from matching import (
+    EXHAUSTIVE_MAX_IMAGES, SEQUENTIAL_OVERLAP, choose_strategy, clear_matches, looks_sequential, match_pairs,
+    matcher_command,
+)
+
+
+def _frames(count, step=1, prefix="frame_"):
+    return [f"{prefix}{i * step:05d}.jpg" for i in range(count)]
+
+
+def test_sequential_names():
+    assert looks_sequential(_frames(50))
+    assert looks_sequential(_frames(50, step=5))
+    assert not looks_sequential(["IMG_1.jpg", "DSC_2.jpg", "IMG_3.jpg"])
+    assert not looks_sequential(["a.jpg", "b.jpg", "c.jpg"])
+    assert not looks_sequential([f"img_{i}.jpg" for i in (1, 7, 8, 30, 31, 90)])
+
+
+def test_auto_strategy(tmp_path):
+    small = _frames(EXHAUSTIVE_MAX_IMAGES)
+    assert choose_strategy(str(tmp_path), small)[0] == "exhaustive"
+    assert choose_strategy(str(tmp_path), _frames(EXHAUSTIVE_MAX_IMAGES + 1))[0] == "sequential"
+    unordered = [f"photo_{i}_{i * 7 % 13}.jpg" for i in range(EXHAUSTIVE_MAX_IMAGES + 1)]
+    assert choose_strategy(str(tmp_path), unordered, vocab_tree="tree.bin")[0] == "vocab_tree"
+    assert choose_strategy(str(tmp_path), unordered)[0] == "exhaustive"
+
+
+def test_requested_strategy_and_missing_vocab_tree(tmp_path):
+    assert choose_strategy(str(tmp_path), _frames(5), "spatial") == ("spatial", "requested")
+    assert choose_strategy(str(tmp_path), _frames(5), "vocab_tree")[0] == "exhaustive"
+
+
+def test_matcher_commands():
+    command = matcher_command("colmap", "sequential", "db.db", 1, vocab_tree="tree.bin")
+    assert command.startswith("colmap sequential_matcher --database_path db.db")
+    assert f"--SequentialMatching.overlap {SEQUENTIAL_OVERLAP}" in command and "loop_detection 1" in command
+    assert "loop_detection" not in matcher_command("colmap", "sequential", "db.db", 1)
+    assert "--SpatialMatching.is_gps 1" in matcher_command("colmap", "spatial", "db.db", 0)
+
+
+def test_pairs_follow_capture_order():
+    names = [f"f{i}.jpg" for i in range(12)]
+    assert len(match_pairs("exhaustive", names)) == 12 * 11 // 2
+    pairs = match_pairs("sequential", list(reversed(names)))
+    assert pairs[0] == ("f0.jpg", "f1.jpg")
+    # f9 è vicino a f10, non a f1 come nell'ordine lessicografico
+    assert ("f9.jpg", "f10.jpg") in pairs and ("f1.jpg", "f10.jpg") in pairs and ("f0.jpg", "f11.jpg") not in pairs
+    assert match_pairs("vocab_tree", names) is None
+
+
+def test_clear_matches_keeps_features(tmp_path):
+    database = str(tmp_path / "database.db")
+    with sqlite3.connect(database) as connection:
+        for table in ("keypoints", "matches", "two_view_geometries"):
+            connection.execute(f"CREATE TABLE {table} (id INTEGER)")
+            connection.execute(f"INSERT INTO {table} VALUES (1)")
+    connection.close()
+    clear_matches(database)
+    with sqlite3.connect(database) as connection:
+        counts = {t: connection.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                  for t in ("keypoints", "matches", "two_view_geometries")}
+    connection.close()
+    assert counts == {"keypoints": 1, "matches": 0, "two_view_geometries": 0}
@@ -0,0 +1,21 @@
+import numpy as np
+
+from point_filter import density_inliers, voxel_downsample
+
+
+def test_first_voxel_layer_is_not_merged_with_the_second():
+    # Due punti per strato lungo x, strati 0..3 da voxel 1.0
+    xyz = np.array([[x + 0.5, 0.5, 0.5] for x in range(4) for _ in range(2)], dtype=np.float64)
+    kept, size = voxel_downsample(xyz, np.arange(len(xyz), dtype=np.float64), max_points=4)
+    assert len(kept) == 4
+    assert sorted(np.floor(xyz[kept, 0] / size).astype(int).tolist()) == [0, 1, 2, 3]
+
+
+def test_isolated_point_is_an_outlier():
+    rng = np.random.default_rng(0)
+    cloud = rng.normal(size=(5000, 3))
+    xyz = np.vstack([cloud, [[40.0, 40.0, 40.0]]])
+    inliers, _ = density_inliers(xyz)
+    assert not inliers[-1]
+    # Solo le code più rade della gaussiana cadono con il punto isolato
+    assert inliers[:-1].mean() > 0.9
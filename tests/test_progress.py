@@ -0,0 +1,60 @@
+import asyncio
+
+from common.progress import ProgressChannel, parse_training_line, sse_stream
+
+
+def test_tqdm_line_with_loss_and_gaussians():
+    line = ("Training progress:  23%|██▎       | 7000/30000 [05:12<17:05, 22.43it/s, "
+            "Loss=0.0452311, Depth Loss=0.0012, Gaussians=1234567]")
+    (event,) = parse_training_line(line)
+    assert event == {
+        "type": "progress", "iteration": 7000, "total": 30000, "percent": 23, "it_s": 22.43,
+        "elapsed_s": 312, "eta_s": 1025, "loss": 0.0452311, "depth_loss": 0.0012, "gaussians": 1234567,
+    }
+
+
+def test_slow_bar_rate_and_unknown_eta():
+    (event,) = parse_training_line("Training progress:   0%|          | 10/30000 [01:00:05<?, 2.00s/it]")
+    assert event["it_s"] == 0.5
+    assert event["elapsed_s"] == 3605 and event["eta_s"] is None
+
+
+def test_eval_and_gaussian_count_lines():
+    assert parse_training_line("[ITER 7000] Evaluating test: L1 0.0312 PSNR 27.41") == [
+        {"type": "eval", "iteration": 7000, "split": "test", "l1": 0.0312, "psnr": 27.41}]
+    assert parse_training_line("Number of points at initialisation :  182686") == [
+        {"type": "gaussians", "count": 182686}]
+    assert parse_training_line("Reading camera 12/200") == []
+
+
+def test_channel_coalesces_progress_and_keeps_discrete_events():
+    channel = ProgressChannel()
+    for line in ("[ITER 1000] Evaluating train: L1 0.1 PSNR 20.0",
+                 " 1%|| 100/10000 [00:10<16:30, 10.00it/s]",
+                 " 2%|| 200/10000 [00:20<16:20, 10.00it/s]"):
+        channel.feed("stdout", line)
+    channel.close()
+    entries, _, closed = channel._since(0)
+    assert closed
+    assert [event["type"] for _, event in entries] == ["eval", "progress"]
+    assert channel.latest["iteration"] == 200
+
+
+def test_sse_stream_formats_events():
+    channel = ProgressChannel()
+    channel.publish({"type": "state", "state": "running"})
+    channel.close()
+
+    async def collect():
+        return [chunk async for chunk in sse_stream(channel, min_interval=0)]
+
+    assert asyncio.run(collect()) == ['id: 1\nevent: state\ndata: {"type": "state", "state": "running"}\n\n']
+
+
+def test_failing_listener_does_not_stop_publishing():
+    channel = ProgressChannel()
+    seen = []
+    channel.add_listener(lambda event: 1 / 0)
+    channel.add_listener(seen.append)
+    channel.publish({"type": "gaussians", "count": 3})
+    assert seen == [{"type": "gaussians", "count": 3}]
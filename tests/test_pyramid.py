@@ -0,0 +1,47 @@
+import os
+
+import cv2
+import numpy as np
+
+from pyramid import build_pyramid, fit_size
+
+
+def _scene(tmp_path, names=("a.png", "b.png")):
+    images = tmp_path / "images"
+    images.mkdir()
+    rng = np.random.default_rng(0)
+    for name in names:
+        cv2.imwrite(str(images / name), rng.integers(0, 256, (100, 161, 3), dtype=np.uint8))
+    return tmp_path
+
+
+def test_fit_size_keeps_aspect_and_never_upscales():
+    assert fit_size(4000, 3000, 1600, 1600) == (1600, 1200)
+    assert fit_size(800, 600, 1600, 1600) == (800, 600)
+    assert fit_size(1000, 10, 10, 10) == (10, 1)
+
+
+def test_levels_match_a_direct_area_resize(tmp_path):
+    scene = _scene(tmp_path)
+    result = build_pyramid(str(scene), target=(80, 80), workers=2)
+    assert result["images"] == 2
+    assert sorted(result["outputs"]) == ["images_2", "images_4", "images_8", "images_80x80"]
+    source = cv2.imread(str(scene / "images" / "a.png"))
+    for factor, size in ((2, (80, 50)), (4, (40, 25)), (8, (20, 12))):
+        level = cv2.imread(str(scene / f"images_{factor}" / "a.png"))
+        assert level.shape[1::-1] == size
+        # Dimezzamenti successivi ≈ un unico resize INTER_AREA (stesso filtro a scatola)
+        direct = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+        assert np.abs(level.astype(int) - direct).mean() < 4
+    assert cv2.imread(str(scene / "images_80x80" / "b.png")).shape[:2] == (50, 80)
+
+
+def test_rebuild_starts_from_empty_levels_and_names_only_adds(tmp_path):
+    scene = _scene(tmp_path)
+    build_pyramid(str(scene), factors=(2,), workers=1)
+    os.remove(scene / "images" / "b.png")
+    build_pyramid(str(scene), factors=(2,), workers=1)
+    assert os.listdir(scene / "images_2") == ["a.png"]
+    cv2.imwrite(str(scene / "images" / "c.png"), np.zeros((10, 10, 3), dtype=np.uint8))
+    build_pyramid(str(scene), factors=(2,), workers=1, names=["c.png"])
+    assert sorted(os.listdir(scene / "images_2")) == ["a.png", "c.png"]
@@ -0,0 +1,140 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from common.colmap_model import write_points3D_ply
+from common.jobs import JobManager
+from common.rendering import RenderService
+from common.worker import ModelCache, ResidentWorker
+
+BACKEND = "common.rendering:PointSplatBackend"
+
+
+def trained_model(model_dir, iteration=7000, cameras=3):
+    rng = np.random.default_rng(0)
+    ply_dir = os.path.join(model_dir, "point_cloud", f"iteration_{iteration}")
+    os.makedirs(ply_dir)
+    xyz = rng.normal(size=(500, 3)) + [0, 0, 5]
+    write_points3D_ply(xyz, rng.integers(0, 255, (500, 3)), os.path.join(ply_dir, "point_cloud.ply"))
+    with open(os.path.join(model_dir, "cameras.json"), "w") as f:
+        json.dump([
+            {"id": i, "img_name": f"frame_{i:05d}", "width": 160, "height": 120,
+             "position": [0.1 * i, 0, 0], "rotation": np.eye(3).tolist(), "fx": 100.0, "fy": 100.0}
+            for i in range(cameras)
+        ], f)
+    return str(model_dir)
+
+
+def test_render_service_writes_views_and_reuses_the_model(tmp_path):
+    model_dir = trained_model(tmp_path / "model")
+    service = RenderService(BACKEND, cache_mb=1)
+
+    first = service.render(model_dir, skip_test=True)
+    assert first["iteration"] == 7000 and not first["cache_hit"]
+    assert sorted(os.listdir(os.path.join(model_dir, "train", "ours_7000", "renders"))) == [
+        "00000.png", "00001.png", "00002.png"]
+
+    # Solo una vista, ma con l'indice della lista completa (come render.py)
+    second = service.render(model_dir, skip_test=True, views=["frame_00002"])
+    assert second["cache_hit"] and second["views"] == {"train": 1}
+
+
+def test_model_cache_evicts_least_recently_used():
+    released = []
+    cache = ModelCache(100, lambda key: (key, 30), released.append)
+    for key in ("a", "b", "c"):
+        cache.get(key)
+    assert cache.get("a") == ("a", True)
+    cache.get("d")
+    # b è il meno usato: esce per primo, a è stato appena riletto
+    assert released == ["b"]
+    assert [entry["key"] for entry in cache.stats()["models"]] == ["c", "a", "d"]
+
+
+def test_model_cache_keeps_an_oversized_model():
+    cache = ModelCache(10, lambda key: (key, 50))
+    cache.get("a")
+    cache.get("b")
+    assert [entry["key"] for entry in cache.stats()["models"]] == ["b"]
+
+
+def test_model_cache_clears_and_retries_on_out_of_memory():
+    released = []
+    failures = iter([RuntimeError("CUDA out of memory")])
+
+    def load(key):
+        if key == "big":
+            error = next(failures, None)
+            if error is not None:
+                raise error
+        return key, 1
+
+    cache = ModelCache(100, load, released.append)
+    cache.get("a")
+    cache.get("b")
+    assert cache.get("big") == ("big", False)
+    assert released == ["a", "b"]
+    assert cache.stats()["used_mb"] * 2**20 == 1
+
+
+def test_model_cache_does_not_hide_other_errors():
+    def load(key):
+        if key == "bad":
+            raise RuntimeError("corrupt ply")
+        return key, 1
+
+    cache = ModelCache(100, load)
+    cache.get("a")
+    with pytest.raises(RuntimeError, match="corrupt"):
+        cache.get("bad")
+    assert len(cache.stats()["models"]) == 1
+
+
+def test_resident_worker_rpc_events_and_release(tmp_path):
+    model_dir = trained_model(tmp_path / "model", cameras=2)
+    worker = ResidentWorker("common.rendering:RenderService", {"backend": BACKEND, "cache_mb": 16},
+                            name="render", release_op="clear")
+    try:
+        events = []
+        result = worker.call("render", {"model_dir": model_dir, "skip_test": True}, on_event=events.append)
+        assert result["views"] == {"train": 2}
+        assert [event["iteration"] for event in events] == [1, 2]
+        assert len(worker.call("stats")["models"]) == 1
+
+        # release svuota la cache ma lascia il processo caldo
+        pid = worker.pid
+        worker.release()
+        assert worker.alive and worker.pid == pid
+        assert worker.call("stats")["models"] == []
+    finally:
+        worker.close()
+    assert not worker.alive
+
+
+class FakeResident:
+    def __init__(self):
+        self.alive = True
+        self.releases = 0
+
+    def release(self):
+        self.releases += 1
+        self.alive = False
+
+
+def test_job_manager_releases_other_kinds_before_a_job_starts():
+    jobs = JobManager(slots=1, max_queue=4)
+    render, depth = FakeResident(), FakeResident()
+    jobs.add_resident(render, "render")
+    jobs.add_resident(depth, "depth_regularization")
+    jobs.add_resident(None, "render")
+    seen = []
+
+    def target(job):
+        seen.append((job.kind, render.releases, depth.releases))
+
+    for kind in ("render", "render", "train"):
+        jobs.submit(kind, target).done.wait(5)
+    # Render dopo render: la cache resta; il training parte solo dopo il rilascio di entrambi
+    assert seen == [("render", 0, 1), ("render", 0, 1), ("train", 1, 1)]
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from common.jobs import JobManager
+from common.scheduler import QueueFull, SlotScheduler
+
+
+class FakeJob:
+    def __init__(self, name, priority, kind="train"):
+        self.id = self.name = name
+        self.kind = kind
+        self.priority = priority
+        self.state = "queued"
+        self.started_at = None
+        self.expected_wait_s = None
+
+
+class Recorder:
+    """``run`` of the scheduler: records the start order, each job waits for its release."""
+
+    def __init__(self):
+        self.started = []
+        self.release = {}
+        self.changed = threading.Condition()
+
+    def __call__(self, job):
+        job.started_at = time.time()
+        with self.changed:
+            self.started.append(job.name)
+            self.changed.notify_all()
+        self.release.setdefault(job.name, threading.Event()).wait(5)
+        job.state = "succeeded"
+
+    def finish(self, name):
+        self.release.setdefault(name, threading.Event()).set()
+
+    def wait_started(self, count):
+        with self.changed:
+            assert self.changed.wait_for(lambda: len(self.started) >= count, timeout=5)
+
+
+def test_lower_priority_value_runs_first_in_submission_order():
+    run = Recorder()
+    scheduler = SlotScheduler(run, slots=1, max_queue=8)
+    scheduler.submit(FakeJob("blocker", 2))
+    run.wait_started(1)
+    for name, priority in (("train", 2), ("render-1", 0), ("depth", 1), ("render-2", 0)):
+        scheduler.submit(FakeJob(name, priority))
+    for name in ("blocker", "render-1", "render-2", "depth", "train"):
+        run.finish(name)
+    run.wait_started(5)
+    assert run.started == ["blocker", "render-1", "render-2", "depth", "train"]
+
+
+def test_full_queue_raises_with_the_time_until_a_slot_frees():
+    run = Recorder()
+    scheduler = SlotScheduler(run, slots=1, max_queue=1, durations={"train": 100.0})
+    scheduler.submit(FakeJob("running", 2))
+    run.wait_started(1)
+    scheduler.submit(FakeJob("queued", 2))
+    with pytest.raises(QueueFull) as full:
+        scheduler.submit(FakeJob("rejected", 0))
+    assert full.value.queued == 1
+    # Il posto in coda si libera quando il job in corso finisce e parte quello in attesa
+    assert 95 < full.value.retry_after <= 100
+    assert scheduler.stats() == {"slots": 1, "running": 1, "queued": 1, "max_queue": 1}
+    run.finish("running")
+    run.finish("queued")
+
+
+def test_expected_wait_counts_only_jobs_ahead():
+    run = Recorder()
+    scheduler = SlotScheduler(run, slots=1, max_queue=8, durations={"train": 100.0, "render": 10.0})
+    scheduler.submit(FakeJob("running", 2))
+    run.wait_started(1)
+    scheduler.submit(FakeJob("train", 2))
+    scheduler.submit(FakeJob("render", 0, kind="render"))
+    assert scheduler.expected_wait(0) == pytest.approx(110.0, abs=1)
+    assert scheduler.expected_wait(2) == pytest.approx(210.0, abs=1)
+    for name in ("running", "render", "train"):
+        run.finish(name)
+
+
+def test_removed_job_never_starts():
+    run = Recorder()
+    scheduler = SlotScheduler(run, slots=1, max_queue=8)
+    scheduler.submit(FakeJob("running", 2))
+    run.wait_started(1)
+    queued = FakeJob("queued", 2)
+    scheduler.submit(queued)
+    assert scheduler.remove(queued)
+    run.finish("running")
+    time.sleep(0.1)
+    assert run.started == ["running"]
+
+
+def test_manager_answers_429_with_retry_after():
+    started = threading.Event()
+    release = threading.Event()
+
+    def body(job):
+        started.set()
+        release.wait(5)
+
+    manager = JobManager(slots=1, max_queue=1)
+    try:
+        manager.submit("train", body)
+        assert started.wait(5)
+        manager.submit("train", body)
+        with pytest.raises(HTTPException) as rejected:
+            manager.submit("render", body)
+        assert rejected.value.status_code == 429
+        assert int(rejected.value.headers["Retry-After"]) >= 1
+        assert rejected.value.detail["queued"] == 1
+        # Il job rifiutato non resta nel registro
+        assert len(manager.list()) == 2
+    finally:
+        release.set()
@@ -0,0 +1,98 @@
+import sqlite3
+
+import numpy as np
+
+import sharding
+
+# Schema di colmap/scene/database.cc (COLMAP 3.8)
+COLMAP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cameras (
+    camera_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, model INTEGER NOT NULL,
+    width INTEGER NOT NULL, height INTEGER NOT NULL, params BLOB, prior_focal_length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS images (
+    image_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, name TEXT NOT NULL UNIQUE, camera_id INTEGER NOT NULL,
+    prior_qw REAL, prior_qx REAL, prior_qy REAL, prior_qz REAL, prior_tx REAL, prior_ty REAL, prior_tz REAL,
+    CONSTRAINT image_id_check CHECK(image_id >= 0 and image_id < 2147483647),
+    FOREIGN KEY(camera_id) REFERENCES cameras(camera_id));
+CREATE UNIQUE INDEX IF NOT EXISTS index_name ON images(name);
+CREATE TABLE IF NOT EXISTS keypoints (
+    image_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL, data BLOB,
+    FOREIGN KEY(image_id) REFERENCES images(image_id) ON DELETE CASCADE);
+CREATE TABLE IF NOT EXISTS descriptors (
+    image_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL, data BLOB,
+    FOREIGN KEY(image_id) REFERENCES images(image_id) ON DELETE CASCADE);
+CREATE TABLE IF NOT EXISTS matches (
+    pair_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL, data BLOB);
+CREATE TABLE IF NOT EXISTS two_view_geometries (
+    pair_id INTEGER PRIMARY KEY NOT NULL, rows INTEGER NOT NULL, cols INTEGER NOT NULL, data BLOB,
+    config INTEGER NOT NULL, F BLOB, E BLOB, H BLOB, qvec BLOB, tvec BLOB);
+"""
+NAMES = [f"frame_{i:05d}.jpg" for i in range(1, 7)]
+
+
+def pair_id(first, second):
+    first, second = min(first, second), max(first, second)
+    return first * 2147483647 + second
+
+
+def colmap_database(path):
+    with sqlite3.connect(path) as connection:
+        connection.executescript(COLMAP_SCHEMA)
+        connection.execute("INSERT INTO cameras (model, width, height, params, prior_focal_length) "
+                           "VALUES (1, 640, 480, ?, 0)", (np.zeros(4).tobytes(),))
+        for name in NAMES:
+            cursor = connection.execute("INSERT INTO images (name, camera_id) VALUES (?, 1)", (name,))
+            keypoints = np.full((5, 6), cursor.lastrowid, dtype=np.float32)
+            connection.execute("INSERT INTO keypoints VALUES (?, 5, 6, ?)", (cursor.lastrowid, keypoints.tobytes()))
+            connection.execute("INSERT INTO descriptors VALUES (?, 5, 128, ?)",
+                               (cursor.lastrowid, np.zeros((5, 128), np.uint8).tobytes()))
+    connection.close()
+
+
+def add_matches(shard_path, pairs):
+    with sqlite3.connect(shard_path) as connection:
+        ids = dict(connection.execute("SELECT name, image_id FROM images"))
+        for first, second in pairs:
+            match = np.array([[0, 1]], dtype=np.uint32).tobytes()
+            pid = pair_id(ids[first], ids[second])
+            connection.execute("INSERT INTO matches VALUES (?, 1, 2, ?)", (pid, match))
+            connection.execute("INSERT INTO two_view_geometries (pair_id, rows, cols, data, config) "
+                               "VALUES (?, 1, 2, ?, 2)", (pid, match))
+    connection.close()
+
+
+def test_shard_database_and_merge_with_colmap_schema(tmp_path):
+    database_path = str(tmp_path / "database.db")
+    colmap_database(database_path)
+    pairs = [(NAMES[i], NAMES[i + 1]) for i in range(len(NAMES) - 1)]
+
+    shard_paths = []
+    for index, chunk in enumerate(sharding.split(pairs, 2)):
+        shard_path = str(tmp_path / f"match_{index}.db")
+        sharding.shard_database(database_path, shard_path, sharding.pair_images(chunk))
+        with sqlite3.connect(shard_path) as connection:
+            # Tutte le immagini e camere, feature solo per le immagini delle coppie dello shard
+            assert connection.execute("SELECT COUNT(*) FROM images").fetchone()[0] == len(NAMES)
+            assert connection.execute("SELECT COUNT(*) FROM cameras").fetchone()[0] == 1
+            names = {row[0] for row in connection.execute(
+                "SELECT name FROM images JOIN keypoints USING (image_id)")}
+            assert names == set(sharding.pair_images(chunk))
+            # Il contatore AUTOINCREMENT segue gli id copiati: un'immagine nuova non ne riusa uno
+            cursor = connection.execute("INSERT INTO images (name, camera_id) VALUES ('new.jpg', 1)")
+            assert cursor.lastrowid == len(NAMES) + 1
+            connection.execute("DELETE FROM images WHERE name = 'new.jpg'")
+        connection.close()
+        add_matches(shard_path, chunk)
+        shard_paths.append(shard_path)
+
+    sharding.merge_matches(database_path, shard_paths)
+    with sqlite3.connect(database_path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM matches").fetchone()[0] == len(pairs)
+        assert connection.execute("SELECT COUNT(*) FROM two_view_geometries").fetchone()[0] == len(pairs)
+    connection.close()
+
+
+def test_split_keeps_order_and_balance():
+    chunks = sharding.split(list(range(10)), 3)
+    assert chunks == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert sharding.split([1], 4) == [[1]]
@@ -0,0 +1,82 @@
+import pytest
+
+from stages import StageRunner
+
+
+def _pipeline(scene, inputs, calls):
+    report = {}
+    runner = StageRunner(str(scene), report)
+
+    def stage(name, output):
+        def func():
+            calls.append(name)
+            (scene / output).write_text(name)
+            return {f"{name}_done": True}
+        return func
+
+    for name in ("extract", "match", "map"):
+        runner.run(name, inputs[name], stage(name, f"{name}.out"), outputs=[f"{name}.out"])
+    return report
+
+
+def _inputs(**changes):
+    return {"extract": {"camera": "OPENCV"}, "match": {"matcher": "sequential"}, "map": {}, **changes}
+
+
+def test_rerun_reuses_every_stage(tmp_path):
+    calls = []
+    _pipeline(tmp_path, _inputs(), calls)
+    report = _pipeline(tmp_path, _inputs(), calls)
+    assert calls == ["extract", "match", "map"]
+    assert {stage["status"] for stage in report["stages"].values()} == {"reused"}
+    # Le voci del report degli stage ripresi tornano dal marker
+    assert report["match_done"] is True
+
+
+def test_changed_input_invalidates_downstream_only(tmp_path):
+    calls = []
+    _pipeline(tmp_path, _inputs(), calls)
+    calls.clear()
+    report = _pipeline(tmp_path, _inputs(match={"matcher": "exhaustive"}), calls)
+    assert calls == ["match", "map"]
+    assert [report["stages"][name]["status"] for name in ("extract", "match", "map")] == ["reused", "ran", "ran"]
+
+
+def test_missing_output_reruns_from_that_stage(tmp_path):
+    calls = []
+    _pipeline(tmp_path, _inputs(), calls)
+    (tmp_path / "extract.out").unlink()
+    calls.clear()
+    _pipeline(tmp_path, _inputs(), calls)
+    assert calls == ["extract", "match", "map"]
+
+
+def test_failed_stage_resumes_there(tmp_path):
+    calls = []
+    runner = StageRunner(str(tmp_path), {})
+    runner.run("extract", {}, lambda: calls.append("extract"))
+    with pytest.raises(RuntimeError):
+        runner.run("map", {}, lambda: (_ for _ in ()).throw(RuntimeError("mapper crashed")))
+    report = {}
+    runner = StageRunner(str(tmp_path), report)
+    runner.run("extract", {}, lambda: calls.append("extract again"))
+    runner.run("map", {}, lambda: calls.append("map"))
+    assert calls == ["extract", "map"]
+    assert report["stages"]["map"]["status"] == "ran" and report["stages"]["map"]["wall_s"] >= 0
+
+
+def test_reset_forgets_the_markers(tmp_path):
+    calls = []
+    _pipeline(tmp_path, _inputs(), calls)
+    StageRunner(str(tmp_path), {}).reset()
+    calls.clear()
+    _pipeline(tmp_path, _inputs(), calls)
+    assert calls == ["extract", "match", "map"]
+
+
+def test_failing_command_exits_with_its_code(tmp_path):
+    runner = StageRunner(str(tmp_path), {})
+    with pytest.raises(SystemExit) as exit_info:
+        runner.command("exit 3", "mapper")
+    assert exit_info.value.code == 3
+    assert len(runner.commands(["true", "true"], "extract")) == 2
@@ -0,0 +1,66 @@
+import math
+import os
+
+import numpy as np
+
+from common.telemetry import COLUMNS, TELEMETRY_DIR, TelemetryRecorder, downsample, load_series, query_series
+
+
+def _record_run(output_dir, steps=10):
+    recorder = TelemetryRecorder(str(output_dir), min_interval=0.0, flush_rows=4)
+    recorder.record({"type": "gaussians", "count": 1000})
+    for i in range(1, steps + 1):
+        recorder.record({"type": "progress", "iteration": 100 * i, "loss": 1.0 / i})
+    recorder.record({"type": "eval", "split": "test", "iteration": 100 * steps, "psnr": 25.5, "l1": 0.03})
+    recorder.close()
+
+
+def test_columns_round_trip(tmp_path):
+    _record_run(tmp_path)
+    series = load_series(str(tmp_path))
+    assert set(series) == set(COLUMNS)
+    assert series["iteration"].tolist() == [100.0 * i for i in range(1, 11)] + [1000.0]
+    assert np.allclose(series["loss"][:10], [1.0 / i for i in range(1, 11)])
+    # La riga di eval ha solo le metriche di test, la loss resta NaN
+    assert math.isnan(series["loss"][-1]) and series["test_psnr"][-1] == np.float32(25.5)
+    assert (series["gaussians"] == 1000).all()
+    assert series["loss"].dtype == np.float32 and series["wall_time"].dtype == np.float64
+    assert (np.diff(series["wall_time"]) >= 0).all()
+
+
+def test_reopened_run_appends_with_the_same_clock(tmp_path):
+    _record_run(tmp_path, steps=3)
+    _record_run(tmp_path, steps=2)
+    series = load_series(str(tmp_path), columns=["iteration"])
+    assert list(series) == ["wall_time", "iteration"]
+    assert series["iteration"].tolist() == [100, 200, 300, 300, 100, 200, 200]
+    assert (np.diff(series["wall_time"]) >= 0).all()
+
+
+def test_torn_flush_is_truncated_to_the_shortest_column(tmp_path):
+    _record_run(tmp_path, steps=3)
+    with open(os.path.join(tmp_path, TELEMETRY_DIR, "loss.f4"), "ab") as f:
+        np.float32(0.5).tofile(f)
+    assert len(load_series(str(tmp_path))["loss"]) == 4
+
+
+def test_downsample_averages_buckets_and_skips_nan():
+    series = {
+        "wall_time": np.arange(10, dtype=np.float64),
+        "loss": np.array([1, 3, np.nan, np.nan, 5, 7, 2, 2, 4, 4], dtype=np.float32),
+    }
+    reduced = downsample(series, 5)
+    assert reduced["wall_time"].tolist() == [0.5, 2.5, 4.5, 6.5, 8.5]
+    assert reduced["loss"][0] == 2 and math.isnan(reduced["loss"][1]) and reduced["loss"][2] == 6
+    assert downsample(series, 20) is series
+
+
+def test_query_window_and_json_nulls(tmp_path):
+    _record_run(tmp_path)
+    result = query_series(str(tmp_path), max_points=3, columns=["loss"])
+    assert result["rows"] == result["selected"] == 11
+    assert result["returned"] == 3
+    assert all(value is None or isinstance(value, float) for value in result["series"]["loss"])
+    assert query_series(str(tmp_path / "missing")) is None
+    empty = query_series(str(tmp_path), t0=1e9)
+    assert empty["selected"] == 0 and empty["returned"] == 0
@@ -0,0 +1,80 @@
+import os
+
+import cv2
+import numpy as np
+
+from common.colmap_model import (
+    Camera, ImageArrays, PointArrays, read_cameras_binary, read_images_arrays, write_cameras_binary,
+    write_images_arrays, write_points3D_arrays,
+)
+from undistort import output_camera, remap_tables, supported, undistort_model, undistort_points, undistorted_camera
+
+OPENCV = Camera(1, "OPENCV", 400, 300, np.array([300.0, 310.0, 200.0, 150.0, -0.2, 0.05, 0.001, -0.001]))
+
+
+def test_supported_models():
+    assert supported({1: OPENCV})
+    assert not supported({1: OPENCV, 2: Camera(2, "FOV", 10, 10, np.array([1.0, 1, 5, 5, 0.1]))})
+
+
+def test_undistorted_size_follows_the_distortion():
+    pinhole = Camera(1, "PINHOLE", 400, 300, np.array([300.0, 310.0, 200.0, 150.0]))
+    assert undistorted_camera(pinhole).width == 400
+    # Barile: i bordi si allargano; cuscinetto: si restringono (nessun pixel vuoto)
+    barrel = undistorted_camera(OPENCV)
+    assert barrel.model == "PINHOLE" and barrel.width > 400 and barrel.height > 300
+    assert np.allclose(barrel.params[2:], [200.0 * barrel.width / 400, 150.0 * barrel.height / 300])
+    pincushion = undistorted_camera(OPENCV._replace(params=np.array([300.0, 310.0, 200.0, 150.0, 0.2, 0, 0, 0])))
+    assert pincushion.width < 400 and pincushion.height < 300
+    fitted = output_camera(OPENCV, target=(100, 100))
+    assert fitted.width == 100 and fitted.height <= 100
+
+
+def test_points_round_trip_through_the_distortion_model():
+    pinhole = undistorted_camera(OPENCV)
+    xys = np.array([[20.5, 30.5], [200.0, 150.0], [390.0, 280.0]])
+    undistorted = undistort_points(OPENCV, pinhole, xys)
+    # Riproiezione con la distorsione OpenCV: si torna ai pixel originali
+    fx, fy, cx, cy = pinhole.params
+    rays = np.stack([(undistorted[:, 0] - cx) / fx, (undistorted[:, 1] - cy) / fy, np.ones(3)], axis=1)
+    matrix = np.array([[300.0, 0, 199.5], [0, 310.0, 149.5], [0, 0, 1]])
+    projected, _ = cv2.projectPoints(rays, np.zeros(3), np.zeros(3), matrix, OPENCV.params[4:])
+    assert np.allclose(projected.reshape(-1, 2) + 0.5, xys, atol=1e-4)
+
+
+def test_remap_tables_are_built_once(tmp_path):
+    pinhole = undistorted_camera(OPENCV)
+    paths = remap_tables(OPENCV, pinhole, str(tmp_path))
+    mtimes = [os.stat(path).st_mtime_ns for path in paths]
+    assert remap_tables(OPENCV, pinhole, str(tmp_path)) == paths
+    assert [os.stat(path).st_mtime_ns for path in paths] == mtimes
+    assert np.load(paths[0]).shape[:2] == (pinhole.height, pinhole.width)
+
+
+def test_undistort_model_writes_images_and_model_at_the_target(tmp_path):
+    model = tmp_path / "distorted"
+    model.mkdir()
+    (tmp_path / "input").mkdir()
+    rng = np.random.default_rng(0)
+    cv2.imwrite(str(tmp_path / "input" / "a.png"), rng.integers(0, 256, (300, 400, 3), dtype=np.uint8))
+    write_cameras_binary({1: OPENCV}, str(model / "cameras.bin"))
+    write_images_arrays(ImageArrays(
+        np.array([1]), np.array([[1.0, 0, 0, 0]]), np.zeros((1, 3)), np.array([1]), ["a.png"],
+        np.array([0, 1]), np.array([[200.0, 150.0]]), np.array([-1]),
+    ), str(model / "images.bin"))
+    write_points3D_arrays(PointArrays(
+        np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros((0, 3), dtype=np.uint8), np.zeros(0),
+        np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32),
+    ), str(model / "points3D.bin"))
+
+    report = undistort_model(str(model), str(tmp_path / "input"), str(tmp_path / "images"),
+                             str(tmp_path / "sparse"), str(tmp_path / "tables"), target=(120, 120), workers=1)
+    camera = read_cameras_binary(str(tmp_path / "sparse" / "cameras.bin"))[1]
+    assert camera.model == "PINHOLE" and camera.width == 120
+    assert report["cameras"]["1"]["width"] == 120 and report["images"] == 1
+    # Immagine ridotta prima del remap: mai più di 2x sopra l'uscita
+    assert report["cameras"]["1"]["source_size"][0] < 400
+    assert cv2.imread(str(tmp_path / "images" / "a.png")).shape[:2] == (camera.height, camera.width)
+    # Il centro ottico resta al centro ottico, riscalato
+    xy = read_images_arrays(str(tmp_path / "sparse" / "images.bin")).xys[0]
+    assert np.allclose(xy, camera.params[2:], atol=0.5)